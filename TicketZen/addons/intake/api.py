@@ -1,30 +1,114 @@
-import io
+import hashlib
+import itertools
 import logging
+import math
 import os
+import queue
+import re
+import shutil
+import tempfile
 import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
-from flask import Blueprint, current_app, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, send_file, stream_with_context
 
-from addons.intake import state
-from addons.ocr import postprocess_fr
-from addons.ocr.providers import azure_client
+from addons import metrics
+from addons.intake import batch, events, jobs, ledger, pipeline, search, state
+from addons.ocr import preprocess
 
 LOGGER = logging.getLogger("ticketzen.intake.api")
 
+RETRY_AFTER_SEC = 5
+SSE_RETRY_MS = 3000
+SSE_HEARTBEAT_SEC = 15
+SSE_STORE_CHECK_SEC = float(os.getenv("TZ_SSE_STORE_CHECK_SEC", "2"))
+# Each open stream holds a WSGI thread (or greenlet) for its whole life: keep it short, EventSource reconnects on its own.
+SSE_MAX_SEC = float(os.getenv("TZ_SSE_MAX_SEC", "60"))
+
 intake_bp = Blueprint("intake", __name__, url_prefix="/api/intake")
+batch_bp = Blueprint("batch", __name__, url_prefix="/api/batch")
+expenses_bp = Blueprint("expenses", __name__, url_prefix="/api/expenses")
+search_bp = Blueprint("search", __name__, url_prefix="/api/search")
+
+MONTH_RE = re.compile(r"^\d{4}-\d{2}$")
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 
 
 def _base_dir() -> Path:
     return Path(current_app.config.get("DATA_ROOT"))
 
 
+@intake_bp.route("", methods=["GET"])
+def history():
+    states = [value for value in request.args.get("state", "").split(",") if value] or None
+    limit = max(1, min(request.args.get("limit", 50, type=int), ledger.PAGE_MAX))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    items = state.list_intakes(_base_dir(), states=states, limit=limit + 1, offset=offset)
+    return jsonify({"ok": True, "items": items[:limit], "next_offset": offset + limit if len(items) > limit else None})
+
+
 @intake_bp.route("/<token>/status", methods=["GET"])
 def status(token: str):
     payload = state.get_status(_base_dir(), token)
     payload["ok"] = True
-    return jsonify(payload)
+    response = jsonify(payload)
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@intake_bp.route("/<token>/events", methods=["GET"])
+def status_events(token: str):
+    base_dir = _base_dir()
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    subscription = events.BUS.subscribe(token)
+
+    def generate():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            replay = events.BUS.replay(token, last_id)
+            if replay is None:
+                snapshot = state.get_status(base_dir, token)
+                yield events.format_event(snapshot.get("version"), snapshot)
+                seen = _status_key(snapshot)
+            else:
+                for event_id, payload in replay:
+                    yield events.format_event(event_id, {"ok": True, **payload})
+                seen = _status_key(replay[-1][1]) if replay else None
+            started = time.time()
+            idle = 0.0
+            while time.time() - started < SSE_MAX_SEC:
+                try:
+                    event_id, payload = subscription.get(timeout=SSE_STORE_CHECK_SEC)
+                except queue.Empty:
+                    idle += SSE_STORE_CHECK_SEC
+                    # Updates written by another process (process pool, other WSGI workers) never reach this bus.
+                    current = state.get_status(base_dir, token)
+                    if _status_key(current) != seen:
+                        seen = _status_key(current)
+                        idle = 0.0
+                        yield events.format_event(current.get("version"), current)
+                    elif idle >= SSE_HEARTBEAT_SEC:
+                        idle = 0.0
+                        yield ": heartbeat\n\n"
+                    continue
+                seen = _status_key(payload)
+                idle = 0.0
+                yield events.format_event(event_id, {"ok": True, **payload})
+        finally:
+            events.BUS.unsubscribe(token, subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+
+def _status_key(payload: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (payload.get("state"), payload.get("progress"), payload.get("error"), payload.get("result") is not None)
 
 
 @intake_bp.route("/<token>/upload", methods=["POST"])
@@ -33,13 +117,47 @@ def upload(token: str):
     file = request.files.get("file")
     if not file:
         return jsonify({"ok": False, "error": "Aucun fichier"})
-    resp = state.save_upload(_base_dir(), token, file)
+    with metrics.timer("upload_save", kind="multipart"):
+        resp = state.save_upload(_base_dir(), token, file)
     LOGGER.info("/upload token=%s duration=%.1fms", token, (time.time() - start) * 1000)
     if not resp.get("ok"):
         state.set_status(_base_dir(), token, "error", error=resp.get("error"))
     return jsonify(resp)
 
 
+@intake_bp.route("/<token>/upload/stream", methods=["POST", "PUT"])
+def upload_stream(token: str):
+    start = time.time()
+    filename = request.args.get("filename") or request.headers.get("X-Upload-Name")
+    with metrics.timer("upload_save", kind="stream"):
+        resp = state.save_stream(_base_dir(), token, request.stream, filename, request.content_length)
+    LOGGER.info("/upload/stream token=%s size=%s duration=%.1fms", token, resp.get("size"), (time.time() - start) * 1000)
+    if not resp.get("ok"):
+        state.set_status(_base_dir(), token, "error", error=resp.get("error"))
+    return jsonify(resp)
+
+
+@intake_bp.route("/<token>/upload/chunk", methods=["GET"])
+def upload_chunk_progress(token: str):
+    return jsonify(state.chunk_progress(_base_dir(), token))
+
+
+@intake_bp.route("/<token>/upload/chunk", methods=["POST", "PUT"])
+def upload_chunk(token: str):
+    try:
+        offset = int(request.headers.get("X-Upload-Offset", "0"))
+        total = int(request.headers.get("X-Upload-Total", "0"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "En-têtes d'envoi invalides"})
+    if request.content_length and request.content_length > state.CHUNK_UPLOAD_MAX_BYTES:
+        return jsonify({"ok": False, "error": "Morceau trop volumineux"})
+    with metrics.timer("upload_save", kind="chunk"):
+        resp = state.save_chunk(_base_dir(), token, request.get_data(cache=False), offset, total, request.headers.get("X-Upload-Name"))
+    if resp.get("complete"):
+        LOGGER.info("/upload/chunk token=%s size=%s complete", token, resp.get("size"))
+    return jsonify(resp)
+
+
 @intake_bp.route("/rotate", methods=["POST"])
 def rotate():
     data = request.get_json(force=True, silent=True) or {}
@@ -52,46 +170,177 @@ def rotate():
     return jsonify(resp)
 
 
+@intake_bp.route("/<token>/preview", methods=["GET"])
+def preview(token: str):
+    # Snap to a few sizes so the per-token preview cache stays bounded.
+    requested = request.args.get("size", type=int) or preprocess.PREVIEW_SIDE
+    size = next((side for side in preprocess.PREVIEW_SIZES if side >= requested), preprocess.PREVIEW_SIZES[-1])
+    resp = state.preview_image(_base_dir(), token, size)
+    if not resp.get("ok"):
+        return jsonify(resp)
+    return send_file(resp["path"], mimetype="image/jpeg", max_age=0)
+
+
+@intake_bp.route("/<token>/duplicate", methods=["POST"])
+def resolve_duplicate(token: str):
+    data = request.get_json(force=True, silent=True) or {}
+    return jsonify(pipeline.resolve_duplicate(_base_dir(), token, bool(data.get("confirm"))))
+
+
 @intake_bp.route("/<token>/analyze", methods=["POST"])
 def analyze(token: str):
     base_dir = _base_dir()
-    folder = state.ensure_dirs(base_dir, token)
-    originals = list(folder.glob("original.*"))
-    if not originals:
+    folder = state.token_dir(base_dir, token)
+    if not folder.exists() or not pipeline.find_original(folder):
         return jsonify({"ok": False, "error": "Aucun fichier"})
-    original = originals[0]
-    state.set_status(base_dir, token, "analyzing", progress=50)
-    start = time.time()
     try:
-        content = original.read_bytes()
-        content_type = "application/octet-stream"
-        if original.suffix.lower() == ".pdf":
-            content_type = "application/pdf"
-        elif original.suffix.lower() in {".png"}:
-            content_type = "image/png"
-        elif original.suffix.lower() in {".jpg", ".jpeg"}:
-            content_type = "image/jpeg"
-        ocr_result = azure_client.analyze_document(content, content_type, config=_azure_config(), logger=LOGGER)
-        processed = postprocess_fr.normalize_result(ocr_result)
-        result_path = folder / "result.json"
-        result_path.write_text(postprocess_fr.dump_json(processed))
-        payload = state.set_status(base_dir, token, "done", progress=100, result=processed)
-        LOGGER.info("/analyze token=%s duration=%.1fms", token, (time.time() - start) * 1000)
-        return jsonify({"ok": True, **payload})
-    except Exception as exc:  # pragma: no cover - defensive
-        LOGGER.exception("Analyze failed: %s", exc)
-        payload = state.set_status(base_dir, token, "error", error=str(exc))
-        return jsonify({"ok": False, **payload})
-
-
-def _azure_config() -> Dict[str, Any]:
-    return {
-        "endpoint": os.getenv("AZURE_DI_ENDPOINT", ""),
-        "key": os.getenv("AZURE_DI_KEY", ""),
-        "route": os.getenv("AZURE_DI_ROUTE", "formrecognizer_v21"),
-        "api_version": os.getenv("AZURE_DI_API_VERSION", "v2.1"),
-        "timeout": int(os.getenv("AZURE_DI_TIMEOUT_SEC", "90")),
-        "dry_run": bool(int(os.getenv("OCR_DRY_RUN", "0"))),
-        "cloud_enabled": bool(int(os.getenv("TICKETZEN_OCR_CLOUD_ENABLED", "1"))),
-        "vendor": os.getenv("TICKETZEN_OCR_CLOUD_VENDOR", "azure"),
-    }
+        config = pipeline.ocr_config()
+        if request.args.get("nocache") == "1":
+            config["use_cache"] = False
+        if request.args.get("force") == "1":
+            config["dedupe"] = False
+        payload = jobs.init_queue(base_dir).submit(token, config)
+    except jobs.QueueFull as exc:
+        LOGGER.warning("/analyze token=%s rejected: queue full", token)
+        metrics.incr("queue_rejections")
+        response = jsonify({"ok": False, "error": str(exc), "retry_after": RETRY_AFTER_SEC})
+        response.headers["Retry-After"] = str(RETRY_AFTER_SEC)
+        return response
+    return jsonify({"ok": True, **payload})
+
+
+def _batch_stream(base_dir: Path, batch_id: str, retry_failed: bool = True):
+    concurrency = request.args.get("concurrency", type=int)
+    events_iter = batch.run_batch(base_dir, batch_id, concurrency=concurrency, retry_failed=retry_failed)
+    try:
+        first = next(events_iter)
+    except batch.BatchRejected as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    body = stream_with_context(batch.ndjson(itertools.chain([first], events_iter)))
+    return Response(body, mimetype="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@batch_bp.route("", methods=["POST"])
+def batch_create():
+    base_dir = _base_dir()
+    upload = request.files.get("file")
+    try:
+        if upload:
+            manifest = batch.create_batch(base_dir, upload.stream)
+        else:
+            with tempfile.TemporaryFile() as spool:
+                shutil.copyfileobj(request.stream, spool, state.CHUNK_SIZE)
+                spool.seek(0)
+                manifest = batch.create_batch(base_dir, spool)
+    except batch.BatchRejected as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    LOGGER.info("/batch created id=%s items=%d", manifest["batch_id"], len(manifest["items"]))
+    if request.args.get("run", "1") != "1":
+        return jsonify({"ok": True, "batch_id": manifest["batch_id"], "total": len(manifest["items"]), "rejected": manifest["rejected"]})
+    return _batch_stream(base_dir, manifest["batch_id"])
+
+
+@batch_bp.route("/<batch_id>", methods=["GET"])
+def batch_status(batch_id: str):
+    try:
+        summary = batch.batch_summary(_base_dir(), batch_id)
+    except batch.BatchRejected as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    if summary is None:
+        return jsonify({"ok": False, "error": "Lot introuvable"})
+    return jsonify({"ok": True, **summary})
+
+
+@batch_bp.route("/<batch_id>/run", methods=["POST"])
+def batch_run(batch_id: str):
+    return _batch_stream(_base_dir(), batch_id, retry_failed=request.args.get("retry_failed", "1") == "1")
+
+
+def _month_arg() -> Optional[str]:
+    month = request.args.get("month") or None
+    if month is not None and not MONTH_RE.match(month):
+        raise ledger.LedgerError("Mois invalide (AAAA-MM attendu)")
+    return month
+
+
+@expenses_bp.route("", methods=["GET"])
+def expenses_list():
+    try:
+        page = ledger.get_ledger(_base_dir()).expenses(
+            month=_month_arg(),
+            category=request.args.get("category"),
+            merchant=request.args.get("merchant"),
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", 50, type=int),
+        )
+    except ledger.LedgerError as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    return jsonify({"ok": True, **page})
+
+
+@expenses_bp.route("/rollups", methods=["GET"])
+def expenses_rollups():
+    dim = request.args.get("dim", "month")
+    try:
+        month = _month_arg()
+        book = ledger.get_ledger(_base_dir())
+        buckets = book.rollup(dim, month=month, limit=request.args.get("limit", 100, type=int), offset=max(0, request.args.get("offset", 0, type=int)))
+    except ledger.LedgerError as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    return jsonify({"ok": True, "dim": dim, "month": month, "summary": book.summary(month), "buckets": buckets})
+
+
+@expenses_bp.route("/ledger", methods=["GET"])
+def expenses_ledger():
+    try:
+        page = ledger.get_ledger(_base_dir()).entries(source=request.args.get("source"), cursor=request.args.get("cursor"), limit=request.args.get("limit", 50, type=int))
+    except ledger.LedgerError as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    return jsonify({"ok": True, **page})
+
+
+@expenses_bp.route("/<int:entry_id>/reverse", methods=["POST"])
+def expenses_reverse(entry_id: int):
+    if not ledger.get_ledger(_base_dir()).reverse(entry_id):
+        return jsonify({"ok": False, "error": "Dépense introuvable ou déjà annulée"})
+    return jsonify({"ok": True, "reversed": entry_id})
+
+
+def _date_arg(name: str) -> Optional[str]:
+    value = request.args.get(name) or None
+    if value is not None and not DATE_RE.match(value):
+        raise search.SearchError(f"Date invalide pour {name} (AAAA-MM-JJ attendu)")
+    return value
+
+
+def _amount_arg(name: str) -> Optional[float]:
+    value = request.args.get(name) or None
+    if value is None:
+        return None
+    try:
+        amount = float(value)
+    except ValueError:
+        amount = math.nan
+    if not math.isfinite(amount) or abs(amount) > search.MAX_CENTS / 100:
+        raise search.SearchError(f"Montant invalide pour {name}")
+    return amount
+
+
+@search_bp.route("", methods=["GET"])
+def search_receipts():
+    try:
+        results = search.get_index(_base_dir()).search(
+            request.args.get("q", ""),
+            date_from=_date_arg("date_from"),
+            date_to=_date_arg("date_to"),
+            total_min=_amount_arg("total_min"),
+            total_max=_amount_arg("total_max"),
+            category=request.args.get("category") or None,
+            limit=request.args.get("limit", 20, type=int),
+            offset=max(0, request.args.get("offset", 0, type=int)),
+            fuzzy=request.args.get("fuzzy", "1") != "0",
+            sort=request.args.get("sort", "relevance"),
+        )
+    except search.SearchError as exc:
+        return jsonify({"ok": False, "error": str(exc)})
+    return jsonify({"ok": True, **results})
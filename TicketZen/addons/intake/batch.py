@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from addons.intake import ledger, pipeline, search, state
+from addons.ocr import postprocess_fr
+
+LOGGER = logging.getLogger("ticketzen.intake.batch")
+
+BATCH_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_RUNNING: Set[str] = set()
+_RUNNING_LOCK = threading.Lock()
+
+
+class BatchRejected(Exception):
+    pass
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def batch_config() -> Dict[str, Any]:
+    return {
+        "concurrency": max(1, int(_env_float("TZ_BATCH_CONCURRENCY", 4))),
+        "rate": _env_float("TZ_BATCH_RATE_PER_SEC", 8),
+        "burst": max(1, int(_env_float("TZ_BATCH_BURST", 4))),
+        "max_items": int(_env_float("TZ_BATCH_MAX_ITEMS", 500)),
+        "max_bytes": int(_env_float("TZ_BATCH_MAX_MB", 500) * 1024 * 1024),
+    }
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def batch_dir(base_dir: Path, batch_id: str) -> Path:
+    if not BATCH_ID_RE.match(batch_id or ""):
+        raise BatchRejected("Identifiant de lot invalide")
+    return Path(base_dir) / "batches" / batch_id
+
+
+def _manifest_path(folder: Path) -> Path:
+    return folder / "batch.json"
+
+
+def _results_path(folder: Path) -> Path:
+    return folder / "results.jsonl"
+
+
+def _add_item(folder: Path, items: List[Dict[str, Any]], name: str, handle: BinaryIO, limits: Dict[str, Any], budget: List[int]) -> Optional[Dict[str, Any]]:
+    suffix, error = state.check_file(name)
+    if error:
+        return {"name": name, "error": error}
+    index = len(items)
+    item_folder = folder / "items" / f"{index:05d}"
+    item_folder.mkdir(parents=True, exist_ok=True)
+    dest = item_folder / f"original{suffix}"
+    digest = hashlib.sha256()
+    size = 0
+    with dest.open("wb") as out:
+        while True:
+            chunk = handle.read(state.CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0:
+                error = state.check_file(name, chunk)[1]
+                if error:
+                    break
+            size += len(chunk)
+            budget[0] -= len(chunk)
+            if size > limits["max_bytes"]:
+                error = "Fichier trop volumineux"
+                break
+            if budget[0] < 0:
+                raise BatchRejected("Lot trop volumineux")
+            digest.update(chunk)
+            out.write(chunk)
+    if not error and size == 0:
+        error = "Fichier vide"
+    if error:
+        shutil.rmtree(item_folder, ignore_errors=True)
+        return {"name": name, "error": error}
+    items.append({"index": index, "name": name, "path": str(dest.relative_to(folder)), "size": size, "sha256": digest.hexdigest()})
+    return None
+
+
+def _sources(source: Any) -> Iterator[Tuple[str, BinaryIO]]:
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        for path in sorted(p for p in Path(source).rglob("*") if p.is_file()):
+            with path.open("rb") as handle:
+                yield str(path.relative_to(source)), handle
+        return
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise BatchRejected("Archive zip invalide")
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or Path(info.filename).name.startswith((".", "__MACOSX")) or "__MACOSX" in info.filename:
+                continue
+            with archive.open(info) as handle:
+                yield info.filename, handle
+
+
+def create_batch(base_dir: Path, source: Any, batch_id: Optional[str] = None) -> Dict[str, Any]:
+    config = batch_config()
+    limits = state.upload_limits()
+    batch_id = batch_id or secrets.token_hex(6)
+    folder = batch_dir(base_dir, batch_id)
+    if _manifest_path(folder).exists():
+        raise BatchRejected("Ce lot existe déjà")
+    folder.mkdir(parents=True, exist_ok=True)
+    items: List[Dict[str, Any]] = []
+    rejected: List[Dict[str, Any]] = []
+    budget = [config["max_bytes"]]
+    try:
+        for name, handle in _sources(source):
+            if len(items) >= config["max_items"]:
+                raise BatchRejected(f"Lot limité à {config['max_items']} fichiers")
+            problem = _add_item(folder, items, name, handle, limits, budget)
+            if problem:
+                rejected.append(problem)
+    except BatchRejected:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    if not items:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise BatchRejected("Aucun fichier exploitable dans le lot")
+    manifest = {"batch_id": batch_id, "created_at": time.time(), "items": items, "rejected": rejected}
+    _manifest_path(folder).write_text(json.dumps(manifest, ensure_ascii=False, indent=2))
+    LOGGER.info("Batch %s created with %d items (%d rejected)", batch_id, len(items), len(rejected))
+    return manifest
+
+
+def load_manifest(base_dir: Path, batch_id: str) -> Optional[Dict[str, Any]]:
+    path = _manifest_path(batch_dir(base_dir, batch_id))
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def load_results(base_dir: Path, batch_id: str) -> Dict[int, Dict[str, Any]]:
+    path = _results_path(batch_dir(base_dir, batch_id))
+    results: Dict[int, Dict[str, Any]] = {}
+    if not path.exists():
+        return results
+    for line in path.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A crash can leave the last line truncated; that item is simply rerun.
+            continue
+        results[record["index"]] = record
+    return results
+
+
+def batch_summary(base_dir: Path, batch_id: str) -> Optional[Dict[str, Any]]:
+    manifest = load_manifest(base_dir, batch_id)
+    if manifest is None:
+        return None
+    results = load_results(base_dir, batch_id)
+    done = sum(1 for record in results.values() if record.get("ok"))
+    failed = sum(1 for record in results.values() if not record.get("ok"))
+    total = len(manifest["items"])
+    return {"batch_id": batch_id, "total": total, "done": done, "failed": failed, "remaining": total - done - failed, "rejected": manifest.get("rejected", [])}
+
+
+def _analyze_item(base_dir: Path, folder: Path, item: Dict[str, Any], config: Dict[str, Any], limiter: RateLimiter) -> Dict[str, Any]:
+    start = time.time()
+    original = folder / item["path"]
+    record: Dict[str, Any] = {"index": item["index"], "name": item["name"], "sha256": item["sha256"]}
+    try:
+        processed = pipeline.analyze_file(base_dir, original, config, limiter=limiter)
+        tags = processed.get("tags") or []
+        if "azure_all_failed" in tags:
+            raise RuntimeError("OCR indisponible")
+        (original.parent / "result.json").write_text(postprocess_fr.dump_json(processed))
+        source = f"batch:{folder.name}:{item['index']}"
+        ledger.record_result(base_dir, source, processed)
+        search.index_result(base_dir, source, processed)
+        record.update({"ok": True, "result": processed, "cached": "ocr_cache=hit" in tags})
+    except Exception as exc:
+        LOGGER.warning("Batch item %s failed: %s", item["name"], exc)
+        record.update({"ok": False, "error": str(exc)})
+    record["duration_ms"] = round((time.time() - start) * 1000, 1)
+    return record
+
+
+def run_batch(base_dir: Path, batch_id: str, config: Optional[Dict[str, Any]] = None, concurrency: Optional[int] = None, rate: Optional[float] = None, retry_failed: bool = True) -> Iterator[Dict[str, Any]]:
+    settings = batch_config()
+    concurrency = max(1, concurrency or settings["concurrency"])
+    limiter = RateLimiter(settings["rate"] if rate is None else rate, settings["burst"])
+    config = config or pipeline.ocr_config()
+    folder = batch_dir(base_dir, batch_id)
+    manifest = load_manifest(base_dir, batch_id)
+    if manifest is None:
+        raise BatchRejected("Lot introuvable")
+    with _RUNNING_LOCK:
+        if str(folder) in _RUNNING:
+            raise BatchRejected("Ce lot est déjà en cours d'analyse")
+        _RUNNING.add(str(folder))
+    try:
+        yield from _run(base_dir, batch_id, folder, manifest, config, concurrency, limiter, retry_failed)
+    finally:
+        with _RUNNING_LOCK:
+            _RUNNING.discard(str(folder))
+
+
+def _run(base_dir: Path, batch_id: str, folder: Path, manifest: Dict[str, Any], config: Dict[str, Any], concurrency: int, limiter: RateLimiter, retry_failed: bool) -> Iterator[Dict[str, Any]]:
+    previous = load_results(base_dir, batch_id)
+    total = len(manifest["items"])
+    started = time.time()
+    counts = {"ok": 0, "failed": 0, "resumed": 0}
+    pending: List[Dict[str, Any]] = []
+    yield {"type": "batch", "batch_id": batch_id, "total": total, "rejected": manifest.get("rejected", [])}
+    for item in manifest["items"]:
+        record = previous.get(item["index"])
+        if record and record.get("sha256") == item["sha256"] and (record.get("ok") or not retry_failed):
+            counts["resumed"] += 1
+            counts["ok" if record.get("ok") else "failed"] += 1
+            yield {"type": "item", "resumed": True, "progress": counts["ok"] + counts["failed"], "total": total, **record}
+        else:
+            pending.append(item)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"tz-batch-{batch_id}")
+    items = iter(pending)
+    in_flight = set()
+    try:
+        for item in items:
+            in_flight.add(executor.submit(_analyze_item, base_dir, folder, item, config, limiter))
+            if len(in_flight) >= concurrency * 2:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            records = [future.result() for future in done]
+            # Persist before yielding: a disconnect at the yield must not lose finished work.
+            with _results_path(folder).open("a") as handle:
+                for record in records:
+                    handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for record in records:
+                item = next(items, None)
+                if item is not None:
+                    in_flight.add(executor.submit(_analyze_item, base_dir, folder, item, config, limiter))
+            for record in records:
+                counts["ok" if record["ok"] else "failed"] += 1
+                yield {"type": "item", "progress": counts["ok"] + counts["failed"], "total": total, **record}
+    finally:
+        # Client gone or generator closed: drop queued items, the manifest lets the batch resume later.
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False)
+    yield {"type": "summary", "batch_id": batch_id, "total": total, **counts, "duration_ms": round((time.time() - started) * 1000, 1)}
+
+
+def ndjson(events: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for event in events:
+        yield json.dumps(event, ensure_ascii=False) + "\n"
@@ -0,0 +1,266 @@
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger("ticketzen.intake.dedupe")
+
+HASH_SIDE = 8
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".heic"}
+CANDIDATES_MAX = 5
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def dedupe_config() -> Dict[str, Any]:
+    return {
+        "enabled": os.getenv("TZ_DEDUPE_ENABLED", "1") != "0",
+        "max_distance": max(0, min(_env_int("TZ_DEDUPE_MAX_DISTANCE", 6), 15)),
+        "reuse_distance": max(-1, _env_int("TZ_DEDUPE_REUSE_DISTANCE", -1)),
+    }
+
+
+def image_hash(path: Path) -> int:
+    # dHash: sign of the horizontal gradient on a 9x8 grayscale thumbnail, 64 bits.
+    from PIL import Image, ImageOps
+
+    img = Image.open(path)
+    if img.format == "JPEG":
+        img.draft("L", (HASH_SIDE * 8, HASH_SIDE * 8))
+    img = ImageOps.exif_transpose(img).convert("L").resize((HASH_SIDE + 1, HASH_SIDE), Image.BOX)
+    pixels = img.tobytes()
+    value = 0
+    for row in range(HASH_SIDE):
+        offset = row * (HASH_SIDE + 1)
+        for col in range(HASH_SIDE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _to_sql(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _from_sql(value: int) -> int:
+    return value & ((1 << 64) - 1)
+
+
+def _flip_masks(radius: int) -> List[int]:
+    return [sum(1 << bit for bit in bits) for flips in range(radius + 1) for bits in combinations(range(CHUNK_BITS), flips)]
+
+
+class HashIndex:
+    # Multi-index hashing: two hashes within distance d agree on at least one of the four 16-bit chunks
+    # up to d // 4 bits, so a lookup probes each chunk table around the query chunk and only checks
+    # what it finds there instead of the whole collection.
+    def __init__(self):
+        self.rowids = array("q")
+        self.hashes = array("Q")
+        self.alive = bytearray()
+        self.tables: List[Dict[int, array]] = [{} for _ in range(CHUNKS)]
+        self.last_id = 0
+        self._masks: Dict[int, List[int]] = {}
+
+    def __len__(self) -> int:
+        return self.alive.count(1)
+
+    def add(self, rowid: int, value: int):
+        slot = len(self.rowids)
+        self.rowids.append(rowid)
+        self.hashes.append(value)
+        self.alive.append(1)
+        for idx, table in enumerate(self.tables):
+            chunk = (value >> (idx * CHUNK_BITS)) & CHUNK_MASK
+            slots = table.get(chunk)
+            if slots is None:
+                table[chunk] = array("I", (slot,))
+            else:
+                slots.append(slot)
+
+    def remove(self, rowid: int):
+        slot = bisect.bisect_left(self.rowids, rowid)
+        if slot < len(self.rowids) and self.rowids[slot] == rowid:
+            self.alive[slot] = 0
+
+    def lookup(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        radius = max_distance // CHUNKS
+        masks = self._masks.get(radius)
+        if masks is None:
+            masks = self._masks[radius] = _flip_masks(radius)
+        hashes, alive = self.hashes, self.alive
+        found: Dict[int, int] = {}
+        for idx, table in enumerate(self.tables):
+            chunk = (value >> (idx * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                slots = table.get(chunk ^ mask)
+                if slots is None:
+                    continue
+                for slot in slots:
+                    distance = (hashes[slot] ^ value).bit_count()
+                    if distance <= max_distance and alive[slot]:
+                        found[slot] = distance
+        return sorted((distance, self.rowids[slot]) for slot, distance in found.items())
+
+
+class DuplicateIndex:
+    # Append-only log: a new hash for a source points at the row it replaces, a removal is a row without hash.
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS phashes (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        hash INTEGER,
+        replaces INTEGER,
+        added_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_phashes_source ON phashes (source, id);
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._index = HashIndex()
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _sync(self):
+        # Rows are only appended, so catching up with other workers is one range scan on the primary key.
+        index = self._index
+        rows = self._conn().execute("SELECT id, hash, replaces FROM phashes WHERE id > ? ORDER BY id", (index.last_id,)).fetchall()
+        for rowid, value, replaces in rows:
+            if replaces is not None:
+                index.remove(replaces)
+            if value is not None:
+                index.add(rowid, _from_sql(value))
+            index.last_id = rowid
+
+    def _append(self, source: str, value: Optional[int]) -> Optional[int]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = conn.execute("SELECT id, hash FROM phashes WHERE source = ? ORDER BY id DESC LIMIT 1", (source,)).fetchone()
+            replaces = previous[0] if previous and previous[1] is not None else None
+            if value is None and replaces is None:
+                conn.execute("COMMIT")
+                return None
+            rowid = conn.execute(
+                "INSERT INTO phashes (source, hash, replaces, added_at) VALUES (?, ?, ?, ?)",
+                (source, None if value is None else _to_sql(value), replaces, time.time()),
+            ).lastrowid
+            conn.execute("COMMIT")
+            return rowid
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add(self, source: str, value: int) -> Optional[int]:
+        return self._append(source, value)
+
+    def remove(self, source: str) -> bool:
+        return self._append(source, None) is not None
+
+    def lookup(self, value: int, max_distance: int, exclude: Optional[str] = None, limit: int = CANDIDATES_MAX) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            matches = self._index.lookup(value, max_distance)
+        if not matches:
+            return []
+        distances = {rowid: distance for distance, rowid in matches[: limit + 1]}
+        marks = ",".join("?" * len(distances))
+        rows = self._conn().execute(f"SELECT id, source FROM phashes WHERE id IN ({marks})", tuple(distances)).fetchall()
+        found = sorted(({"source": source, "distance": distances[rowid]} for rowid, source in rows if source != exclude), key=lambda item: item["distance"])
+        return found[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return {"entries": len(self._index), "last_id": self._index.last_id}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_INDEXES: Dict[str, DuplicateIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(base_dir: Path) -> DuplicateIndex:
+    key = str(base_dir)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = DuplicateIndex(Path(base_dir) / "dedupe.sqlite")
+    return index
+
+
+def register_upload(base_dir: Path, source: str, path: Path) -> Dict[str, Any]:
+    config = dedupe_config()
+    if not config["enabled"] or path.suffix.lower() not in IMAGE_SUFFIXES:
+        return {}
+    try:
+        value = image_hash(path)
+        index = get_index(base_dir)
+        candidates = index.lookup(value, config["max_distance"], exclude=source)
+        index.add(source, value)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Perceptual hash failed source=%s: %s", source, exc)
+        return {}
+    if candidates:
+        LOGGER.info("Possible duplicate source=%s of %s (distance %d)", source, candidates[0]["source"], candidates[0]["distance"])
+    return {"phash": f"{value:016x}", "duplicate_of": candidates}
+
+
+def forget(base_dir: Path, source: str):
+    if not dedupe_config()["enabled"]:
+        return
+    try:
+        get_index(base_dir).remove(source)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Perceptual hash removal failed source=%s: %s", source, exc)
+
+
+def _key(result: Dict[str, Any]) -> Optional[Tuple[str, str, int]]:
+    merchant, day = result.get("merchant"), result.get("date")
+    try:
+        cents = int(round(float(result.get("total")) * 100))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if not merchant or not day:
+        return None
+    return str(merchant).casefold(), str(day), cents
+
+
+def same_receipt(result: Dict[str, Any], other: Dict[str, Any]) -> bool:
+    # Second stage: a look-alike photo only counts as a duplicate if merchant, date and total all agree.
+    key = _key(result)
+    return key is not None and key == _key(other)
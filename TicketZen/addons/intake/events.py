@@ -0,0 +1,81 @@
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+LOGGER = logging.getLogger("ticketzen.intake.events")
+
+Event = Tuple[int, Dict[str, Any]]
+
+
+class EventBus:
+    def __init__(self, history: int = 20, max_tokens: int = 2000, subscriber_queue: int = 100):
+        self.history = history
+        self.max_tokens = max_tokens
+        self.subscriber_queue = subscriber_queue
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set["queue.Queue[Event]"]] = {}
+        self._recent: "OrderedDict[str, Deque[Event]]" = OrderedDict()
+
+    def publish(self, token: str, payload: Dict[str, Any]) -> Optional[int]:
+        # Event ids are the store's status version, so they mean the same thing in every worker.
+        event_id = payload.get("version")
+        with self._lock:
+            if event_id is not None:
+                recent = self._recent.pop(token, None) or deque(maxlen=self.history)
+                recent.append((event_id, payload))
+                self._recent[token] = recent
+                while len(self._recent) > self.max_tokens:
+                    self._recent.popitem(last=False)
+            subscribers = list(self._subscribers.get(token, ()))
+        for sub in subscribers:
+            try:
+                sub.put_nowait((event_id, payload))
+            except queue.Full:
+                LOGGER.warning("Dropping event for slow subscriber token=%s", token)
+        return event_id
+
+    def subscribe(self, token: str) -> "queue.Queue[Event]":
+        sub: "queue.Queue[Event]" = queue.Queue(maxsize=self.subscriber_queue)
+        with self._lock:
+            self._subscribers.setdefault(token, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, token: str, sub: "queue.Queue[Event]"):
+        with self._lock:
+            subs = self._subscribers.get(token)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    self._subscribers.pop(token, None)
+
+    def replay(self, token: str, last_id: Optional[int]) -> Optional[List[Event]]:
+        if last_id is None:
+            return None
+        with self._lock:
+            recent = list(self._recent.get(token, ()))
+        missed = [event for event in recent if event[0] > last_id]
+        # Replay only an unbroken run of versions: a gap means an evicted event or a write made by another process.
+        if [event_id for event_id, _ in missed] != list(range(last_id + 1, last_id + 1 + len(missed))):
+            return None
+        if not missed and (not recent or recent[-1][0] != last_id):
+            return None
+        return missed
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+def format_event(event_id: Optional[int], payload: Dict[str, Any], event: str = "status") -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+BUS = EventBus()
+
+
+def publish(token: str, payload: Dict[str, Any]) -> Optional[int]:
+    return BUS.publish(token, payload)
@@ -0,0 +1,287 @@
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from addons import metrics
+from addons.intake import pipeline, state
+
+LOGGER = logging.getLogger("ticketzen.intake.jobs")
+
+RECOVERABLE_STATES = {"queued", "analyzing"}
+INTERRUPTED_STATE = "interrupted"
+ACCEPTING_STATES = {"pending", "uploaded", "done", "error", INTERRUPTED_STATE}
+CLAIM_STATES = ("queued",)
+PROCESS_GRACE_SEC = 5
+EXPIRE_EVERY_SEC = 3600
+HOSTNAME = socket.gethostname()
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    host, _, pid = (owner or "").rpartition(":")
+    if host != HOSTNAME or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _run_in_child(base_dir: Path, token: str, config: Dict[str, Any], deadline: float, claim_from) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # Metrics recorded in a pool process would stay there: send them back with the result.
+    result = pipeline.run_analysis(base_dir, token, config, deadline, claim_from)
+    return result, metrics.METRICS.drain()
+
+
+class AnalysisQueue:
+    def __init__(self, base_dir: Path, workers: int = 4, max_depth: int = 32, job_timeout: int = 120, mode: str = "thread", lease_sec: int = 30, expire_days: float = 7):
+        self.base_dir = Path(base_dir)
+        self.workers = max(1, workers)
+        self.max_depth = max(1, max_depth)
+        self.job_timeout = max(1, job_timeout)
+        self.mode = mode if mode in {"thread", "process"} else "thread"
+        self.lease_sec = max(3, lease_sec)
+        self.expire_days = expire_days
+        self.owner = f"{HOSTNAME}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._running = 0
+        self._counters = {"completed": 0, "failed": 0, "rejected": 0, "timeouts": 0, "recovered": 0}
+
+    def start(self):
+        if self._threads:
+            return
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"tz-ocr-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="tz-ocr-lease", daemon=True)
+        self._heartbeat_thread.start()
+        LOGGER.info("OCR queue started mode=%s workers=%d max_depth=%d", self.mode, self.workers, self.max_depth)
+
+    def _lease(self) -> Dict[str, Any]:
+        return {"owner": self.owner, "lease_until": time.time() + self.lease_sec}
+
+    def _orphaned(self, lease: Optional[Dict[str, Any]]) -> bool:
+        # A queued/analyzing row whose worker died, or stopped renewing its lease, is nobody's.
+        if not lease or lease["state"] not in RECOVERABLE_STATES or lease["owner"] == self.owner:
+            return False
+        lease_until = lease["lease_until"] or lease["updated_at"] + self.lease_sec
+        return lease_until < time.time() or not _owner_alive(lease["owner"])
+
+    def submit(self, token: str, config: Dict[str, Any], recovering: bool = False) -> Dict[str, Any]:
+        payload = self._claim(token, config, recovering)
+        if payload is None:
+            return {**state.get_status(self.base_dir, token), "depth": self._jobs.qsize()}
+        return payload
+
+    def _claim(self, token: str, config: Dict[str, Any], recovering: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if token in self._pending:
+                return None
+            if self._jobs.qsize() >= self.max_depth:
+                self._counters["rejected"] += 1
+                raise QueueFull("File d'analyse saturée, réessayez dans quelques secondes")
+            expected, version = ({INTERRUPTED_STATE} if recovering else ACCEPTING_STATES), None
+            lease = state.get_lease(self.base_dir, token)
+            if self._orphaned(lease):
+                # Compare-and-set on the version: of several workers reclaiming the row, one wins.
+                expected, version = RECOVERABLE_STATES, lease["version"]
+            payload = state.transition(self.base_dir, token, expected, "queued", progress=30, version=version, lease=self._lease())
+            if payload is None:
+                return None
+            self._pending.add(token)
+            self._jobs.put((token, config))
+            depth = self._jobs.qsize()
+        return {**payload, "depth": depth}
+
+    def recover(self) -> int:
+        # Claims interrupted rows and queued/analyzing rows whose owner is gone; live siblings keep theirs.
+        recovered = 0
+        for row in state.list_intakes(self.base_dir, states=RECOVERABLE_STATES | {INTERRUPTED_STATE}, limit=10000):
+            token = row["token"]
+            lease = state.get_lease(self.base_dir, token) if row["state"] in RECOVERABLE_STATES else None
+            if row["state"] in RECOVERABLE_STATES and (token in self._pending or not self._orphaned(lease)):
+                continue
+            if not pipeline.find_original(state.token_dir(self.base_dir, token)):
+                state.transition(self.base_dir, token, {row["state"]}, "error", error="Aucun fichier", version=lease["version"] if lease else None)
+                continue
+            try:
+                if self._claim(token, pipeline.ocr_config(), recovering=True) is not None:
+                    recovered += 1
+            except QueueFull:
+                # Left as is: the next sweep, here or in a sibling, picks it up.
+                break
+        if recovered:
+            LOGGER.info("Recovered %d interrupted analyses", recovered)
+            with self._lock:
+                self._counters["recovered"] += recovered
+        return recovered
+
+    def _execute(self, token: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        deadline = time.time() + self.job_timeout
+        if self._executor is None:
+            return pipeline.run_analysis(self.base_dir, token, config, deadline=deadline, claim_from=CLAIM_STATES)
+        future = self._executor.submit(_run_in_child, self.base_dir, token, config, deadline, CLAIM_STATES)
+        try:
+            result, recorded = future.result(timeout=self.job_timeout + PROCESS_GRACE_SEC)
+            metrics.METRICS.merge(recorded)
+            return result
+        except FutureTimeout:
+            # The child keeps running; its final write is a transition from analyzing, so this error stands.
+            future.cancel()
+            payload = state.transition(self.base_dir, token, RECOVERABLE_STATES, "error", error="Délai d'analyse dépassé") or state.get_status(self.base_dir, token)
+            return {"ok": False, "timeout": True, **payload}
+
+    def _worker(self):
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                self._jobs.task_done()
+                return
+            token, config = item
+            with self._lock:
+                self._running += 1
+            result: Dict[str, Any] = {"ok": False}
+            try:
+                result = self._execute(token, config)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.exception("OCR job failed token=%s: %s", token, exc)
+                state.set_status(self.base_dir, token, "error", error=str(exc))
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending.discard(token)
+                    if result.get("ok"):
+                        self._counters["completed"] += 1
+                    else:
+                        self._counters["failed"] += 1
+                        if result.get("timeout"):
+                            self._counters["timeouts"] += 1
+                self._jobs.task_done()
+
+    def _heartbeat(self):
+        last_sweep = time.time()
+        last_expiry = 0.0
+        while not self._stop.wait(self.lease_sec / 3):
+            try:
+                with self._lock:
+                    tokens = list(self._pending)
+                if tokens:
+                    state.renew_leases(self.base_dir, self.owner, tokens, time.time() + self.lease_sec)
+                if time.time() - last_sweep >= self.lease_sec:
+                    last_sweep = time.time()
+                    self.recover()
+                if self.expire_days > 0 and time.time() - last_expiry >= EXPIRE_EVERY_SEC:
+                    last_expiry = time.time()
+                    expired = state.expire_intakes(self.base_dir, self.expire_days * 86400)
+                    if expired:
+                        LOGGER.info("Expired %d abandoned intakes", expired)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.warning("OCR lease heartbeat failed: %s", exc)
+
+    def release(self) -> int:
+        # Hands what this worker still holds to its siblings right away instead of after the lease expires.
+        with self._lock:
+            tokens = list(self._pending)
+        released = 0
+        for token in tokens:
+            if state.transition(self.base_dir, token, RECOVERABLE_STATES, INTERRUPTED_STATE) is not None:
+                released += 1
+        if released:
+            LOGGER.info("Released %d unfinished analyses", released)
+        return released
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_depth": self.max_depth,
+                "depth": self._jobs.qsize(),
+                "running": self._running,
+                **self._counters,
+            }
+
+    def shutdown(self, drain: bool = True, timeout: Optional[float] = None):
+        if drain:
+            deadline = time.time() + timeout if timeout else None
+            while self._pending and (deadline is None or time.time() < deadline):
+                time.sleep(0.1)
+        self._stop.set()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=drain, cancel_futures=not drain)
+            self._executor = None
+
+
+_QUEUE: Optional[AnalysisQueue] = None
+_QUEUE_PID = 0
+_QUEUE_LOCK = threading.Lock()
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def release_orphans(base_dir: Path) -> int:
+    # Must run while no queue is live (gunicorn master before fork, or a single-process server):
+    # every queued/analyzing row is then left over from a previous run.
+    released = 0
+    for row in state.list_intakes(base_dir, states=RECOVERABLE_STATES, limit=10000):
+        if state.transition(base_dir, row["token"], RECOVERABLE_STATES, INTERRUPTED_STATE, progress=row.get("progress")) is not None:
+            released += 1
+    if released:
+        LOGGER.info("Marked %d interrupted analyses for recovery", released)
+    return released
+
+
+def init_queue(base_dir: Path, release: bool = False) -> AnalysisQueue:
+    global _QUEUE, _QUEUE_PID
+    with _QUEUE_LOCK:
+        # A forked worker inherits the parent's queue object but none of its threads: build its own.
+        if _QUEUE is None or _QUEUE_PID != os.getpid():
+            _QUEUE_PID = os.getpid()
+            if release:
+                release_orphans(base_dir)
+            _QUEUE = AnalysisQueue(
+                base_dir,
+                workers=_env_int("TZ_OCR_WORKERS", 4),
+                max_depth=_env_int("TZ_OCR_QUEUE_MAX", 32),
+                job_timeout=_env_int("TZ_OCR_JOB_TIMEOUT_SEC", 120),
+                mode=os.getenv("TZ_OCR_POOL", "thread"),
+                lease_sec=_env_int("TZ_OCR_LEASE_SEC", 30),
+                expire_days=_env_int("TZ_INTAKE_EXPIRE_DAYS", 7),
+            )
+            _QUEUE.start()
+            _QUEUE.recover()
+        return _QUEUE
+
+
+def get_queue() -> Optional[AnalysisQueue]:
+    return _QUEUE if _QUEUE_PID == os.getpid() else None
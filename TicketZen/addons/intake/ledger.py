@@ -0,0 +1,374 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LOGGER = logging.getLogger("ticketzen.intake.ledger")
+
+DIMENSIONS = ("month", "category", "merchant")
+SIGNATURE = ("merchant", "category", "date", "total_cents")
+PAGE_MAX = 200
+MAX_CENTS = 10 ** 15
+
+
+class LedgerError(Exception):
+    pass
+
+
+def ledger_enabled() -> bool:
+    return os.getenv("TZ_LEDGER_ENABLED", "1") != "0"
+
+
+def _cents(total: Any) -> Optional[int]:
+    try:
+        cents = int(round(float(total) * 100))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    # inf/nan are rejected above; absurd amounts would overflow SQLite integers (or their sums).
+    return cents if abs(cents) <= MAX_CENTS else None
+
+
+def _iso_date(value: Any) -> Optional[str]:
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        return None
+
+
+def expense_rows(result: Dict[str, Any], recorded_at: Optional[float] = None) -> List[Dict[str, Any]]:
+    # A multi-page PDF carries one receipt per page; each one is a separate expense.
+    receipts = result.get("receipts") or [result]
+    fallback = datetime.fromtimestamp(recorded_at or time.time()).date().isoformat()
+    rows = []
+    for receipt in receipts:
+        cents = _cents(receipt.get("total"))
+        if cents is None:
+            continue
+        day = _iso_date(receipt.get("date"))
+        rows.append({
+            "merchant": receipt.get("merchant") or "",
+            "category": receipt.get("category") or "",
+            "date": day,
+            "sort_date": day or fallback,
+            "total_cents": cents,
+        })
+    return rows
+
+
+def _rollup_keys(row: Dict[str, Any]) -> List[Tuple[str, str]]:
+    month = row["sort_date"][:7]
+    return [
+        ("month", month),
+        ("category", row["category"]),
+        ("merchant", row["merchant"]),
+        ("month:category", f"{month}|{row['category']}"),
+        ("month:merchant", f"{month}|{row['merchant']}"),
+    ]
+
+
+def encode_cursor(sort_key: Any, entry_id: int) -> str:
+    return f"{sort_key}|{entry_id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    if not cursor:
+        return None
+    sort_key, _, entry_id = cursor.rpartition("|")
+    try:
+        return sort_key, int(entry_id)
+    except ValueError:
+        raise LedgerError("Curseur invalide")
+
+
+class Ledger:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        reverses INTEGER,
+        merchant TEXT NOT NULL,
+        category TEXT NOT NULL,
+        date TEXT,
+        sort_date TEXT NOT NULL,
+        total_cents INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_source ON entries (source);
+    CREATE TRIGGER IF NOT EXISTS entries_no_update BEFORE UPDATE ON entries BEGIN SELECT RAISE(ABORT, 'ledger entries are append-only'); END;
+    CREATE TRIGGER IF NOT EXISTS entries_no_delete BEFORE DELETE ON entries BEGIN SELECT RAISE(ABORT, 'ledger entries are append-only'); END;
+    CREATE TABLE IF NOT EXISTS live (
+        entry_id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        sort_date TEXT NOT NULL,
+        month TEXT NOT NULL,
+        category TEXT NOT NULL,
+        merchant TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_live_source ON live (source);
+    CREATE INDEX IF NOT EXISTS idx_live_sort ON live (sort_date, entry_id);
+    CREATE INDEX IF NOT EXISTS idx_live_month ON live (month, sort_date, entry_id);
+    CREATE INDEX IF NOT EXISTS idx_live_category ON live (category, sort_date, entry_id);
+    CREATE INDEX IF NOT EXISTS idx_live_merchant ON live (merchant, sort_date, entry_id);
+    CREATE TABLE IF NOT EXISTS rollups (
+        dim TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        PRIMARY KEY (dim, key)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _apply_rollups(self, conn: sqlite3.Connection, row: Dict[str, Any], sign: int):
+        conn.executemany(
+            "INSERT INTO rollups (dim, key, count, total_cents) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(dim, key) DO UPDATE SET count = count + excluded.count, total_cents = total_cents + excluded.total_cents",
+            [(dim, key, sign, sign * row["total_cents"]) for dim, key in _rollup_keys(row)],
+        )
+
+    def _append(self, conn: sqlite3.Connection, source: str, row: Dict[str, Any], now: float) -> int:
+        cursor = conn.execute(
+            "INSERT INTO entries (source, kind, reverses, merchant, category, date, sort_date, total_cents, created_at) VALUES (?, 'expense', NULL, ?, ?, ?, ?, ?, ?)",
+            (source, row["merchant"], row["category"], row["date"], row["sort_date"], row["total_cents"], now),
+        )
+        entry_id = cursor.lastrowid
+        conn.execute(
+            "INSERT INTO live (entry_id, source, sort_date, month, category, merchant) VALUES (?, ?, ?, ?, ?, ?)",
+            (entry_id, source, row["sort_date"], row["sort_date"][:7], row["category"], row["merchant"]),
+        )
+        self._apply_rollups(conn, row, 1)
+        return entry_id
+
+    def _reverse(self, conn: sqlite3.Connection, entry: Dict[str, Any], now: float, kind: str = "reversal"):
+        # "reversal" is a correction by the pipeline; "cancellation" is the user deleting the expense.
+        conn.execute(
+            "INSERT INTO entries (source, kind, reverses, merchant, category, date, sort_date, total_cents, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry["source"], kind, entry["id"], entry["merchant"], entry["category"], entry["date"], entry["sort_date"], -entry["total_cents"], now),
+        )
+        conn.execute("DELETE FROM live WHERE entry_id = ?", (entry["id"],))
+        self._apply_rollups(conn, entry, -1)
+
+    def _live_entries(self, conn: sqlite3.Connection, where: str, params: Iterable[Any]) -> List[Dict[str, Any]]:
+        rows = conn.execute(
+            "SELECT e.id, e.source, e.merchant, e.category, e.date, e.sort_date, e.total_cents FROM live l JOIN entries e ON e.id = l.entry_id WHERE " + where,
+            tuple(params),
+        ).fetchall()
+        return [dict(zip(("id", "source", "merchant", "category", "date", "sort_date", "total_cents"), row)) for row in rows]
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            outcome = work(conn)
+            conn.execute("COMMIT")
+            return outcome
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def record(self, source: str, result: Dict[str, Any]) -> Dict[str, int]:
+        if result.get("duplicate_of"):
+            # Second copy of a receipt already in the ledger: it must not count twice.
+            return {"recorded": 0, "reversed": self.void(source)}
+        rows = expense_rows(result)
+        if not rows:
+            # No readable total (OCR failure): keep whatever was recorded before.
+            return {"recorded": 0, "reversed": 0}
+
+        def work(conn: sqlite3.Connection) -> Dict[str, int]:
+            current = self._live_entries(conn, "l.source = ?", (source,))
+            # Receipts the user deleted stay deleted when the same source comes back with them.
+            cancelled = Counter(conn.execute(
+                "SELECT e.merchant, e.category, e.date, e.total_cents FROM entries c JOIN entries e ON e.id = c.reverses WHERE c.source = ? AND c.kind = 'cancellation'",
+                (source,),
+            ).fetchall())
+            kept = []
+            for row in rows:
+                key = tuple(row[field] for field in SIGNATURE)
+                if cancelled[key]:
+                    cancelled[key] -= 1
+                else:
+                    kept.append(row)
+            if Counter(tuple(entry[field] for field in SIGNATURE) for entry in current) == Counter(tuple(row[field] for field in SIGNATURE) for row in kept):
+                # Same receipts analysed again (recovery, cache hit): nothing to correct.
+                return {"recorded": 0, "reversed": 0}
+            now = time.time()
+            for entry in current:
+                self._reverse(conn, entry, now)
+            for row in kept:
+                self._append(conn, source, row, now)
+            return {"recorded": len(kept), "reversed": len(current)}
+
+        return self._transaction(work)
+
+    def reverse(self, entry_id: int) -> bool:
+        def work(conn: sqlite3.Connection) -> bool:
+            current = self._live_entries(conn, "l.entry_id = ?", (entry_id,))
+            for entry in current:
+                self._reverse(conn, entry, time.time(), kind="cancellation")
+            return bool(current)
+
+        return self._transaction(work)
+
+    def void(self, source: str) -> int:
+        def work(conn: sqlite3.Connection) -> int:
+            current = self._live_entries(conn, "l.source = ?", (source,))
+            for entry in current:
+                self._reverse(conn, entry, time.time())
+            return len(current)
+
+        return self._transaction(work)
+
+    def expenses(self, month: Optional[str] = None, category: Optional[str] = None, merchant: Optional[str] = None, cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        limit = max(1, min(limit, PAGE_MAX))
+        clauses, params = [], []
+        for column, value in (("month", month), ("category", category), ("merchant", merchant)):
+            if value is not None:
+                clauses.append(f"l.{column} = ?")
+                params.append(value)
+        position = decode_cursor(cursor)
+        if position is not None:
+            clauses.append("(l.sort_date, l.entry_id) < (?, ?)")
+            params.extend(position)
+        where = " AND ".join(clauses) or "1"
+        items = self._live_entries(self._conn(), f"{where} ORDER BY l.sort_date DESC, l.entry_id DESC LIMIT ?", (*params, limit + 1))
+        more = len(items) > limit
+        items = items[:limit]
+        return {
+            "items": [_public_entry(item) for item in items],
+            "next_cursor": encode_cursor(items[-1]["sort_date"], items[-1]["id"]) if more else None,
+        }
+
+    def entries(self, source: Optional[str] = None, cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        limit = max(1, min(limit, PAGE_MAX))
+        clauses, params = [], []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        position = decode_cursor(cursor)
+        if position is not None:
+            clauses.append("id < ?")
+            params.append(position[1])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT id, source, kind, reverses, merchant, category, date, sort_date, total_cents, created_at FROM entries {where} ORDER BY id DESC LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        fields = ("id", "source", "kind", "reverses", "merchant", "category", "date", "sort_date", "total_cents", "created_at")
+        items = [dict(zip(fields, row)) for row in rows]
+        more = len(items) > limit
+        items = items[:limit]
+        return {
+            "items": [{**_public_entry(item), "kind": item["kind"], "reverses": item["reverses"], "created_at": item["created_at"]} for item in items],
+            "next_cursor": encode_cursor("", items[-1]["id"]) if more else None,
+        }
+
+    def rollup(self, dim: str, month: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        if dim not in DIMENSIONS:
+            raise LedgerError(f"Dimension inconnue : {dim}")
+        limit = max(1, min(limit, PAGE_MAX))
+        order = "key DESC" if dim == "month" else "total_cents DESC, key"
+        if month is not None and dim != "month":
+            # Per-month buckets are keyed "YYYY-MM|value"; "}" sorts right after "|".
+            prefix = f"{month}|"
+            rows = self._conn().execute(
+                f"SELECT substr(key, ?), count, total_cents FROM rollups WHERE dim = ? AND key >= ? AND key < ? AND count > 0 ORDER BY {order} LIMIT ? OFFSET ?",
+                (len(prefix) + 1, f"month:{dim}", prefix, f"{month}}}", limit, offset),
+            ).fetchall()
+        else:
+            clause, params = ("AND key = ?", (month,)) if month is not None else ("", ())
+            rows = self._conn().execute(
+                f"SELECT key, count, total_cents FROM rollups WHERE dim = ? {clause} AND count > 0 ORDER BY {order} LIMIT ? OFFSET ?",
+                (dim, *params, limit, offset),
+            ).fetchall()
+        return [{"key": key or None, "count": count, "total": total_cents / 100} for key, count, total_cents in rows]
+
+    def summary(self, month: Optional[str] = None) -> Dict[str, Any]:
+        clause, params = ("AND key = ?", (month,)) if month is not None else ("", ())
+        count, total_cents = self._conn().execute(f"SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total_cents), 0) FROM rollups WHERE dim = 'month' {clause}", params).fetchone()
+        return {"count": count, "total": total_cents / 100}
+
+    def rebuild_rollups(self) -> int:
+        def work(conn: sqlite3.Connection) -> int:
+            conn.execute("DELETE FROM rollups")
+            live = self._live_entries(conn, "1", ())
+            for entry in live:
+                self._apply_rollups(conn, entry, 1)
+            return len(live)
+
+        return self._transaction(work)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _public_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": entry["id"],
+        "source": entry["source"],
+        "merchant": entry["merchant"] or None,
+        "category": entry["category"] or None,
+        "date": entry["date"],
+        "total": entry["total_cents"] / 100,
+    }
+
+
+_LEDGERS: Dict[str, Ledger] = {}
+_LEDGERS_LOCK = threading.Lock()
+
+
+def get_ledger(base_dir: Path) -> Ledger:
+    key = str(base_dir)
+    ledger = _LEDGERS.get(key)
+    if ledger is None:
+        with _LEDGERS_LOCK:
+            ledger = _LEDGERS.get(key)
+            if ledger is None:
+                ledger = _LEDGERS[key] = Ledger(Path(base_dir) / "ledger.sqlite")
+    return ledger
+
+
+def record_result(base_dir: Path, source: str, result: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    if not ledger_enabled():
+        return None
+    try:
+        return get_ledger(base_dir).record(source, result)
+    except Exception as exc:  # pragma: no cover - defensive
+        # The analysis itself succeeded; the ledger can be rebuilt from result.json (tools/ledger_backfill.py).
+        LOGGER.warning("Ledger write failed source=%s: %s", source, exc)
+        return None
+
+
+def void_result(base_dir: Path, source: str) -> int:
+    if not ledger_enabled():
+        return 0
+    try:
+        return get_ledger(base_dir).void(source)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Ledger void failed source=%s: %s", source, exc)
+        return 0
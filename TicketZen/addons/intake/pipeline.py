@@ -0,0 +1,257 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from addons import metrics
+from addons.intake import dedupe, ledger, search, state
+from addons.ocr import cache as ocr_cache
+from addons.ocr import pdf, postprocess_fr, preprocess
+from addons.ocr.providers import registry
+
+LOGGER = logging.getLogger("ticketzen.intake.pipeline")
+
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def ocr_config() -> Dict[str, Any]:
+    return {
+        "endpoint": os.getenv("AZURE_DI_ENDPOINT", ""),
+        "key": os.getenv("AZURE_DI_KEY", ""),
+        "route": os.getenv("AZURE_DI_ROUTE", "formrecognizer_v21"),
+        "api_version": os.getenv("AZURE_DI_API_VERSION", "v2.1"),
+        "timeout": int(os.getenv("AZURE_DI_TIMEOUT_SEC", "90")),
+        "dry_run": bool(int(os.getenv("OCR_DRY_RUN", "0"))),
+        "cloud_enabled": bool(int(os.getenv("TICKETZEN_OCR_CLOUD_ENABLED", "1"))),
+        "vendor": os.getenv("TICKETZEN_OCR_CLOUD_VENDOR", "azure"),
+        **registry.provider_config(),
+    }
+
+
+def find_original(folder: Path) -> Optional[Path]:
+    originals = list(folder.glob("original.*"))
+    return originals[0] if originals else None
+
+
+def content_type_for(path: Path) -> str:
+    return CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream")
+
+
+def _cacheable(ocr_result: Dict[str, Any]) -> bool:
+    warnings = ocr_result.get("warnings") or []
+    return not any(tag in warnings for tag in ("azure_all_failed", "dry_run=true", "ocr_fallback_failed")) and not any(str(tag).startswith("ocr_local_error") for tag in warnings)
+
+
+def cached_ocr(base_dir: Path, content: bytes, content_type: str, config: Dict[str, Any], limiter=None) -> Dict[str, Any]:
+    if not config.get("use_cache", True) or not ocr_cache.cache_enabled():
+        with metrics.timer("ocr"):
+            return registry.analyze_document(content, content_type, config, LOGGER, limiter=limiter)
+    cache = ocr_cache.get_cache(base_dir)
+    scope = registry.cache_scope(config)
+    if config.get("pages"):
+        scope = f"{scope}#pages={config['pages']}"
+    key = ocr_cache.make_key(content, scope)
+    cached = cache.get(key)
+    if cached is not None:
+        LOGGER.info("OCR cache hit key=%s", key[:12])
+        metrics.incr("ocr_cache", result="hit")
+        cached["warnings"] = [tag for tag in cached.get("warnings", []) if tag != "ocr_cache=hit"] + ["ocr_cache=hit"]
+        return cached
+    metrics.incr("ocr_cache", result="miss")
+    with metrics.timer("ocr"):
+        ocr_result = registry.analyze_document(content, content_type, config, LOGGER, limiter=limiter)
+    if _cacheable(ocr_result):
+        cache.put(key, ocr_result)
+    return ocr_result
+
+
+def _check_deadline(deadline: Optional[float]):
+    if deadline is not None and time.time() > deadline:
+        raise JobTimeout("Délai d'analyse dépassé")
+
+
+def merge_pages(receipts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    receipts = sorted(receipts, key=lambda receipt: receipt.get("page", 0))
+    primary = next((receipt for receipt in receipts if receipt.get("total") is not None), receipts[0])
+    merged = {key: value for key, value in primary.items() if key != "page"}
+    merged["tags"] = list(primary.get("tags") or []) + [f"pdf_pages={len(receipts)}"]
+    merged["texts"] = "\n".join(receipt.get("texts") or "" for receipt in receipts)
+    merged["pages"] = len(receipts)
+    merged["receipts"] = receipts
+    return merged
+
+
+def _analyze_page(base_dir: Path, page: pdf.PdfPage, config: Dict[str, Any], limiter=None) -> Dict[str, Any]:
+    ocr_result = cached_ocr(base_dir, page.content, "application/pdf", config, limiter=limiter)
+    with metrics.timer("normalize"):
+        return {"page": page.number, **postprocess_fr.normalize_result(ocr_result)}
+
+
+def _analyze_pdf(base_dir: Path, pages: List[pdf.PdfPage], config: Dict[str, Any], concurrency: int, deadline: Optional[float] = None, limiter=None, on_page: Optional[Callable[[List[Dict[str, Any]], int], None]] = None) -> Dict[str, Any]:
+    receipts: List[Dict[str, Any]] = []
+    failed: Dict[int, Exception] = {}
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(pages)), thread_name_prefix="tz-pdf")
+    futures = {executor.submit(_analyze_page, base_dir, page, config, limiter): page.number for page in pages}
+    try:
+        timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+        for future in as_completed(futures, timeout=timeout):
+            # One unreadable page must not cost the others: keep what succeeded and say which pages are missing.
+            try:
+                receipts.append(future.result())
+            except Exception as exc:
+                LOGGER.warning("PDF page %d failed: %s", futures[future], exc)
+                failed[futures[future]] = exc
+                continue
+            if on_page is not None:
+                on_page(receipts, len(pages))
+    except FutureTimeout:
+        raise JobTimeout("Délai d'analyse dépassé")
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+    if not receipts:
+        raise failed[min(failed)]
+    merged = merge_pages(receipts)
+    if failed:
+        merged["failed_pages"] = sorted(failed)
+        merged["tags"].append(f"pdf_failed_pages={','.join(str(number) for number in sorted(failed))}")
+    return merged
+
+
+def analyze_file(base_dir: Path, original: Path, config: Dict[str, Any], deadline: Optional[float] = None, limiter=None, on_page: Optional[Callable[[List[Dict[str, Any]], int], None]] = None, rotation: int = 0) -> Dict[str, Any]:
+    if original.suffix.lower() == ".pdf":
+        settings = pdf.pdf_config()
+        if settings["split"]:
+            pages = pdf.split_pages(original.read_bytes(), settings["max_pages"])
+            if len(pages) > 1:
+                return _analyze_pdf(base_dir, pages, config, settings["concurrency"], deadline, limiter, on_page)
+    with metrics.timer("image_read"):
+        content, content_type = preprocess.load_ocr_input(original.parent, original, content_type_for(original), rotation=rotation)
+    ocr_result = cached_ocr(base_dir, content, content_type, config, limiter=limiter)
+    _check_deadline(deadline)
+    with metrics.timer("normalize"):
+        return postprocess_fr.normalize_result(ocr_result)
+
+
+def _duplicate_candidates(base_dir: Path, candidates: List[Dict[str, Any]]) -> Iterable[Tuple[Dict[str, Any], str, Dict[str, Any]]]:
+    for candidate in candidates:
+        kind, _, other = candidate["source"].partition(":")
+        preview = state.result_preview(base_dir, other) if kind == "intake" else {}
+        result = preview.get("result")
+        if not preview.get("ok") or not result or result.get("duplicate_of"):
+            continue
+        yield candidate, other, result
+
+
+def _find_duplicate(base_dir: Path, token: str, config: Dict[str, Any], processed: Optional[Dict[str, Any]] = None) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    if not config.get("dedupe", True):
+        return None
+    upload = state.get_upload_meta(base_dir, token)
+    reuse_distance = dedupe.dedupe_config()["reuse_distance"]
+    # The user's answers to earlier fields-only matches (resolve_duplicate): source -> is a duplicate.
+    decisions = upload.get("duplicate_decisions") or {}
+    for candidate, other, previous in _duplicate_candidates(base_dir, upload.get("duplicate_of") or []):
+        if processed is None:
+            # Before OCR only the same file, or a picture closer than TZ_DEDUPE_REUSE_DISTANCE, is trusted:
+            # distinct receipts from one shop can hash a few bits apart.
+            if upload.get("sha256") and state.get_upload_meta(base_dir, other).get("sha256") == upload["sha256"]:
+                return {**candidate, "stage": "file"}, previous
+            if candidate["distance"] <= reuse_distance:
+                return {**candidate, "stage": "image"}, previous
+        elif decisions.get(candidate["source"]) is not False and dedupe.same_receipt(processed, previous):
+            if decisions.get(candidate["source"]):
+                return {**candidate, "stage": "fields", "confirmed": True}, previous
+            return {**candidate, "stage": "fields"}, previous
+    return None
+
+
+def run_analysis(base_dir: Path, token: str, config: Dict[str, Any], deadline: Optional[float] = None, claim_from: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    folder = state.token_dir(base_dir, token)
+    original = find_original(folder) if folder.exists() else None
+    if not original:
+        payload = state.set_status(base_dir, token, "error", error="Aucun fichier")
+        return {"ok": False, **payload}
+    if claim_from is None:
+        state.set_status(base_dir, token, "analyzing", progress=50)
+    elif state.transition(base_dir, token, claim_from, "analyzing", progress=50) is None:
+        LOGGER.info("analyze token=%s already claimed elsewhere; skipping", token)
+        return {"ok": True, "skipped": True, **state.get_status(base_dir, token)}
+    start = time.time()
+    try:
+        if deadline is not None:
+            remaining = int(deadline - time.time())
+            config = {**config, "timeout": max(1, min(int(config.get("timeout", 90)), remaining)), "deadline": deadline}
+
+        def on_page(receipts: List[Dict[str, Any]], total: int):
+            partial = {"partial": True, "pages": total, "receipts": sorted(receipts, key=lambda receipt: receipt["page"])}
+            state.transition(base_dir, token, {"analyzing"}, "analyzing", progress=50 + int(45 * len(receipts) / total), result=partial)
+
+        # Stage one runs before OCR and reuses the earlier result; stage two compares the normalized fields.
+        duplicate = _find_duplicate(base_dir, token, config)
+        if duplicate is not None:
+            processed = dict(duplicate[1])
+            processed.pop("possible_duplicate_of", None)
+        else:
+            processed = analyze_file(base_dir, original, config, deadline, on_page=on_page, rotation=state.get_rotation(base_dir, token))
+            duplicate = _find_duplicate(base_dir, token, config, processed)
+        if duplicate is not None:
+            # Only the same file or picture is dropped from the expenses on its own: two real purchases can
+            # share shop, day and total, so a fields-only match waits for the user (resolve_duplicate).
+            pending = duplicate[0]["stage"] == "fields" and not duplicate[0].get("confirmed")
+            processed["possible_duplicate_of" if pending else "duplicate_of"] = duplicate[0]
+            metrics.incr("duplicates", stage=duplicate[0]["stage"])
+        _check_deadline(deadline)
+        # The job may have been given up on meanwhile (process pool timeout marks it as error): never overwrite that.
+        payload = state.transition(base_dir, token, {"analyzing"}, "done", progress=100, result=processed)
+        if payload is None:
+            LOGGER.warning("analyze token=%s finished after being abandoned; result dropped", token)
+            return {"ok": False, "stale": True, **state.get_status(base_dir, token)}
+        (folder / "result.json").write_text(postprocess_fr.dump_json(processed))
+        ledger.record_result(base_dir, f"intake:{token}", processed)
+        search.index_result(base_dir, f"intake:{token}", processed)
+        LOGGER.info("analyze token=%s duration=%.1fms", token, (time.time() - start) * 1000)
+        metrics.incr("scans", state="done")
+        metrics.observe("analysis", time.time() - start)
+        return {"ok": True, **payload}
+    except JobTimeout as exc:
+        LOGGER.warning("Analyze timed out token=%s after %.1fms", token, (time.time() - start) * 1000)
+        payload = state.transition(base_dir, token, {"analyzing"}, "error", error=str(exc)) or state.get_status(base_dir, token)
+        metrics.incr("scans", state="timeout")
+        return {"ok": False, "timeout": True, **payload}
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.exception("Analyze failed: %s", exc)
+        payload = state.set_status(base_dir, token, "error", error=str(exc))
+        metrics.incr("scans", state="error")
+        return {"ok": False, **payload}
+
+
+def resolve_duplicate(base_dir: Path, token: str, confirm: bool) -> Dict[str, Any]:
+    preview = state.result_preview(base_dir, token)
+    result = preview.get("result") if preview.get("ok") else None
+    if not result or not result.get("possible_duplicate_of"):
+        return {"ok": False, "error": "Aucun doublon à confirmer"}
+    result = dict(result)
+    candidate = result.pop("possible_duplicate_of")
+    if confirm:
+        result["duplicate_of"] = {**candidate, "confirmed": True}
+    payload = state.transition(base_dir, token, {"done"}, "done", progress=100, result=result)
+    if payload is None:
+        return {"ok": False, "error": "Analyse en cours, réessayez"}
+    (state.token_dir(base_dir, token) / "result.json").write_text(postprocess_fr.dump_json(result))
+    # Remembered, so a re-analysis does not ask the same question again.
+    state.update_upload_meta(base_dir, token, lambda meta: {**meta, "duplicate_decisions": {**(meta.get("duplicate_decisions") or {}), candidate["source"]: confirm}})
+    if confirm:
+        ledger.void_result(base_dir, f"intake:{token}")
+    return {"ok": True, **payload}
@@ -0,0 +1,307 @@
+import bisect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+LOGGER = logging.getLogger("ticketzen.intake.search")
+
+PAGE_MAX = 100
+MAX_CENTS = 10 ** 15
+TOKEN_RE = re.compile(r"[^\W_]+")
+# Column weights for bm25: merchant, header, line items, full OCR text.
+WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+FUZZY_MIN_LEN = 4
+FUZZY_EXPANSIONS = 3
+# bm25 scores every matching receipt; "recent" walks the index backwards and stops after one page.
+SORTS = {"relevance": "rank", "recent": "docs_fts.rowid DESC"}
+
+
+class SearchError(Exception):
+    pass
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def search_enabled() -> bool:
+    return os.getenv("TZ_SEARCH_ENABLED", "1") != "0"
+
+
+def fold_tokens(text: str) -> List[str]:
+    # Same folding as the unicode61 tokenizer with remove_diacritics 2: lowercase, accents stripped.
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return TOKEN_RE.findall("".join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+def _cents(total: Any) -> Optional[int]:
+    try:
+        cents = int(round(float(total) * 100))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    # inf/nan are rejected above; absurd amounts would overflow SQLite integers (or their sums).
+    return cents if abs(cents) <= MAX_CENTS else None
+
+
+def _line_names(result: Dict[str, Any]) -> str:
+    receipts = result.get("receipts") or [result]
+    return "\n".join(str(line.get("name")) for receipt in receipts for line in receipt.get("lignes") or [] if isinstance(line, dict) and line.get("name"))
+
+
+def max_edits(token: str) -> int:
+    if len(token) < FUZZY_MIN_LEN:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+class Vocabulary:
+    def __init__(self, generation: int, rows: Iterable[Tuple[str, int]]):
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+        self.terms: List[str] = []
+        # Typo candidates are bucketed by (first letter, length): like a fuzzy prefix length of 1,
+        # a typo on the first letter is rare and this keeps each lookup to a few thousand terms.
+        self.buckets: Dict[Tuple[str, int], Tuple[List[str], List[int]]] = {}
+        # fts5vocab walks the index, so terms arrive sorted.
+        for term, docs in rows:
+            self.terms.append(term)
+            terms, counts = self.buckets.setdefault((term[0], len(term)), ([], []))
+            terms.append(term)
+            counts.append(docs)
+
+    def has_prefix(self, token: str) -> bool:
+        idx = bisect.bisect_left(self.terms, token)
+        return idx < len(self.terms) and self.terms[idx].startswith(token)
+
+    def similar(self, token: str, edits: int) -> List[str]:
+        from rapidfuzz import process
+        from rapidfuzz.distance import OSA
+
+        found = []
+        for length in range(len(token) - edits, len(token) + edits + 1):
+            terms, counts = self.buckets.get((token[0], length), ((), ()))
+            for term, distance, idx in process.extract(token, terms, scorer=OSA.distance, processor=None, score_cutoff=edits, limit=None):
+                found.append((distance, -counts[idx], term))
+        # Closest first, then the terms found in the most receipts: OCR noise rarely repeats.
+        return [term for _, _, term in sorted(found)[:FUZZY_EXPANSIONS]]
+
+
+class SearchIndex:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS docs (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL UNIQUE,
+        merchant TEXT,
+        category TEXT,
+        date TEXT,
+        total_cents INTEGER,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_docs_date ON docs (date);
+    CREATE INDEX IF NOT EXISTS idx_docs_total ON docs (total_cents);
+    CREATE INDEX IF NOT EXISTS idx_docs_category ON docs (category, date);
+    CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(merchant, header, lines, texts, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+    CREATE VIRTUAL TABLE IF NOT EXISTS docs_vocab USING fts5vocab(docs_fts, 'row');
+    CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    INSERT OR IGNORE INTO index_meta (key, value) VALUES ('generation', 0);
+    """
+
+    def __init__(self, path: Path, vocab_refresh_sec: Optional[float] = None):
+        self.path = Path(path)
+        self.vocab_refresh_sec = _env_float("TZ_SEARCH_VOCAB_REFRESH_SEC", 30.0) if vocab_refresh_sec is None else vocab_refresh_sec
+        self._local = threading.local()
+        self._vocab: Optional[Vocabulary] = None
+        self._vocab_lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _generation(self) -> int:
+        return self._conn().execute("SELECT value FROM index_meta WHERE key = 'generation'").fetchone()[0]
+
+    def _write(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            outcome = work(conn)
+            conn.execute("UPDATE index_meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute("COMMIT")
+            return outcome
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def index(self, source: str, result: Dict[str, Any]):
+        fields = (result.get("merchant") or "", result.get("header") or "", _line_names(result), result.get("texts") or "")
+        date = result.get("date") if isinstance(result.get("date"), str) else None
+
+        def work(conn: sqlite3.Connection):
+            row = conn.execute("SELECT id FROM docs WHERE source = ?", (source,)).fetchone()
+            if row is None:
+                doc_id = conn.execute(
+                    "INSERT INTO docs (source, merchant, category, date, total_cents, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (source, result.get("merchant"), result.get("category"), date, _cents(result.get("total")), time.time()),
+                ).lastrowid
+            else:
+                doc_id = row[0]
+                conn.execute(
+                    "UPDATE docs SET merchant = ?, category = ?, date = ?, total_cents = ?, updated_at = ? WHERE id = ?",
+                    (result.get("merchant"), result.get("category"), date, _cents(result.get("total")), time.time(), doc_id),
+                )
+                conn.execute("DELETE FROM docs_fts WHERE rowid = ?", (doc_id,))
+            conn.execute("INSERT INTO docs_fts (rowid, merchant, header, lines, texts) VALUES (?, ?, ?, ?, ?)", (doc_id, *fields))
+
+        self._write(work)
+
+    def remove(self, source: str) -> bool:
+        def work(conn: sqlite3.Connection) -> bool:
+            row = conn.execute("SELECT id FROM docs WHERE source = ?", (source,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM docs_fts WHERE rowid = ?", row)
+            conn.execute("DELETE FROM docs WHERE id = ?", row)
+            return True
+
+        return self._write(work)
+
+    def _load_vocabulary(self) -> Vocabulary:
+        generation = self._generation()
+        if self._vocab is not None and self._vocab.generation == generation:
+            self._vocab.loaded_at = time.monotonic()
+            return self._vocab
+        self._vocab = Vocabulary(generation, self._conn().execute("SELECT term, doc FROM docs_vocab"))
+        return self._vocab
+
+    def _background_reload(self):
+        try:
+            self._load_vocabulary()
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Keeping previous search vocabulary after failed reload: %s", exc)
+        finally:
+            self._vocab_lock.release()
+
+    def vocabulary(self) -> Vocabulary:
+        vocab = self._vocab
+        if vocab is None:
+            with self._vocab_lock:
+                return self._vocab or self._load_vocabulary()
+        if time.monotonic() - vocab.loaded_at >= self.vocab_refresh_sec and self._vocab_lock.acquire(blocking=False):
+            # Reloading takes ~1s at 100k receipts: queries keep the previous terms until the swap.
+            vocab.loaded_at = time.monotonic()
+            threading.Thread(target=self._background_reload, name="tz-search-vocab", daemon=True).start()
+        return vocab
+
+    def build_query(self, text: str, fuzzy: bool = True) -> Tuple[str, Dict[str, List[str]]]:
+        tokens = fold_tokens(text)
+        # Single letters ("l'", "à") match half the vocabulary as a prefix.
+        tokens = [token for token in tokens if len(token) > 1] or tokens
+        if not tokens:
+            return "", {}
+        vocab = self.vocabulary() if fuzzy else None
+        groups, expanded = [], {}
+        for token in tokens:
+            alternatives = [f'"{token}"*']
+            edits = max_edits(token)
+            # Only reach for typo tolerance when nothing indexed even starts with what was typed.
+            if vocab is not None and edits and not vocab.has_prefix(token):
+                similar = vocab.similar(token, edits)
+                if similar:
+                    expanded[token] = similar
+                    alternatives.extend(f'"{term}"' for term in similar)
+            groups.append(alternatives[0] if len(alternatives) == 1 else f"({' OR '.join(alternatives)})")
+        return " AND ".join(groups), expanded
+
+    def search(self, text: str = "", date_from: Optional[str] = None, date_to: Optional[str] = None, total_min: Optional[float] = None, total_max: Optional[float] = None, category: Optional[str] = None, limit: int = 20, offset: int = 0, fuzzy: bool = True, sort: str = "relevance") -> Dict[str, Any]:
+        if sort not in SORTS:
+            raise SearchError(f"Tri inconnu : {sort}")
+        limit = max(1, min(limit, PAGE_MAX))
+        clauses, params = [], []
+        for clause, value in (("d.date >= ?", date_from), ("d.date <= ?", date_to), ("d.total_cents >= ?", _cents(total_min)), ("d.total_cents <= ?", _cents(total_max)), ("d.category = ?", category)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        query, expanded = self.build_query(text, fuzzy=fuzzy)
+        if query:
+            sql = (
+                "SELECT d.source, d.merchant, d.category, d.date, d.total_cents, snippet(docs_fts, -1, '[', ']', '…', 10), bm25(docs_fts, ?, ?, ?, ?) AS rank "
+                f"FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid WHERE docs_fts MATCH ? {''.join(' AND ' + clause for clause in clauses)} ORDER BY {SORTS[sort]} LIMIT ? OFFSET ?"
+            )
+            args = (*WEIGHTS, query, *params, limit + 1, offset)
+        else:
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            sql = f"SELECT d.source, d.merchant, d.category, d.date, d.total_cents, NULL, NULL FROM docs d {where} ORDER BY d.date DESC, d.id DESC LIMIT ? OFFSET ?"
+            args = (*params, limit + 1, offset)
+        try:
+            rows = self._conn().execute(sql, args).fetchall()
+        except sqlite3.OperationalError as exc:  # pragma: no cover - defensive
+            raise SearchError(f"Recherche invalide : {exc}")
+        items = [
+            {"source": source, "merchant": merchant, "category": category, "date": date, "total": total_cents / 100 if total_cents is not None else None, "snippet": snippet, "score": round(-rank, 3) if rank is not None else None}
+            for source, merchant, category, date, total_cents, snippet, rank in rows[:limit]
+        ]
+        return {"items": items, "expanded": expanded, "next_offset": offset + limit if len(rows) > limit else None}
+
+    def stats(self) -> Dict[str, Any]:
+        vocab = self._vocab
+        return {"documents": self._conn().execute("SELECT COUNT(*) FROM docs").fetchone()[0], "vocabulary": len(vocab.terms) if vocab else None}
+
+    def optimize(self):
+        self._conn().execute("INSERT INTO docs_fts (docs_fts) VALUES ('optimize')")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_INDEXES: Dict[str, SearchIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_index(base_dir: Path) -> SearchIndex:
+    key = str(base_dir)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = SearchIndex(Path(base_dir) / "search.sqlite")
+    return index
+
+
+def index_result(base_dir: Path, source: str, result: Dict[str, Any]):
+    if not search_enabled():
+        return
+    try:
+        get_index(base_dir).index(source, result)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Search indexing failed source=%s: %s", source, exc)
+
+
+def remove_result(base_dir: Path, source: str):
+    if not search_enabled():
+        return
+    try:
+        get_index(base_dir).remove(source)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Search removal failed source=%s: %s", source, exc)
@@ -1,12 +1,48 @@
+import hashlib
 import json
 import logging
+import os
+import secrets
+import shutil
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from PIL import Image
+from addons import metrics
+from addons.intake import dedupe, events, ledger, search
+from addons.intake import store as intake_store
+from addons.ocr import preprocess
 
 LOGGER = logging.getLogger("ticketzen.intake.state")
 
+CHUNK_SIZE = 256 * 1024
+CHUNK_UPLOAD_MAX_BYTES = 4 * 1024 * 1024
+ALLOWED_SUFFIXES = {".jpg", ".jpeg", ".png", ".pdf", ".webp", ".heic", ".tif", ".tiff", ".bmp"}
+MAGIC_BYTES = {
+    ".jpg": [(0, b"\xff\xd8\xff")],
+    ".jpeg": [(0, b"\xff\xd8\xff")],
+    ".png": [(0, b"\x89PNG")],
+    ".pdf": [(0, b"%PDF")],
+    ".webp": [(8, b"WEBP")],
+    ".heic": [(4, b"ftyp")],
+    ".tif": [(0, b"II*\x00"), (0, b"MM\x00*")],
+    ".tiff": [(0, b"II*\x00"), (0, b"MM\x00*")],
+    ".bmp": [(0, b"BM")],
+}
+
+# token -> [lock, holders and waiters]: an entry lives only while a chunk of that upload is in flight.
+_CHUNK_LOCKS: Dict[str, List[Any]] = {}
+_CHUNK_LOCKS_GUARD = threading.Lock()
+_CHUNK_HASHES: Dict[str, Tuple[int, Any]] = {}
+# Intakes that never produced a kept result: a finished one backs ledger entries and stays.
+EXPIRABLE_STATES = ("pending", "uploaded", "error")
+
+
+class UploadRejected(Exception):
+    pass
+
 
 def ensure_dirs(base_dir: Path, token: str) -> Path:
     target = base_dir / "intake" / token
@@ -14,74 +50,298 @@ def ensure_dirs(base_dir: Path, token: str) -> Path:
     return target
 
 
+def token_dir(base_dir: Path, token: str) -> Path:
+    return base_dir / "intake" / token
+
+
 def file_path(base_dir: Path, token: str, *parts: str) -> Path:
-    return ensure_dirs(base_dir, token) / Path(*parts)
+    return token_dir(base_dir, token) / Path(*parts)
+
+
+def _store(base_dir: Path) -> intake_store.IntakeStore:
+    return intake_store.get_store(base_dir)
 
 
 def set_status(base_dir: Path, token: str, state: str, progress: Optional[int] = None, error: Optional[str] = None, result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    target = file_path(base_dir, token, "status.json")
-    payload: Dict[str, Any] = {"state": state}
-    if progress is not None:
-        payload["progress"] = progress
-    if error:
-        payload["error"] = error
-    if result is not None:
-        payload["result"] = result
+    payload = intake_store.status_payload(state, progress, error, result)
     try:
-        target.write_text(json.dumps(payload, ensure_ascii=False, indent=2))
+        with metrics.timer("status_write"):
+            payload = _store(base_dir).set_status(token, payload)
     except Exception as exc:  # pragma: no cover - defensive
         LOGGER.warning("Failed to persist status: %s", exc)
+    events.publish(token, payload)
     return payload
 
 
+def transition(base_dir: Path, token: str, expected: Iterable[str], state: str, progress: Optional[int] = None, error: Optional[str] = None, result: Optional[Dict[str, Any]] = None, version: Optional[int] = None, lease: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    payload = _store(base_dir).transition(token, expected, {**intake_store.status_payload(state, progress, error, result), **(lease or {})}, version=version)
+    if payload is None:
+        return None
+    payload = {key: value for key, value in payload.items() if key not in intake_store.LEASE_FIELDS}
+    events.publish(token, payload)
+    return payload
+
+
+def get_lease(base_dir: Path, token: str) -> Optional[Dict[str, Any]]:
+    return _store(base_dir).get_lease(token)
+
+
+def renew_leases(base_dir: Path, owner: str, tokens: Iterable[str], lease_until: float):
+    _store(base_dir).renew(owner, tokens, lease_until)
+
+
 def get_status(base_dir: Path, token: str) -> Dict[str, Any]:
-    target = file_path(base_dir, token, "status.json")
-    if target.exists():
-        try:
-            data = json.loads(target.read_text())
-            data.setdefault("progress", 0)
-            data.setdefault("state", "pending")
-            return {"ok": True, **data}
-        except Exception as exc:  # pragma: no cover - defensive
-            LOGGER.warning("Failed to read status: %s", exc)
+    try:
+        data = _store(base_dir).get_status(token)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Failed to read status: %s", exc)
+        data = None
+    if data:
+        data.setdefault("progress", 0)
+        data.setdefault("state", "pending")
+        return {"ok": True, **data}
     return {"ok": True, "state": "pending", "progress": 0}
 
 
-def save_upload(base_dir: Path, token: str, file_storage) -> Dict[str, Any]:
+def list_intakes(base_dir: Path, states: Optional[Iterable[str]] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    return _store(base_dir).list_intakes(states=states, limit=limit, offset=offset)
+
+
+def expire_intakes(base_dir: Path, max_age_sec: float, states: Optional[Iterable[str]] = EXPIRABLE_STATES) -> int:
+    store = _store(base_dir)
+    cutoff = time.time() - max_age_sec
+    expired = 0
+    while True:
+        rows = store.list_intakes(states=states, updated_before=cutoff, limit=500)
+        if not rows:
+            return expired
+        for row in rows:
+            shutil.rmtree(token_dir(base_dir, row["token"]), ignore_errors=True)
+            store.delete(row["token"])
+            source = f"intake:{row['token']}"
+            dedupe.forget(base_dir, source)
+            # An errored re-analysis can still have entries from an earlier success.
+            ledger.void_result(base_dir, source)
+            search.remove_result(base_dir, source)
+            _CHUNK_HASHES.pop(row["token"], None)
+            expired += 1
+
+
+def upload_limits() -> Dict[str, Any]:
     try:
-        folder = ensure_dirs(base_dir, token)
-        suffix = Path(file_storage.filename or "upload").suffix or ".bin"
-        dest = folder / f"original{suffix}"
-        file_storage.save(dest)
-        set_status(base_dir, token, "uploaded", progress=20)
-        return {"ok": True, "path": dest}
+        max_mb = float(os.getenv("TZ_UPLOAD_MAX_MB", "25"))
+    except ValueError:
+        max_mb = 25.0
+    return {"max_bytes": int(max_mb * 1024 * 1024), "suffixes": ALLOWED_SUFFIXES}
+
+
+def _sniff_ok(head: bytes, suffix: str) -> bool:
+    magic = MAGIC_BYTES.get(suffix)
+    if magic is None:
+        return True
+    return any(head[offset:offset + len(sig)] == sig for offset, sig in magic)
+
+
+def _check_name(filename: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    suffix = Path(filename or "upload").suffix.lower() or ".bin"
+    if suffix not in ALLOWED_SUFFIXES:
+        return None, f"Type de fichier non supporté ({suffix})"
+    return suffix, None
+
+
+def check_file(filename: Optional[str], head: Optional[bytes] = None) -> Tuple[Optional[str], Optional[str]]:
+    suffix, error = _check_name(filename)
+    if error:
+        return None, error
+    if head is not None and not _sniff_ok(head, suffix):
+        return None, "Contenu du fichier non reconnu"
+    return suffix, None
+
+
+def _finalize_upload(base_dir: Path, token: str, part: Path, suffix: str, filename: str, size: int, sha256: str) -> Dict[str, Any]:
+    folder = ensure_dirs(base_dir, token)
+    dest = folder / f"original{suffix}"
+    for previous in folder.glob("original.*"):
+        if previous != dest:
+            previous.unlink()
+    os.replace(part, dest)
+    meta = {"filename": filename, "size": size, "sha256": sha256, "uploaded_at": time.time()}
+    meta.update(dedupe.register_upload(base_dir, f"intake:{token}", dest))
+    _store(base_dir).set_meta(token, "upload", meta)
+    set_status(base_dir, token, "uploaded", progress=20)
+    return {"ok": True, "path": dest.name, **meta}
+
+
+def save_stream(base_dir: Path, token: str, stream: BinaryIO, filename: Optional[str], content_length: Optional[int] = None) -> Dict[str, Any]:
+    limits = upload_limits()
+    suffix, error = _check_name(filename)
+    if error:
+        return {"ok": False, "error": error}
+    if content_length is not None and content_length > limits["max_bytes"]:
+        return {"ok": False, "error": "Fichier trop volumineux"}
+    folder = ensure_dirs(base_dir, token)
+    part = folder / f".upload-{secrets.token_hex(6)}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with part.open("wb") as handle:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not _sniff_ok(chunk, suffix):
+                    raise UploadRejected("Contenu du fichier non reconnu")
+                size += len(chunk)
+                if size > limits["max_bytes"]:
+                    raise UploadRejected("Fichier trop volumineux")
+                digest.update(chunk)
+                handle.write(chunk)
+        if size == 0:
+            raise UploadRejected("Fichier vide")
+        return _finalize_upload(base_dir, token, part, suffix, filename or f"upload{suffix}", size, digest.hexdigest())
+    except UploadRejected as exc:
+        return {"ok": False, "error": str(exc)}
     except Exception as exc:  # pragma: no cover - defensive
         LOGGER.exception("Upload failed: %s", exc)
         return {"ok": False, "error": str(exc)}
+    finally:
+        if part.exists():
+            part.unlink()
+
+
+def save_upload(base_dir: Path, token: str, file_storage) -> Dict[str, Any]:
+    return save_stream(base_dir, token, file_storage.stream, file_storage.filename, file_storage.content_length or None)
+
+
+@contextmanager
+def _chunk_lock(token: str) -> Iterator[None]:
+    with _CHUNK_LOCKS_GUARD:
+        entry = _CHUNK_LOCKS.setdefault(token, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _CHUNK_LOCKS_GUARD:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _CHUNK_LOCKS[token]
+
+
+def chunk_progress(base_dir: Path, token: str) -> Dict[str, Any]:
+    folder = token_dir(base_dir, token)
+    manifest = folder / "upload.part.json"
+    if not manifest.exists():
+        return {"ok": True, "offset": 0, "total": None}
+    meta = json.loads(manifest.read_text())
+    part = folder / "upload.part"
+    return {"ok": True, "offset": part.stat().st_size if part.exists() else 0, "total": meta.get("total"), "filename": meta.get("filename")}
+
+
+def save_chunk(base_dir: Path, token: str, data: bytes, offset: int, total: int, filename: Optional[str]) -> Dict[str, Any]:
+    limits = upload_limits()
+    suffix, error = _check_name(filename)
+    if error:
+        return {"ok": False, "error": error}
+    if total <= 0 or total > limits["max_bytes"]:
+        return {"ok": False, "error": "Fichier trop volumineux" if total > 0 else "Taille totale invalide"}
+    folder = ensure_dirs(base_dir, token)
+    part = folder / "upload.part"
+    manifest = folder / "upload.part.json"
+    with _chunk_lock(token):
+        try:
+            if offset == 0:
+                if not _sniff_ok(data, suffix):
+                    return {"ok": False, "error": "Contenu du fichier non reconnu"}
+                part.write_bytes(b"")
+                manifest.write_text(json.dumps({"filename": filename, "total": total}, ensure_ascii=False))
+                _CHUNK_HASHES[token] = (0, hashlib.sha256())
+            elif not manifest.exists() or json.loads(manifest.read_text()).get("total") != total:
+                return {"ok": False, "error": "Envoi inconnu, recommencez", "offset": 0}
+            received = part.stat().st_size if part.exists() else 0
+            if offset != received:
+                return {"ok": False, "error": "Décalage inattendu", "offset": received}
+            if received + len(data) > total:
+                return {"ok": False, "error": "Fichier trop volumineux", "offset": received}
+            hashed, digest = _CHUNK_HASHES.get(token, (0, None))
+            if digest is None or hashed != received:
+                digest = hashlib.sha256()
+                with part.open("rb") as handle:
+                    for block in iter(lambda: handle.read(CHUNK_SIZE), b""):
+                        digest.update(block)
+            with part.open("ab") as handle:
+                handle.write(data)
+            digest.update(data)
+            received += len(data)
+            _CHUNK_HASHES[token] = (received, digest)
+            if received < total:
+                return {"ok": True, "offset": received, "total": total, "complete": False}
+            _CHUNK_HASHES.pop(token, None)
+            manifest.unlink()
+            return {**_finalize_upload(base_dir, token, part, suffix, filename or f"upload{suffix}", received, digest.hexdigest()), "offset": received, "complete": True}
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.exception("Chunk upload failed: %s", exc)
+            return {"ok": False, "error": str(exc)}
+
+
+def get_upload_meta(base_dir: Path, token: str) -> Dict[str, Any]:
+    try:
+        return _store(base_dir).get_meta(token, "upload")
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Failed to read upload metadata: %s", exc)
+        return {}
+
+
+def update_upload_meta(base_dir: Path, token: str, update: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    return _store(base_dir).update_meta(token, "upload", update)
 
 
 def rotate_image(base_dir: Path, token: str, degrees: Optional[int] = None, direction: Optional[str] = None) -> Dict[str, Any]:
+    # Only the cumulative orientation is recorded; pixels are turned once, when the OCR input or a preview is built.
     try:
-        folder = ensure_dirs(base_dir, token)
-        originals = list(folder.glob("original.*"))
+        folder = token_dir(base_dir, token)
+        originals = list(folder.glob("original.*")) if folder.exists() else []
         if not originals:
             return {"ok": False, "error": "Aucun fichier"}
-        original = originals[0]
-        img = Image.open(original)
+        if originals[0].suffix.lower() not in preprocess.IMAGE_SUFFIXES:
+            return {"ok": False, "error": "Rotation impossible pour ce type de fichier"}
         if direction == "cw":
             degrees = -90
         elif direction == "ccw":
             degrees = 90
         deg = degrees or 0
-        rotated = img.rotate(deg, expand=True)
-        rotated.save(original)
-        return {"ok": True, "degrees": deg}
+        # Read-modify-write in one store transaction: two workers rotating the same token both count.
+        meta = update_upload_meta(base_dir, token, lambda meta: {**meta, "rotation": preprocess.normalize_rotation(meta.get("rotation", 0) + preprocess.normalize_rotation(deg))})
+        return {"ok": True, "degrees": deg, "rotation": meta["rotation"]}
     except Exception as exc:  # pragma: no cover - defensive
         LOGGER.exception("Rotation failed: %s", exc)
         return {"ok": False, "error": str(exc)}
 
 
+def get_rotation(base_dir: Path, token: str) -> int:
+    return preprocess.normalize_rotation(get_upload_meta(base_dir, token).get("rotation", 0))
+
+
+def preview_image(base_dir: Path, token: str, size: int = preprocess.PREVIEW_SIDE) -> Dict[str, Any]:
+    folder = token_dir(base_dir, token)
+    originals = list(folder.glob("original.*")) if folder.exists() else []
+    if not originals:
+        return {"ok": False, "error": "Aucun fichier"}
+    if originals[0].suffix.lower() not in preprocess.IMAGE_SUFFIXES:
+        return {"ok": False, "error": "Aperçu indisponible pour ce type de fichier"}
+    try:
+        with metrics.timer("preview"):
+            path = preprocess.render_preview(folder, originals[0], get_rotation(base_dir, token), size)
+        return {"ok": True, "path": path}
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Preview failed for %s: %s", token, exc)
+        return {"ok": False, "error": str(exc)}
+
+
 def result_preview(base_dir: Path, token: str) -> Dict[str, Any]:
+    status = get_status(base_dir, token)
+    if status.get("result") is not None and not status["result"].get("partial"):
+        return {"ok": True, "result": status["result"]}
     target = file_path(base_dir, token, "result.json")
     if not target.exists():
         return {"ok": False, "error": "Aucun résultat"}
@@ -0,0 +1,431 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+LOGGER = logging.getLogger("ticketzen.intake.store")
+
+# Who runs a queued/analyzing row, and until when: kept out of the status payload.
+LEASE_FIELDS = ("owner", "lease_until")
+
+
+def status_payload(state: str, progress: Optional[int] = None, error: Optional[str] = None, result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"state": state}
+    if progress is not None:
+        payload["progress"] = progress
+    if error:
+        payload["error"] = error
+    if result is not None:
+        payload["result"] = result
+    return payload
+
+
+class IntakeStore(ABC):
+    @abstractmethod
+    def get_status(self, token: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set_status(self, token: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def transition(self, token: str, expected: Iterable[str], payload: Dict[str, Any], version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def get_lease(self, token: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def renew(self, owner: str, tokens: Iterable[str], lease_until: float):
+        ...
+
+    @abstractmethod
+    def get_meta(self, token: str, name: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def set_meta(self, token: str, name: str, data: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def update_meta(self, token: str, name: str, update: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def list_intakes(self, states: Optional[Iterable[str]] = None, updated_after: Optional[float] = None, updated_before: Optional[float] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def delete(self, token: str):
+        ...
+
+    def close(self):
+        pass
+
+
+class FileStore(IntakeStore):
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+        self._lock = threading.Lock()
+
+    def _folder(self, token: str) -> Path:
+        return self.base_dir / "intake" / token
+
+    @contextmanager
+    def _token_lock(self, token: str) -> Iterator[None]:
+        # flock on a per-token file: excludes the other threads and the other gunicorn workers alike.
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+        folder = self._folder(token)
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(folder / ".lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read(self, path: Path) -> Optional[Dict[str, Any]]:
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Failed to read %s: %s", path, exc)
+            return None
+
+    def _write(self, path: Path, data: Dict[str, Any]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+        os.replace(tmp, path)
+
+    def get_status(self, token: str) -> Optional[Dict[str, Any]]:
+        data = self._read(self._folder(token) / "status.json")
+        if data is None:
+            return None
+        return {key: value for key, value in data.items() if key not in LEASE_FIELDS}
+
+    def _replace_status(self, token: str, current: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+        lease = {key: current[key] for key in LEASE_FIELDS if key in current and key not in payload}
+        payload = {**payload, **lease, "version": int(current.get("version") or 0) + 1}
+        self._write(self._folder(token) / "status.json", payload)
+        return payload
+
+    def set_status(self, token: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with self._token_lock(token):
+            return self._replace_status(token, self._read(self._folder(token) / "status.json") or {}, payload)
+
+    def transition(self, token: str, expected: Iterable[str], payload: Dict[str, Any], version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._token_lock(token):
+            current = self._read(self._folder(token) / "status.json") or {"state": "pending", "version": 0}
+            if current.get("state") not in set(expected):
+                return None
+            if version is not None and int(current.get("version") or 0) != version:
+                return None
+            return self._replace_status(token, current, payload)
+
+    def get_lease(self, token: str) -> Optional[Dict[str, Any]]:
+        path = self._folder(token) / "status.json"
+        data = self._read(path)
+        if data is None:
+            return None
+        return {"state": data.get("state"), "version": int(data.get("version") or 0), "owner": data.get("owner"), "lease_until": data.get("lease_until"), "updated_at": path.stat().st_mtime}
+
+    def renew(self, owner: str, tokens: Iterable[str], lease_until: float):
+        for token in tokens:
+            with self._token_lock(token):
+                path = self._folder(token) / "status.json"
+                data = self._read(path)
+                if data is not None and data.get("owner") == owner:
+                    self._write(path, {**data, "lease_until": lease_until})
+
+    def get_meta(self, token: str, name: str) -> Dict[str, Any]:
+        return self._read(self._folder(token) / f"{name}.json") or {}
+
+    def set_meta(self, token: str, name: str, data: Dict[str, Any]):
+        self._write(self._folder(token) / f"{name}.json", data)
+
+    def update_meta(self, token: str, name: str, update: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        with self._token_lock(token):
+            data = update(self.get_meta(token, name))
+            self.set_meta(token, name, data)
+            return data
+
+    def list_intakes(self, states: Optional[Iterable[str]] = None, updated_after: Optional[float] = None, updated_before: Optional[float] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        root = self.base_dir / "intake"
+        if not root.exists():
+            return []
+        wanted = set(states) if states else None
+        rows = []
+        for status_path in root.glob("*/status.json"):
+            updated_at = status_path.stat().st_mtime
+            if (updated_after is not None and updated_at <= updated_after) or (updated_before is not None and updated_at >= updated_before):
+                continue
+            status = self._read(status_path) or {}
+            if wanted and status.get("state") not in wanted:
+                continue
+            rows.append({"token": status_path.parent.name, "state": status.get("state"), "progress": status.get("progress"), "updated_at": updated_at})
+        rows.sort(key=lambda row: row["updated_at"], reverse=True)
+        return rows[offset:offset + limit]
+
+    def delete(self, token: str):
+        for name in ("status.json", "upload.json"):
+            path = self._folder(token) / name
+            if path.exists():
+                path.unlink()
+
+
+class SQLiteStore(IntakeStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS intakes (
+        token TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        progress INTEGER,
+        error TEXT,
+        result TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        lease_until REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_intakes_state_updated ON intakes (state, updated_at);
+    CREATE INDEX IF NOT EXISTS idx_intakes_updated ON intakes (updated_at);
+    CREATE INDEX IF NOT EXISTS idx_intakes_created ON intakes (created_at);
+    CREATE TABLE IF NOT EXISTS intake_meta (
+        token TEXT NOT NULL,
+        name TEXT NOT NULL,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (token, name)
+    );
+    """
+    ADDED_COLUMNS = (("version", "INTEGER NOT NULL DEFAULT 0"), ("owner", "TEXT"), ("lease_until", "REAL"))
+    # PRAGMA user_version once the status.json folders have been imported.
+    LEGACY_IMPORTED = 1
+    LEGACY_META = ("upload",)
+
+    def __init__(self, path: Path, legacy_root: Optional[Path] = None):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(intakes)")}
+            for name, spec in self.ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE intakes ADD COLUMN {name} {spec}")
+        if legacy_root is not None and self._conn().execute("PRAGMA user_version").fetchone()[0] < self.LEGACY_IMPORTED:
+            counts = self.import_legacy(Path(legacy_root), mark=True)
+            if counts["statuses"]:
+                LOGGER.info("Imported %d legacy intake folders into %s", counts["statuses"], self.path)
+
+    def import_legacy(self, base_dir: Path, dry_run: bool = False, mark: bool = False) -> Dict[str, int]:
+        # One pass over intake/<token>/ at startup, so reads never fall back to the folders.
+        # Tokens already in the database are left alone.
+        source = FileStore(base_dir)
+        counts = {"statuses": 0, "meta": 0, "skipped": 0}
+        root = base_dir / "intake"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if mark and conn.execute("PRAGMA user_version").fetchone()[0] >= self.LEGACY_IMPORTED:
+                conn.execute("ROLLBACK")
+                return counts
+            folders = sorted(p for p in root.iterdir() if p.is_dir()) if root.exists() else []
+            for folder in folders:
+                token = folder.name
+                status = source.get_status(token)
+                if status is None and (folder / "result.json").exists():
+                    status = status_payload("done", 100, result=json.loads((folder / "result.json").read_text()))
+                if status is None or conn.execute("SELECT 1 FROM intakes WHERE token = ?", (token,)).fetchone():
+                    counts["skipped"] += 1
+                    continue
+                counts["statuses"] += 1
+                if not dry_run:
+                    self._upsert(conn, token, status)
+                for name in self.LEGACY_META:
+                    data = source.get_meta(token, name)
+                    if data:
+                        counts["meta"] += 1
+                        if not dry_run:
+                            self._put_meta(conn, token, name, data)
+            if mark and not dry_run:
+                conn.execute(f"PRAGMA user_version = {self.LEGACY_IMPORTED}")
+            conn.execute("ROLLBACK" if dry_run else "COMMIT")
+            return counts
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row_to_status(row) -> Dict[str, Any]:
+        state, progress, error, result, version = row
+        return {**status_payload(state, progress, error, json.loads(result) if result else None), "version": version}
+
+    def _upsert(self, conn: sqlite3.Connection, token: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Runs inside a transaction: the version read back is the one this write produced.
+        # A write without a lease keeps the current one (the job's own progress updates).
+        now = time.time()
+        result = payload.get("result")
+        conn.execute(
+            "INSERT INTO intakes (token, state, progress, error, result, created_at, updated_at, version, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT(token) DO UPDATE SET state=excluded.state, progress=excluded.progress, error=excluded.error, result=excluded.result, updated_at=excluded.updated_at, version=intakes.version + 1, "
+            "owner=COALESCE(excluded.owner, intakes.owner), lease_until=COALESCE(excluded.lease_until, intakes.lease_until)",
+            (token, payload.get("state"), payload.get("progress"), payload.get("error"), json.dumps(result, ensure_ascii=False) if result is not None else None, now, now, payload.get("owner"), payload.get("lease_until")),
+        )
+        version = conn.execute("SELECT version FROM intakes WHERE token = ?", (token,)).fetchone()[0]
+        return {**payload, "version": version}
+
+    def get_status(self, token: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT state, progress, error, result, version FROM intakes WHERE token = ?", (token,)).fetchone()
+        return self._row_to_status(row) if row else None
+
+    def set_status(self, token: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            payload = self._upsert(conn, token, payload)
+            conn.execute("COMMIT")
+            return payload
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def transition(self, token: str, expected: Iterable[str], payload: Dict[str, Any], version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state, version FROM intakes WHERE token = ?", (token,)).fetchone()
+            current, current_version = row if row else ("pending", 0)
+            if current not in set(expected) or (version is not None and current_version != version):
+                conn.execute("ROLLBACK")
+                return None
+            payload = self._upsert(conn, token, payload)
+            conn.execute("COMMIT")
+            return payload
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_lease(self, token: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT state, version, owner, lease_until, updated_at FROM intakes WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return None
+        state, version, owner, lease_until, updated_at = row
+        return {"state": state, "version": version, "owner": owner, "lease_until": lease_until, "updated_at": updated_at}
+
+    def renew(self, owner: str, tokens: Iterable[str], lease_until: float):
+        tokens = list(tokens)
+        if tokens:
+            self._conn().execute(
+                f"UPDATE intakes SET lease_until = ? WHERE owner = ? AND token IN ({', '.join('?' for _ in tokens)})",
+                (lease_until, owner, *tokens),
+            )
+
+    def get_meta(self, token: str, name: str) -> Dict[str, Any]:
+        row = self._conn().execute("SELECT data FROM intake_meta WHERE token = ? AND name = ?", (token, name)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    @staticmethod
+    def _put_meta(conn: sqlite3.Connection, token: str, name: str, data: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO intake_meta (token, name, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(token, name) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+            (token, name, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+
+    def set_meta(self, token: str, name: str, data: Dict[str, Any]):
+        self._put_meta(self._conn(), token, name, data)
+
+    def update_meta(self, token: str, name: str, update: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM intake_meta WHERE token = ? AND name = ?", (token, name)).fetchone()
+            data = update(json.loads(row[0]) if row else {})
+            self._put_meta(conn, token, name, data)
+            conn.execute("COMMIT")
+            return data
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list_intakes(self, states: Optional[Iterable[str]] = None, updated_after: Optional[float] = None, updated_before: Optional[float] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if states:
+            states = list(states)
+            clauses.append(f"state IN ({', '.join('?' for _ in states)})")
+            params.extend(states)
+        if updated_after is not None:
+            clauses.append("updated_at > ?")
+            params.append(updated_after)
+        if updated_before is not None:
+            clauses.append("updated_at < ?")
+            params.append(updated_before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT token, state, progress, created_at, updated_at FROM intakes {where} ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+        return [{"token": token, "state": state, "progress": progress, "created_at": created_at, "updated_at": updated_at} for token, state, progress, created_at, updated_at in rows]
+
+    def delete(self, token: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM intakes WHERE token = ?", (token,))
+        conn.execute("DELETE FROM intake_meta WHERE token = ?", (token,))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_STORES: Dict[str, IntakeStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def make_store(base_dir: Path, backend: Optional[str] = None) -> IntakeStore:
+    backend = backend or os.getenv("TZ_INTAKE_STORE", "sqlite")
+    if backend == "file":
+        return FileStore(base_dir)
+    return SQLiteStore(Path(base_dir) / "intake.sqlite", legacy_root=base_dir)
+
+
+def get_store(base_dir: Path) -> IntakeStore:
+    key = str(base_dir)
+    store = _STORES.get(key)
+    if store is None:
+        with _STORES_LOCK:
+            store = _STORES.get(key)
+            if store is None:
+                store = _STORES[key] = make_store(base_dir)
+    return store
@@ -0,0 +1,202 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from rapidfuzz import fuzz, process
+
+LOGGER = logging.getLogger("ticketzen.knowledge.matcher")
+
+REGEX_SPECIALS = set(".^$*+?{}[]\\|()")
+REGEX_CHUNK = 200
+FUZZY_CUTOFF = 60
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def sort_tokens(text: str) -> str:
+    return " ".join(sorted(text.lower().split()))
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+# Aho–Corasick automaton over literal patterns; search() returns the lowest merchant index matched.
+class LiteralAutomaton:
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[Optional[int]] = [None]
+
+    def add(self, literal: str, value: int):
+        node = 0
+        for char in literal:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = nxt
+        current = self._best[node]
+        self._best[node] = value if current is None else min(current, value)
+
+    def build(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def search(self, text: str) -> Optional[int]:
+        node, best = 0, None
+        goto, fail, outputs = self._goto, self._fail, self._best
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            value = outputs[node]
+            if value is not None and (best is None or value < best):
+                best = value
+        return best
+
+
+class MerchantMatcher:
+    def __init__(self, merchants: Iterable[Dict[str, Any]], blocking_min: Optional[int] = None, max_candidates: Optional[int] = None):
+        self.merchants = list(merchants)
+        self.blocking_min = blocking_min if blocking_min is not None else _env_int("TZ_MERCHANT_BLOCKING_MIN", 50000)
+        self.max_candidates = max_candidates if max_candidates is not None else _env_int("TZ_MERCHANT_MAX_CANDIDATES", 2000)
+        self.names: List[str] = [merchant.get("name") for merchant in self.merchants]
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.alias_index: Dict[str, str] = {}
+        for merchant in self.merchants:
+            self.records.setdefault(merchant.get("name"), merchant)
+        self._literals = LiteralAutomaton()
+        self._regex_chunks: List[Tuple[int, re.Pattern, List[Tuple[int, re.Pattern]]]] = []
+        self._aliases: List[str] = []
+        self._alias_owner: List[int] = []
+        self._grams: Dict[str, List[int]] = {}
+        self._compile()
+
+    def _compile(self):
+        pending: List[Tuple[int, str]] = []
+        for idx, merchant in enumerate(self.merchants):
+            for pattern in merchant.get("regex") or []:
+                if not any(char in REGEX_SPECIALS for char in pattern):
+                    self._literals.add(pattern.lower(), idx)
+                else:
+                    pending.append((idx, pattern))
+            for alias in (merchant.get("aliases") or []) + [merchant.get("name")]:
+                if alias:
+                    normalized = sort_tokens(alias)
+                    self._aliases.append(normalized)
+                    self._alias_owner.append(idx)
+                    self.alias_index.setdefault(normalized, self.names[idx])
+        self._literals.build()
+        for start in range(0, len(pending), REGEX_CHUNK):
+            self._add_regex_chunk(pending[start:start + REGEX_CHUNK])
+        if len(self._aliases) >= self.blocking_min:
+            for alias_idx, alias in enumerate(self._aliases):
+                for gram in trigrams(alias):
+                    self._grams.setdefault(gram, []).append(alias_idx)
+
+    def _add_regex_chunk(self, chunk: List[Tuple[int, str]]):
+        compiled = []
+        for idx, pattern in chunk:
+            try:
+                compiled.append((idx, re.compile(pattern, re.IGNORECASE)))
+            except re.error as exc:
+                LOGGER.warning("Ignoring invalid merchant regex %r: %s", pattern, exc)
+        if not compiled:
+            return
+        try:
+            combined = re.compile("|".join(f"(?:{regex.pattern})" for _, regex in compiled), re.IGNORECASE)
+        except re.error:
+            # Inline flags or group names clash once joined: keep these patterns standalone.
+            for idx, regex in compiled:
+                self._regex_chunks.append((idx, regex, [(idx, regex)]))
+            return
+        self._regex_chunks.append((compiled[0][0], combined, compiled))
+
+    def match_regex(self, candidate: str) -> Optional[int]:
+        best = self._literals.search(candidate.lower())
+        for first_idx, combined, members in self._regex_chunks:
+            if best is not None and first_idx >= best:
+                break
+            if not combined.search(candidate):
+                continue
+            for idx, regex in members:
+                if best is not None and idx >= best:
+                    break
+                if regex.search(candidate):
+                    best = idx
+                    break
+        return best
+
+    def _candidates(self, query: str) -> Optional[List[int]]:
+        if not self._grams:
+            return None
+        postings = sorted((self._grams[gram] for gram in trigrams(query) if gram in self._grams), key=len)
+        counts = Counter()
+        budget = self.max_candidates * 4
+        for posting in postings:
+            # Rarest trigrams first; very common ones ("  s", "e  ") add cost without pruning anything.
+            if counts and budget < len(posting):
+                break
+            counts.update(posting)
+            budget -= len(posting)
+        if len(counts) > self.max_candidates:
+            return sorted(alias_idx for alias_idx, _ in counts.most_common(self.max_candidates))
+        return sorted(counts)
+
+    def match_fuzzy(self, candidate: str) -> Tuple[Optional[int], float]:
+        query = sort_tokens(candidate.strip())
+        indices = self._candidates(query)
+        choices = self._aliases if indices is None else [self._aliases[alias_idx] for alias_idx in indices]
+        if not choices:
+            return None, 0.0
+        found = process.extractOne(query, choices, scorer=fuzz.ratio, processor=None, score_cutoff=FUZZY_CUTOFF)
+        if found is None:
+            return None, 0.0
+        _, score, position = found
+        alias_idx = position if indices is None else indices[position]
+        return self._alias_owner[alias_idx], score
+
+    def resolve(self, candidate: Optional[str]) -> Optional[str]:
+        if not candidate:
+            return None
+        idx = self.match_regex(candidate)
+        if idx is not None:
+            return self.names[idx]
+        exact = self.alias_index.get(sort_tokens(candidate))
+        if exact is not None:
+            return exact
+        idx, score = self.match_fuzzy(candidate)
+        if idx is not None and score > FUZZY_CUTOFF:
+            return self.names[idx]
+        return candidate
+
+    def category(self, merchant: Optional[str]) -> Optional[str]:
+        if not merchant:
+            return None
+        record = self.records.get(merchant)
+        return record.get("default_category") if record else None
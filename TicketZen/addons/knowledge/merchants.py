@@ -1,50 +1,208 @@
-import re
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional
 
-import yaml
-from rapidfuzz import fuzz
+if TYPE_CHECKING:
+    from addons.knowledge.matcher import MerchantMatcher
+
+LOGGER = logging.getLogger("ticketzen.knowledge.merchants")
 
 DATA_FILE = Path(__file__).resolve().parents[2] / "data" / "merchants.yml"
+MATCHER_FILE = Path(__file__).resolve().with_name("matcher.py")
+CACHE_VERSION = 1
+_CODE_DIGEST: Optional[str] = None
 
 
-def load_merchants():
-    if DATA_FILE.exists():
-        return yaml.safe_load(DATA_FILE.read_text()) or {}
-    return {"merchants": []}
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
 
 
-DATA = load_merchants()
+def cache_dir() -> Path:
+    return Path(os.getenv("TZ_KNOWLEDGE_CACHE_DIR") or DATA_FILE.parent / ".cache")
 
 
-def resolve_merchant(candidate: Optional[str]) -> Optional[str]:
-    if not candidate:
+class Snapshot(NamedTuple):
+    data: Dict[str, Any]
+    matcher: "MerchantMatcher"
+    digest: str
+    mtime_ns: int
+    loaded_at: float
+
+
+def _matcher_settings() -> Dict[str, Any]:
+    return {key: os.getenv(key) for key in ("TZ_MERCHANT_BLOCKING_MIN", "TZ_MERCHANT_MAX_CANDIDATES")}
+
+
+def _code_digest() -> str:
+    # The pickle holds MerchantMatcher instances: a cache built by another version of matcher.py is not reused.
+    global _CODE_DIGEST
+    if _CODE_DIGEST is None:
+        try:
+            _CODE_DIGEST = hashlib.sha256(MATCHER_FILE.read_bytes()).hexdigest()[:16]
+        except OSError:  # pragma: no cover - defensive
+            _CODE_DIGEST = "unknown"
+    return _CODE_DIGEST
+
+
+def _trusted(cache_path: Path) -> bool:
+    # Unpickling runs code: only load a file this user wrote and nobody else can replace.
+    info, parent = cache_path.stat(), cache_path.parent.stat().st_mode
+    return info.st_uid == os.getuid() and not info.st_mode & 0o022 and (not parent & 0o002 or bool(parent & 0o1000))
+
+
+def _signature(path: Path) -> Optional[os.stat_result]:
+    try:
+        return path.stat()
+    except OSError:
         return None
-    merchants = DATA.get("merchants", [])
-    normalized = candidate.strip().lower()
-    best_match = None
-    best_score = 0
-    for merchant in merchants:
-        canonical = merchant.get("name")
-        aliases = merchant.get("aliases", [])
-        regexes = merchant.get("regex", [])
-        for pattern in regexes:
-            if re.search(pattern, candidate, re.IGNORECASE):
-                return canonical
-        for alias in aliases + [canonical]:
-            score = fuzz.token_sort_ratio(normalized, alias.lower())
-            if score > best_score:
-                best_score = score
-                best_match = canonical
-    if best_score > 60:
-        return best_match
-    return candidate
 
 
-def default_category(merchant: Optional[str]) -> Optional[str]:
-    if not merchant:
+def _read_cache(cache_path: Path, digest: str) -> Optional[Dict[str, Any]]:
+    try:
+        if not _trusted(cache_path):
+            LOGGER.warning("Ignoring knowledge cache %s: writable by other users", cache_path)
+            return None
+        with cache_path.open("rb") as handle:
+            cached = pickle.load(handle)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Ignoring unreadable knowledge cache %s: %s", cache_path, exc)
+        return None
+    if cached.get("version") != CACHE_VERSION or cached.get("digest") != digest or cached.get("code") != _code_digest() or cached.get("settings") != _matcher_settings():
         return None
-    for merch in DATA.get("merchants", []):
-        if merch.get("name") == merchant:
-            return merch.get("default_category")
-    return None
+    return cached
+
+
+def _write_cache(cache_path: Path, payload: Dict[str, Any]):
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as handle:
+            pickle.dump(payload, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+        stem = cache_path.stem.rsplit("-", 1)[0]
+        for stale in [cache_path.with_name(f"{stem}.pickle"), *cache_path.parent.glob(f"{stem}-*.pickle")]:
+            if stale != cache_path and stale.exists():
+                stale.unlink()
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Failed to write knowledge cache: %s", exc)
+
+
+def build_snapshot(path: Path = DATA_FILE, use_cache: bool = True) -> Snapshot:
+    # rapidfuzz and yaml are only needed once the merchants are first used (or to parse a cache miss).
+    from addons.knowledge.matcher import MerchantMatcher
+
+    stat = _signature(path)
+    if stat is None:
+        data: Dict[str, Any] = {"merchants": []}
+        return Snapshot(data, MerchantMatcher([]), "", 0, time.time())
+    raw = path.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    cache_path = cache_dir() / f"{path.stem}-{_code_digest()}.pickle"
+    cached = _read_cache(cache_path, digest) if use_cache else None
+    if cached is not None:
+        return Snapshot(cached["data"], cached["matcher"], digest, stat.st_mtime_ns, time.time())
+    import yaml
+
+    data = yaml.load(raw.decode("utf-8"), Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
+    matcher = MerchantMatcher(data.get("merchants", []))
+    if use_cache:
+        _write_cache(cache_path, {"version": CACHE_VERSION, "digest": digest, "code": _code_digest(), "settings": _matcher_settings(), "data": data, "matcher": matcher})
+    return Snapshot(data, matcher, digest, stat.st_mtime_ns, time.time())
+
+
+class KnowledgeBase:
+    def __init__(self, path: Path = DATA_FILE, check_interval: float = 2.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = time.monotonic()
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def _load(self) -> Snapshot:
+        with self._load_lock:
+            if self._snapshot is None:
+                self._snapshot = build_snapshot(self.path)
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    @property
+    def snapshot(self) -> Snapshot:
+        if self._snapshot is None:
+            return self._load()
+        if self.check_interval > 0 and time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            stat = _signature(self.path)
+            if stat is not None and stat.st_mtime_ns != self._snapshot.mtime_ns:
+                # Rebuild off the request path; callers keep the previous snapshot until the swap.
+                if self._reload_lock.acquire(blocking=False):
+                    threading.Thread(target=self._background_reload, name="tz-knowledge-reload", daemon=True).start()
+        return self._snapshot
+
+    def _background_reload(self):
+        try:
+            self._swap(build_snapshot(self.path))
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Keeping previous merchants after failed reload: %s", exc)
+        finally:
+            self._reload_lock.release()
+
+    def _swap(self, snapshot: Snapshot):
+        previous = self._snapshot
+        self._snapshot = snapshot
+        if previous is not None and snapshot.digest != previous.digest:
+            LOGGER.info("Merchants reloaded: %d entries", len(snapshot.matcher.merchants))
+
+    def reload(self) -> Dict[str, Any]:
+        with self._reload_lock:
+            started = time.time()
+            self._swap(build_snapshot(self.path))
+            self._checked_at = time.monotonic()
+            return {**self.info(), "took_ms": round((time.time() - started) * 1000, 1)}
+
+    def info(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        return {
+            "merchants": len(snapshot.matcher.merchants),
+            "aliases": len(snapshot.matcher.alias_index),
+            "digest": snapshot.digest[:12],
+            "loaded_at": snapshot.loaded_at,
+        }
+
+
+KNOWLEDGE = KnowledgeBase(check_interval=_env_float("TZ_MERCHANTS_CHECK_SEC", 2.0))
+
+
+def __getattr__(name: str):
+    # DATA and MATCHER always reflect the current snapshot, which is built on first use.
+    if name == "DATA":
+        return KNOWLEDGE.snapshot.data
+    if name == "MATCHER":
+        return KNOWLEDGE.snapshot.matcher
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_merchants():
+    return build_snapshot(DATA_FILE, use_cache=False).data
+
+
+def resolve_merchant(candidate: Optional[str]) -> Optional[str]:
+    return KNOWLEDGE.snapshot.matcher.resolve(candidate)
+
+
+def default_category(merchant: Optional[str]) -> Optional[str]:
+    return KNOWLEDGE.snapshot.matcher.category(merchant)
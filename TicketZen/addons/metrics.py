@@ -0,0 +1,183 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, shared by every histogram so the Prometheus output stays aggregatable.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RESERVOIR = 2048
+PREFIX = "ticketzen"
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent: Deque[float] = deque(maxlen=RESERVOIR)
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.recent)
+
+        def pick(pct: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000, 2)
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else None,
+            "p50_ms": pick(50),
+            "p95_ms": pick(95),
+            "p99_ms": pick(99),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+        }
+
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._counters: Dict[Key, float] = {}
+        self._histograms: Dict[Key, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def _timed(self, name: str, labels: Dict[str, str]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timer(self, name: str, **labels: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timed(name, labels)
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return histogram.summary() if histogram else None
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def drain(self) -> Dict[str, Any]:
+        # Hands the samples over (e.g. from a process-pool child to its parent) and starts afresh.
+        with self._lock:
+            counters = [(name, labels, value) for (name, labels), value in self._counters.items()]
+            histograms = [(name, labels, histogram.counts, histogram.total, histogram.count, list(histogram.recent)) for (name, labels), histogram in self._histograms.items()]
+            self._counters.clear()
+            self._histograms.clear()
+        return {"counters": counters, "histograms": histograms}
+
+    def merge(self, drained: Dict[str, Any]):
+        if not self.enabled or not drained:
+            return
+        with self._lock:
+            for name, labels, value in drained.get("counters", ()):
+                self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+            for name, labels, counts, total, count, recent in drained.get("histograms", ()):
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[(name, labels)] = Histogram()
+                histogram.counts = [mine + theirs for mine, theirs in zip(histogram.counts, counts)]
+                histogram.total += total
+                histogram.count += count
+                histogram.recent.extend(recent)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {_label(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            timings = {_label(name, labels): histogram.summary() for (name, labels), histogram in sorted(self._histograms.items())}
+        return {"enabled": self.enabled, "uptime_sec": round(time.time() - self.started_at, 1), "counters": counters, "timings": timings}
+
+    def prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(histogram.counts), histogram.total, histogram.count) for key, histogram in sorted(self._histograms.items())]
+        out: List[str] = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                out.append(f"# TYPE {metric} counter")
+            out.append(f"{metric}{_prom_labels(labels)} {_prom_value(value)}")
+        for (name, labels), counts, total, count in histograms:
+            metric = f"{PREFIX}_{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                out.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{metric}_bucket{_prom_labels(labels + (('le', le),))} {cumulative}")
+            out.append(f"{metric}_sum{_prom_labels(labels)} {total:.6f}")
+            out.append(f"{metric}_count{_prom_labels(labels)} {count}")
+        return "\n".join(out) + "\n"
+
+
+def _label(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _prom_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+METRICS = Registry(enabled=bool(int(os.getenv("TZ_METRICS_ENABLED", "1") or 0)))
+
+incr = METRICS.incr
+observe = METRICS.observe
+timer = METRICS.timer
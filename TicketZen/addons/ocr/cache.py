@@ -0,0 +1,160 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+LOGGER = logging.getLogger("ticketzen.ocr.cache")
+
+CACHE_VERSION = "2"
+
+
+def make_key(content: bytes, scope: str) -> str:
+    # No route or API version: whichever Azure route served the document (tagged azure_route=) is a valid answer for it.
+    digest = hashlib.sha256()
+    digest.update(content)
+    digest.update(f"\0{scope}\0{CACHE_VERSION}".encode())
+    return digest.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, root: Path, max_bytes: int = 512 * 1024 * 1024, max_entries: int = 20000, ttl: float = 30 * 86400):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Tuple[int, float]]] = None
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json.gz"
+
+    def _load_index(self) -> Dict[str, Tuple[int, float]]:
+        if self._index is None:
+            index: Dict[str, Tuple[int, float]] = {}
+            if self.root.exists():
+                for path in self.root.glob("*/*.json.gz"):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    index[path.name[: -len(".json.gz")]] = (stat.st_size, stat.st_mtime)
+            self._index = index
+            self._bytes = sum(size for size, _ in index.values())
+        return self._index
+
+    def _drop(self, key: str):
+        index = self._load_index()
+        size, _ = index.pop(key, (0, 0))
+        self._bytes -= size
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            entry = json.loads(gzip.decompress(path.read_bytes()))
+        except FileNotFoundError:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Corrupted OCR cache entry %s: %s", key, exc)
+            with self._lock:
+                self._drop(key)
+                self._counters["misses"] += 1
+            return None
+        now = time.time()
+        with self._lock:
+            if self.ttl and now - entry.get("created_at", 0) > self.ttl:
+                self._drop(key)
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            index = self._load_index()
+            if key in index:
+                index[key] = (index[key][0], now)
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return entry.get("raw")
+
+    def put(self, key: str, raw: Dict[str, Any]):
+        path = self._path(key)
+        data = gzip.compress(json.dumps({"created_at": time.time(), "raw": raw}, ensure_ascii=False).encode())
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Failed to write OCR cache entry: %s", exc)
+            return
+        with self._lock:
+            index = self._load_index()
+            previous, _ = index.get(key, (0, 0))
+            index[key] = (len(data), time.time())
+            self._bytes += len(data) - previous
+            self._counters["writes"] += 1
+            self._evict()
+
+    def _evict(self):
+        index = self._load_index()
+        if self._bytes <= self.max_bytes and len(index) <= self.max_entries:
+            return
+        for key, _ in sorted(index.items(), key=lambda item: item[1][1]):
+            if self._bytes <= self.max_bytes and len(index) <= self.max_entries:
+                break
+            self._drop(key)
+            self._counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round(self._counters["hits"] / lookups, 3) if lookups else None,
+                **self._counters,
+            }
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def cache_enabled() -> bool:
+    return bool(int(os.getenv("TZ_OCR_CACHE_ENABLED", "1")))
+
+
+_CACHES: Dict[str, OcrCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_cache(base_dir: Path) -> OcrCache:
+    root = Path(base_dir) / "ocr_cache"
+    with _CACHES_LOCK:
+        cache = _CACHES.get(str(root))
+        if cache is None:
+            cache = _CACHES[str(root)] = OcrCache(
+                root,
+                max_bytes=int(_env_float("TZ_OCR_CACHE_MAX_MB", 512) * 1024 * 1024),
+                max_entries=int(_env_float("TZ_OCR_CACHE_MAX_ENTRIES", 20000)),
+                ttl=_env_float("TZ_OCR_CACHE_TTL_DAYS", 30) * 86400,
+            )
+        return cache
@@ -0,0 +1,166 @@
+import re
+from datetime import date
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+AMOUNT_RE = re.compile(r"(?<![\d.,/])(-?\d{1,3}(?:[ \u00a0\u202f.]\d{3})+|-?\d+)[,.](\d{2})(?!\d|[./-]\d)")
+DATE_NUMERIC_RE = re.compile(r"(?<!\d)(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4}|\d{2})(?!\d)")
+DATE_ISO_RE = re.compile(r"(?<!\d)(20\d{2})-(\d{2})-(\d{2})(?!\d)")
+DATE_WORDS_RE = re.compile(r"(?<!\d)(\d{1,2})\s+(janv?|fevr?|mars|avr|mai|juin|juil|aout|sept?|oct|nov|dec)[a-z]*\.?\s+(\d{4})")
+MONTHS = {"jan": 1, "janv": 1, "fev": 2, "fevr": 2, "mars": 3, "avr": 4, "mai": 5, "juin": 6, "juil": 7, "aout": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12}
+
+# Tolerates the usual OCR confusions on the label itself (T0TAL, 4 PAYER).
+TOTAL_STRONG_RE = re.compile(r"\b(t[o0]t[a4]l\s*ttc|net\s*[a4]\s*p[a4]yer|[a4]\s*p[a4]yer|m[o0]nt[a4]nt\s*ttc|t[o0]t[a4]l\s*[a4]\s*p[a4]yer|t[o0]t[a4]l\s*eur|t[o0]t[a4]l)\b")
+TOTAL_WEAK_RE = re.compile(r"\b(ttc|montant|cb|carte|especes|paiement|eur)\b")
+TOTAL_NEGATIVE_RE = re.compile(r"\b(tva|h\.?t|sous[\s-]*total|rendu|monnaie|remise|economie|avantage|points?|fidelite|articles?|qte|quantite|taux)\b")
+DATE_KEYWORD_RE = re.compile(r"\b(date|le|du)\b")
+TIME_RE = re.compile(r"\b\d{1,2}[:h]\d{2}\b")
+
+ACCENTS = str.maketrans("àâäáéèêëîïíôöóùûüúçÀÂÄÁÉÈÊËÎÏÍÔÖÓÙÛÜÚÇ", "aaaaeeeeiiiooouuuucAAAAEEEEIIIOOOUUUUC")
+
+SAME_ROW = 0.012
+MAX_AMOUNT = 100000.0
+THOUSANDS_RE = re.compile(r"[ \u00a0\u202f.]")
+
+
+class Candidate(NamedTuple):
+    value: Any
+    score: float
+    line: int
+
+
+def _fold(text: str) -> str:
+    return text.translate(ACCENTS).lower()
+
+
+def parse_amount(text: Optional[str]) -> Optional[float]:
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return float(text)
+    match = AMOUNT_RE.search(text)
+    if not match:
+        digits = text.strip().replace("€", "").strip()
+        return int(digits) / 100 if digits.isdigit() else None
+    return _amount_value(match)
+
+
+def _amount_value(match: re.Match) -> Optional[float]:
+    whole = THOUSANDS_RE.sub("", match.group(1))
+    try:
+        return float(f"{whole}.{match.group(2)}")
+    except ValueError:
+        return None
+
+
+def _valid_date(year: int, month: int, day: int, today: date) -> Optional[date]:
+    if year < 100:
+        year += 2000
+    try:
+        parsed = date(year, month, day)
+    except ValueError:
+        return None
+    if parsed.year < 2000 or (parsed - today).days > 1:
+        return None
+    return parsed
+
+
+def _dates_in(folded: str, today: date) -> List[Tuple[date, float]]:
+    found = []
+    for match in DATE_NUMERIC_RE.finditer(folded):
+        day, month, year = (int(part) for part in match.groups())
+        parsed = _valid_date(year, month, day, today)
+        if parsed:
+            found.append((parsed, 1.0 if len(match.group(3)) == 4 else 0.8))
+    for match in DATE_ISO_RE.finditer(folded):
+        year, month, day = (int(part) for part in match.groups())
+        parsed = _valid_date(year, month, day, today)
+        if parsed:
+            found.append((parsed, 1.0))
+    for match in DATE_WORDS_RE.finditer(folded):
+        parsed = _valid_date(int(match.group(3)), MONTHS.get(match.group(2), 0), int(match.group(1)), today)
+        if parsed:
+            found.append((parsed, 0.9))
+    return found
+
+
+def parse_date(text: Optional[str], today: Optional[date] = None) -> Optional[str]:
+    if not text:
+        return None
+    found = _dates_in(_fold(text), today or date.today())
+    return found[0][0].isoformat() if found else None
+
+
+def _rows(lines: List[Dict[str, Any]], texts: str) -> List[Tuple[str, float]]:
+    if lines:
+        return [(_fold(line.get("text") or ""), float(line.get("y_norm") or 0.0)) for line in lines]
+    raw = [line for line in (texts or "").splitlines() if line.strip()]
+    count = max(1, len(raw))
+    return [(_fold(line), idx / count) for idx, line in enumerate(raw)]
+
+
+def _items_sum(items: Optional[List[Dict[str, Any]]]) -> Optional[float]:
+    if not items:
+        return None
+    total = 0.0
+    for item in items:
+        value = parse_amount(item.get("price")) if isinstance(item, dict) else None
+        if value is None:
+            return None
+        total += value
+    return round(total, 2)
+
+
+def extract(lines: List[Dict[str, Any]], texts: str = "", items: Optional[List[Dict[str, Any]]] = None, today: Optional[date] = None) -> Dict[str, Any]:
+    rows = _rows(lines, texts)
+    today = today or date.today()
+    items_total = _items_sum(items)
+    keyword_rows: Dict[int, float] = {}
+    negative_rows = set()
+    amounts: List[Tuple[float, int]] = []
+    dates: List[Candidate] = []
+    for idx, (folded, y_norm) in enumerate(rows):
+        if TOTAL_NEGATIVE_RE.search(folded):
+            negative_rows.add(idx)
+        if TOTAL_STRONG_RE.search(folded):
+            keyword_rows[idx] = 5.0
+        elif TOTAL_WEAK_RE.search(folded):
+            keyword_rows[idx] = 2.0
+        for match in AMOUNT_RE.finditer(folded):
+            value = _amount_value(match)
+            if value is not None and 0 < value < MAX_AMOUNT:
+                amounts.append((value, idx))
+        for parsed, quality in _dates_in(folded, today):
+            score = quality + (1.5 if DATE_KEYWORD_RE.search(folded) else 0.0) + (0.5 if TIME_RE.search(folded) else 0.0) + (1.0 - y_norm) * 0.5
+            dates.append(Candidate(parsed.isoformat(), score, idx))
+
+    occurrences: Dict[float, int] = {}
+    for value, _ in amounts:
+        occurrences[value] = occurrences.get(value, 0) + 1
+    largest = max((value for value, _ in amounts), default=None)
+    totals: List[Candidate] = []
+    for value, idx in amounts:
+        y_norm = rows[idx][1]
+        score = keyword_rows.get(idx, 0.0)
+        # Labels and amounts often come back as separate OCR lines on the same printed row.
+        for other in (idx - 1, idx + 1):
+            if other in keyword_rows and abs(rows[other][1] - y_norm) <= SAME_ROW and other not in negative_rows:
+                score = max(score, keyword_rows[other] - 0.5)
+        if idx in negative_rows:
+            score -= 4.0
+        score += y_norm
+        if occurrences[value] > 1:
+            score += 1.5
+        if items_total is not None and abs(items_total - value) < 0.011:
+            score += 3.0
+        if value == largest:
+            score += 0.5
+        totals.append(Candidate(value, score, idx))
+
+    best_total = max(totals, key=lambda candidate: (candidate.score, candidate.line), default=None)
+    best_date = max(dates, key=lambda candidate: (candidate.score, -candidate.line), default=None)
+    return {
+        "total": best_total.value if best_total else None,
+        "total_score": round(best_total.score, 2) if best_total else None,
+        "date": best_date.value if best_date else None,
+        "date_score": round(best_date.score, 2) if best_date else None,
+    }
@@ -0,0 +1,51 @@
+import io
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover - optional dependency
+    PdfReader = PdfWriter = None
+
+LOGGER = logging.getLogger("ticketzen.ocr.pdf")
+
+
+class PdfPage(NamedTuple):
+    number: int
+    content: bytes
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def pdf_config() -> Dict[str, Any]:
+    return {
+        "split": bool(_env_int("TZ_PDF_SPLIT", 1)),
+        "concurrency": max(1, _env_int("TZ_PDF_PAGE_CONCURRENCY", 4)),
+        "max_pages": max(1, _env_int("TZ_PDF_MAX_PAGES", 50)),
+    }
+
+
+def split_pages(content: bytes, max_pages: int = 50) -> List[PdfPage]:
+    # Without pypdf the document goes to Azure in one call: asking for each page separately would
+    # upload the whole file once per page.
+    if PdfReader is None:
+        return [PdfPage(1, content)]
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        pages = []
+        for number, page in enumerate(reader.pages[:max_pages], start=1):
+            writer = PdfWriter()
+            writer.add_page(page)
+            out = io.BytesIO()
+            writer.write(out)
+            pages.append(PdfPage(number, out.getvalue()))
+        return pages
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("pypdf split failed, analyzing the whole document at once: %s", exc)
+        return [PdfPage(1, content)]
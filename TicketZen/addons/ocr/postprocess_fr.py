@@ -4,11 +4,11 @@ import re
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from rapidfuzz import fuzz
-
 from addons.knowledge import merchants as merch_knowledge
 from addons.knowledge import header_name
+from addons import metrics
 from addons.classify import categories
+from addons.ocr import extract_fr
 
 LOGGER = logging.getLogger("ticketzen.postprocess")
 
@@ -18,6 +18,8 @@ def dump_json(payload: Dict[str, Any]) -> str:
 
 
 def _parse_amount_fr(text: Optional[str]) -> Optional[float]:
+    if isinstance(text, (int, float)):
+        return float(text)
     if not text:
         return None
     txt = text.strip().replace(" ", "")
@@ -43,7 +45,7 @@ def _parse_date(text: Optional[str]) -> Optional[str]:
             return datetime.strptime(text.strip(), fmt).date().isoformat()
         except ValueError:
             continue
-    return None
+    return extract_fr.parse_date(text)
 
 
 def _extract_header(meta_lines: List[Dict[str, Any]], heuristics: Dict[str, Any]) -> Optional[str]:
@@ -65,11 +67,15 @@ def normalize_result(raw: Dict[str, Any]) -> Dict[str, Any]:
     }
     fields = raw.get("fields", {})
     merchant_name = fields.get("merchant")
-    header_candidate = _extract_header(raw.get("meta", {}).get("lines", []), heuristics)
-    merchant = merch_knowledge.resolve_merchant(merchant_name or header_candidate)
-    total = _parse_amount_fr(fields.get("total") or raw.get("texts"))
-    date_achat = _parse_date(fields.get("date_achat"))
+    with metrics.timer("merchant_resolve"):
+        header_candidate = _extract_header(raw.get("meta", {}).get("lines", []), heuristics)
+        merchant = merch_knowledge.resolve_merchant(merchant_name or header_candidate)
     lignes = fields.get("lignes") or []
+    extracted = extract_fr.extract(raw.get("meta", {}).get("lines", []), raw.get("texts", ""), lignes)
+    total = _parse_amount_fr(fields.get("total"))
+    if total is None:
+        total = extracted["total"]
+    date_achat = _parse_date(fields.get("date_achat")) or extracted["date"]
     category = categories.categorize(merchant)
     return {
         "merchant": merchant,
@@ -0,0 +1,214 @@
+import io
+import json
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+if TYPE_CHECKING:  # PIL is imported on first use to keep it out of the startup path.
+    from PIL import Image
+
+LOGGER = logging.getLogger("ticketzen.ocr.preprocess")
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".heic"}
+CROP_MIN_AREA = 0.2
+CROP_MARGIN = 0.02
+PREVIEW_SIDE = 800
+PREVIEW_SIZES = (320, 800, 1600)
+EXIF_ORIENTATION = 0x0112
+# (miroir, rotation horaire) <-> valeur EXIF Orientation
+ORIENTATIONS = {(False, 0): 1, (True, 0): 2, (False, 180): 3, (True, 180): 4, (True, 270): 5, (False, 90): 6, (True, 90): 7, (False, 270): 8}
+ORIENTATION_PARTS = {value: key for key, value in ORIENTATIONS.items()}
+
+
+def preprocess_config() -> Dict[str, Any]:
+    return {
+        "enabled": bool(int(os.getenv("TZ_OCR_PREPROCESS", "1"))),
+        "max_side": int(os.getenv("TZ_OCR_MAX_SIDE", "2000")),
+        "quality": int(os.getenv("TZ_OCR_JPEG_QUALITY", "80")),
+        "grayscale": bool(int(os.getenv("TZ_OCR_GRAYSCALE", "1"))),
+        "crop": bool(int(os.getenv("TZ_OCR_CROP", "0"))),
+    }
+
+
+def _crop_box(img: "Image.Image") -> Optional[Tuple[int, int, int, int]]:
+    from PIL import ImageOps
+
+    probe = img.convert("L")
+    probe.thumbnail((256, 256))
+    probe = ImageOps.autocontrast(probe, cutoff=2)
+    mask = probe.point(lambda value: 255 if value > 170 else 0)
+    box = mask.getbbox()
+    if not box:
+        return None
+    sx, sy = img.width / probe.width, img.height / probe.height
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) < CROP_MIN_AREA * probe.width * probe.height:
+        return None
+    mx, my = int(img.width * CROP_MARGIN), int(img.height * CROP_MARGIN)
+    return (max(0, int(left * sx) - mx), max(0, int(top * sy) - my), min(img.width, int(right * sx) + mx), min(img.height, int(bottom * sy) + my))
+
+
+def normalize_rotation(degrees: Any) -> int:
+    return int(round(float(degrees or 0))) % 360
+
+
+def _rotate(img: "Image.Image", rotation: int) -> "Image.Image":
+    # Applied on the downscaled image: multiples of 90 are pure transposes, other angles resample once.
+    return img.rotate(rotation, expand=True, fillcolor="white") if rotation else img
+
+
+def prepare_image(content: bytes, max_side: int = 2000, quality: int = 80, grayscale: bool = True, crop: bool = False, rotation: int = 0) -> bytes:
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(content))
+    if img.format == "JPEG":
+        img.draft("L" if grayscale else "RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if crop:
+        box = _crop_box(img)
+        if box:
+            img = img.crop(box)
+    img = img.convert("L") if grayscale else img.convert("RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    img = _rotate(img, rotation)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _exif_segment(content: bytes) -> Optional[Tuple[int, int]]:
+    pos = 2
+    while pos + 4 <= len(content) and content[pos] == 0xFF:
+        marker = content[pos + 1]
+        if marker in (0xD9, 0xDA):
+            break
+        length = int.from_bytes(content[pos + 2 : pos + 4], "big")
+        if marker == 0xE1 and content[pos + 4 : pos + 10] == b"Exif\x00\x00":
+            return pos, length
+        pos += 2 + length
+    return None
+
+
+def _orientation_offset(tiff: bytes) -> Optional[int]:
+    order = "little" if tiff[:2] == b"II" else "big"
+    ifd = int.from_bytes(tiff[4:8], order)
+    count = int.from_bytes(tiff[ifd : ifd + 2], order)
+    for idx in range(count):
+        entry = ifd + 2 + idx * 12
+        if int.from_bytes(tiff[entry : entry + 2], order) == EXIF_ORIENTATION:
+            return entry + 8
+    return None
+
+
+def orient_jpeg(content: bytes, rotation: int) -> Optional[bytes]:
+    # Lossless: only the EXIF Orientation tag changes, the compressed scan is copied byte for byte.
+    if rotation % 90 or content[:2] != b"\xff\xd8":
+        return None
+    found = _exif_segment(content)
+    if found is None:
+        tiff = bytearray(b"MM\x00*\x00\x00\x00\x08\x00\x01" + EXIF_ORIENTATION.to_bytes(2, "big") + b"\x00\x03\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00\x00\x00")
+        offset, current = 18, 1
+        insert_at = 2 + 2 + int.from_bytes(content[4:6], "big") if content[2:4] == b"\xff\xe0" else 2
+        head, tail = content[:insert_at], content[insert_at:]
+    else:
+        start, length = found
+        tiff = bytearray(content[start + 10 : start + 2 + length])
+        offset = _orientation_offset(tiff)
+        if offset is None:
+            return None
+        order = "little" if tiff[:2] == b"II" else "big"
+        current = int.from_bytes(tiff[offset : offset + 2], order)
+        head, tail = content[:start], content[start + 2 + length :]
+    order = "little" if tiff[:2] == b"II" else "big"
+    mirror, clockwise = ORIENTATION_PARTS.get(current, (False, 0))
+    tiff[offset : offset + 2] = ORIENTATIONS[(mirror, (clockwise - rotation) % 360)].to_bytes(2, order)
+    segment = b"Exif\x00\x00" + bytes(tiff)
+    return head + b"\xff\xe1" + (len(segment) + 2).to_bytes(2, "big") + segment + tail
+
+
+def _reencode(content: bytes, rotation: int) -> Tuple[bytes, str]:
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(content))
+    is_jpeg = img.format == "JPEG"
+    img = _rotate(ImageOps.exif_transpose(img), rotation)
+    out = io.BytesIO()
+    if is_jpeg:
+        img.convert("RGB").save(out, format="JPEG", quality=95)
+        return out.getvalue(), "image/jpeg"
+    img.save(out, format="PNG")
+    return out.getvalue(), "image/png"
+
+
+def oriented_original(content: bytes, content_type: str, rotation: int) -> Tuple[bytes, str]:
+    if not rotation:
+        return content, content_type
+    lossless = orient_jpeg(content, rotation)
+    if lossless is not None:
+        return lossless, content_type
+    return _reencode(content, rotation)
+
+
+def load_ocr_input(folder: Path, original: Path, content_type: str, config: Optional[Dict[str, Any]] = None, rotation: int = 0) -> Tuple[bytes, str]:
+    config = config or preprocess_config()
+    rotation = normalize_rotation(rotation)
+    if original.suffix.lower() not in IMAGE_SUFFIXES:
+        return original.read_bytes(), content_type
+    if not config.get("enabled"):
+        return oriented_original(original.read_bytes(), content_type, rotation)
+    derived = folder / "ocr_input.jpg"
+    manifest = folder / "ocr_input.json"
+    settings = {key: config[key] for key in ("max_side", "quality", "grayscale", "crop")}
+    settings["rotation"] = rotation
+    source_mtime = original.stat().st_mtime
+    try:
+        if manifest.exists():
+            meta = json.loads(manifest.read_text())
+            if meta.get("source_mtime") == source_mtime and meta.get("settings") == settings:
+                if meta.get("passthrough"):
+                    return oriented_original(original.read_bytes(), content_type, rotation)
+                return derived.read_bytes(), "image/jpeg"
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Ignoring stale OCR input manifest: %s", exc)
+    content = original.read_bytes()
+    try:
+        prepared = prepare_image(content, **settings)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Preprocessing failed for %s, sending original: %s", original.name, exc)
+        return content, content_type
+    passthrough = content if not rotation else orient_jpeg(content, rotation)
+    if passthrough is not None and len(prepared) >= len(passthrough):
+        manifest.write_text(json.dumps({"source_mtime": source_mtime, "settings": settings, "passthrough": True}))
+        return passthrough, content_type
+    derived.write_bytes(prepared)
+    manifest.write_text(json.dumps({"source_mtime": source_mtime, "settings": settings, "bytes_in": len(content), "bytes_out": len(prepared)}))
+    LOGGER.info("Preprocessed %s: %d -> %d bytes", original.name, len(content), len(prepared))
+    return prepared, "image/jpeg"
+
+
+def render_preview(folder: Path, original: Path, rotation: int = 0, size: int = PREVIEW_SIDE) -> Path:
+    from PIL import Image, ImageOps
+
+    rotation = normalize_rotation(rotation)
+    target = folder / f"preview_{size}.jpg"
+    manifest = folder / f"preview_{size}.json"
+    key = {"source_mtime": original.stat().st_mtime, "rotation": rotation}
+    try:
+        if target.exists() and manifest.exists() and json.loads(manifest.read_text()) == key:
+            return target
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("Ignoring stale preview manifest: %s", exc)
+    img = Image.open(original)
+    if img.format == "JPEG":
+        # DCT scaling decodes at 1/2, 1/4 or 1/8 resolution straight from the compressed data.
+        img.draft("RGB", (size, size))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((size, size), Image.BICUBIC, reducing_gap=2.0)
+    img = _rotate(img.convert("RGB"), rotation)
+    partial = target.with_suffix(".part")
+    img.save(partial, format="JPEG", quality=80)
+    os.replace(partial, target)
+    manifest.write_text(json.dumps(key))
+    return target
@@ -1,26 +1,29 @@
-import json
 import logging
-from pathlib import Path
-from typing import Any, Dict, List
+import time
+from typing import Any, Dict, List, Optional
 
-import requests
+from addons import metrics
+from addons.ocr.providers import debug_capture, poller, route_health, transport
 
 DEFAULT_WARNINGS = ["azure_route=documentintelligence", "azure_api=2024-07-31"]
+# Rejets liés au document lui-même (image illisible, format) : ils ne disent rien de la santé de la route.
+DOCUMENT_ERROR_STATUSES = {400, 413, 415}
 
 
-def _request_azure(content: bytes, content_type: str, endpoint: str, api_path: str, key: str, timeout: int, logger: logging.Logger):
+def _call_azure(content: bytes, content_type: str, endpoint: str, api_path: str, key: str, deadline: float) -> Dict[str, Any]:
     headers = {
         "Ocp-Apim-Subscription-Key": key,
         "Content-Type": content_type,
     }
     url = f"{endpoint.rstrip('/')}/{api_path.lstrip('/')}"
-    try:
-        resp = requests.post(url, headers=headers, data=content, timeout=timeout)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as exc:  # pragma: no cover - defensive
-        logger.warning("Azure request failed for %s: %s", api_path, exc)
-        return None
+    resp = transport.get_transport().request("POST", url, headers=headers, data=content, read_timeout=max(1.0, deadline - time.time()), deadline=deadline)
+    resp.raise_for_status()
+    operation_url = resp.headers.get("Operation-Location")
+    if resp.status_code == 202 and operation_url:
+        remaining = max(1.0, deadline - time.time())
+        retry_after = transport.retry_after_seconds(resp.headers)
+        return poller.get_poller().wait(operation_url, {"Ocp-Apim-Subscription-Key": key}, remaining, retry_after)
+    return resp.json()
 
 
 def _azure_paths(route: str, api_version: str) -> List[str]:
@@ -59,7 +62,10 @@ def _normalize_v21(resp: Dict[str, Any]) -> Dict[str, Any]:
         if total_field:
             total = total_field.get("text") or total_field.get("valueNumber")
         items = []
-        for item in fields.get("Items", []):
+        items_field = fields.get("Items") or []
+        if isinstance(items_field, dict):
+            items_field = items_field.get("valueArray") or []
+        for item in items_field:
             if isinstance(item, dict):
                 name = item.get("valueObject", {}).get("Name", {}).get("text") or item.get("text")
                 price = item.get("valueObject", {}).get("TotalPrice", {}).get("text")
@@ -73,16 +79,25 @@ def _normalize_v21(resp: Dict[str, Any]) -> Dict[str, Any]:
     return result
 
 
+def _line_top(line: Dict[str, Any]) -> float:
+    polygon = line.get("polygon")
+    if polygon and isinstance(polygon[0], (int, float)):
+        return polygon[1] if len(polygon) > 1 else 0
+    bounding = line.get("boundingPolygon") or polygon or [{}]
+    return bounding[0].get("y", 0)
+
+
 def _normalize_azure(resp: Dict[str, Any]) -> Dict[str, Any]:
-    documents = resp.get("documents") or resp.get("analyzeResult", {}).get("documents") or []
-    texts = resp.get("content", "")
+    body = resp.get("analyzeResult") or resp
+    documents = body.get("documents") or []
+    texts = body.get("content", "")
     lines_meta = []
-    pages = resp.get("pages", [])
+    pages = body.get("pages", [])
     for page in pages:
         page_num = page.get("pageNumber") or page.get("page") or 1
         height = page.get("height") or 1
         for line in page.get("lines", []):
-            y_norm = (line.get("boundingPolygon", [{}])[0].get("y", 0) / height) if height else 0
+            y_norm = (_line_top(line) / height) if height else 0
             lines_meta.append({"text": line.get("content", ""), "y_norm": y_norm, "page": page_num})
     fields = {}
     if documents:
@@ -128,18 +143,28 @@ def analyze_document(content: bytes, content_type: str, config: Dict[str, Any],
         "formrecognizer_v21": "v2.1",
     }
 
-    for route in ordered_routes:
-        paths = _azure_paths(route, config.get("api_version", api_versions.get(route, "v2.1")))
-        for path in paths:
-            response = _request_azure(content, content_type, config.get("endpoint", ""), path, config.get("key", ""), config.get("timeout", 90), logger)
-            if response:
-                if route == "formrecognizer_v21":
-                    normalized = _normalize_v21(response)
-                else:
-                    normalized = _normalize_azure(response)
-                normalized["warnings"].append(f"azure_route={route}")
-                normalized["warnings"].append(f"azure_api={config.get('api_version', api_versions.get(route))}")
-                _save_debug(normalized)
+    endpoint = config.get("endpoint", "")
+    health = route_health.ROUTE_HEALTH
+    # One budget for the whole document: a fallback route only gets what the previous ones left.
+    deadline = config.get("deadline") or time.time() + config.get("timeout", 90)
+    attempted = False
+    for route in health.order(endpoint, ordered_routes):
+        if time.time() >= deadline:
+            logger.warning("Azure deadline reached; not trying route %s", route)
+            break
+        if not health.allow(endpoint, route):
+            logger.info("Skipping Azure route %s: circuit open", route)
+            continue
+        attempted = True
+        normalized = _try_route(content, content_type, config, route, api_versions, logger, deadline)
+        if normalized:
+            return normalized
+    if not attempted and time.time() < deadline:
+        route = health.force_probe(endpoint, ordered_routes)
+        if route:
+            logger.info("All Azure routes open; probing %s", route)
+            normalized = _try_route(content, content_type, config, route, api_versions, logger, deadline)
+            if normalized:
                 return normalized
     fallback = {
         "fields": {"merchant": None, "date_achat": None, "total": None, "lignes": []},
@@ -148,14 +173,43 @@ def analyze_document(content: bytes, content_type: str, config: Dict[str, Any],
         "meta": {"lines": []},
         "warnings": ["azure_all_failed"],
     }
-    _save_debug(fallback)
+    debug_capture.record("all", normalized=fallback, error="azure_all_failed", content_type=content_type, size=len(content))
     return fallback
 
 
-def _save_debug(payload: Dict[str, Any]):
-    try:
-        Path("last_azure.json").write_text(json.dumps(payload, ensure_ascii=False, indent=2))
-        if payload.get("meta"):
-            Path("last_azure_meta.json").write_text(json.dumps(payload.get("meta"), ensure_ascii=False, indent=2))
-    except Exception:  # pragma: no cover - defensive
-        pass
+def _try_route(content: bytes, content_type: str, config: Dict[str, Any], route: str, api_versions: Dict[str, str], logger: logging.Logger, deadline: float) -> Optional[Dict[str, Any]]:
+    endpoint = config.get("endpoint", "")
+    for path in _azure_paths(route, config.get("api_version", api_versions.get(route, "v2.1"))):
+        if time.time() >= deadline:
+            return None
+        if config.get("pages"):
+            path = f"{path}&pages={config['pages']}"
+        started = time.time()
+        try:
+            with metrics.timer("azure_route", route=route):
+                response = _call_azure(content, content_type, endpoint, path, config.get("key", ""), deadline)
+        except Exception as exc:
+            logger.warning("Azure request failed for %s: %s", path, exc)
+            debug_capture.record(route, error=str(exc)[:500], content_type=content_type, size=len(content), duration_ms=round((time.time() - started) * 1000, 1))
+            status = getattr(getattr(exc, "response", None), "status_code", None)
+            metrics.incr("azure_route_failures", route=route)
+            if status in DOCUMENT_ERROR_STATUSES:
+                route_health.ROUTE_HEALTH.record_neutral(endpoint, route)
+            else:
+                route_health.ROUTE_HEALTH.record_failure(endpoint, route, str(exc)[:200])
+            continue
+        if not response:
+            metrics.incr("azure_route_failures", route=route)
+            route_health.ROUTE_HEALTH.record_failure(endpoint, route, "réponse vide")
+            continue
+        route_health.ROUTE_HEALTH.record_success(endpoint, route)
+        if route == "formrecognizer_v21":
+            normalized = _normalize_v21(response)
+        else:
+            normalized = _normalize_azure(response)
+        normalized["warnings"].append(f"azure_route={route}")
+        normalized["warnings"].append(f"azure_api={config.get('api_version', api_versions.get(route))}")
+        debug_capture.record(route, raw=response, normalized=normalized, content_type=content_type, size=len(content), duration_ms=round((time.time() - started) * 1000, 1))
+        return normalized
+    return None
+
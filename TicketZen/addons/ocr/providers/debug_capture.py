@@ -0,0 +1,208 @@
+import atexit
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+LOGGER = logging.getLogger("ticketzen.ocr.debug_capture")
+
+ARCHIVE_PREFIX = "ocr-"
+ARCHIVE_SUFFIX = ".jsonl.gz"
+SUMMARY_FIELDS = ("id", "ts", "pid", "route", "content_type", "size", "duration_ms", "error", "warnings", "bytes", "truncated")
+
+
+class DebugCapture:
+    # Recent OCR payloads kept in memory; sampled captures are serialised once on the calling thread
+    # (the normalized dict keeps changing afterwards) and written to gzip archives by a background thread.
+    def __init__(self, ring_size: int = 50, sample_rate: float = 0.05, max_entry_bytes: int = 256 * 1024, archive_bytes: int = 5 * 1024 * 1024, archive_keep: int = 10, flush_interval: float = 5.0):
+        self.ring_size = max(1, ring_size)
+        self.sample_rate = sample_rate
+        self.max_entry_bytes = max_entry_bytes
+        self.archive_bytes = archive_bytes
+        self.archive_keep = max(1, archive_keep)
+        self.flush_interval = flush_interval
+        self.archive_dir: Optional[Path] = None
+        self._ring: Deque[Dict[str, Any]] = deque(maxlen=self.ring_size)
+        self._pending: Deque[Dict[str, Any]] = deque(maxlen=self.ring_size * 4)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._archive: Optional[Path] = None
+        self._counters = {"seen": 0, "captured": 0, "truncated": 0, "archived": 0, "dropped": 0, "flush_errors": 0}
+
+    def configure(self, archive_dir: Optional[Path]):
+        with self._lock:
+            self.archive_dir = Path(archive_dir) if archive_dir else None
+            self._archive = None
+
+    def record(self, route: str, raw: Any = None, normalized: Any = None, error: Optional[str] = None, **info: Any) -> Optional[int]:
+        with self._lock:
+            self._counters["seen"] += 1
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return None
+        payload = json.dumps({"raw": raw, "normalized": normalized}, ensure_ascii=False, default=str)
+        truncated = len(payload) > self.max_entry_bytes
+        if truncated:
+            # The raw response is what grows (per-word geometry); keep the normalized view if it fits.
+            payload = json.dumps({"raw": None, "normalized": normalized}, ensure_ascii=False, default=str)
+            if len(payload) > self.max_entry_bytes:
+                payload = None
+        entry = {
+            "id": next(self._ids),
+            "ts": time.time(),
+            "pid": os.getpid(),
+            "route": route,
+            "error": error,
+            "warnings": list((normalized or {}).get("warnings") or []) if isinstance(normalized, dict) else [],
+            "bytes": len(payload) if payload else 0,
+            "truncated": truncated,
+            **info,
+            "payload": payload,
+        }
+        with self._lock:
+            self._counters["captured"] += 1
+            self._counters["truncated"] += truncated
+            self._ring.append(entry)
+            if self.archive_dir is not None:
+                if len(self._pending) == self._pending.maxlen:
+                    self._counters["dropped"] += 1
+                self._pending.append(entry)
+                if len(self._pending) >= self._pending.maxlen // 2:
+                    self._wake.set()
+                self._ensure_thread()
+        return entry["id"]
+
+    def _ensure_thread(self):
+        # Also restarts the writer in a forked worker, where the parent's thread no longer runs.
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="tz-ocr-debug", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _archive_path(self) -> Path:
+        suffix = f"-{os.getpid()}{ARCHIVE_SUFFIX}"
+        # One file per process, so concurrent workers never interleave writes in the same gzip stream.
+        if self._archive is None or not self._archive.name.endswith(suffix) or not self._archive.exists() or self._archive.stat().st_size >= self.archive_bytes:
+            self._archive = self.archive_dir / f"{ARCHIVE_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}{suffix}"
+            self._prune()
+        return self._archive
+
+    def _prune(self):
+        archives = sorted(self.archive_dir.glob(f"{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+        for path in archives[: max(0, len(archives) - self.archive_keep + 1)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch or self.archive_dir is None:
+                return 0
+            lines = []
+            for entry in batch:
+                head = json.dumps({key: value for key, value in entry.items() if key != "payload"}, ensure_ascii=False, default=str)
+                # The payload is already JSON text: splice it in rather than parsing it back.
+                lines.append(f"{head[:-1]}, \"payload\": {entry['payload'] or 'null'}}}\n")
+            try:
+                self.archive_dir.mkdir(parents=True, exist_ok=True)
+                # Each flush appends one gzip member; gzip readers see the concatenation as a single stream.
+                with gzip.open(self._archive_path(), "at", encoding="utf-8") as handle:
+                    handle.writelines(lines)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.warning("OCR debug archive write failed: %s", exc)
+                with self._lock:
+                    self._counters["flush_errors"] += 1
+                return 0
+            with self._lock:
+                self._counters["archived"] += len(batch)
+            return len(batch)
+
+    def entries(self, limit: int = 50, route: Optional[str] = None, errors_only: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            ring = list(self._ring)
+        picked = [entry for entry in reversed(ring) if (route is None or entry["route"] == route) and (not errors_only or entry["error"])]
+        return [{key: entry.get(key) for key in SUMMARY_FIELDS} for entry in picked[: max(1, limit)]]
+
+    def entry(self, capture_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            found = next((entry for entry in self._ring if entry["id"] == capture_id), None)
+        if found is None:
+            return None
+        payload = json.loads(found["payload"]) if found["payload"] else {"raw": None, "normalized": None}
+        return {**{key: found.get(key) for key in SUMMARY_FIELDS}, **payload}
+
+    def archives(self) -> List[Dict[str, Any]]:
+        if self.archive_dir is None or not self.archive_dir.exists():
+            return []
+        files = sorted(self.archive_dir.glob(f"{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}"), key=lambda path: path.stat().st_mtime, reverse=True)
+        return [{"name": path.name, "bytes": path.stat().st_size, "modified": path.stat().st_mtime} for path in files]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "ring_size": self.ring_size,
+                "buffered": len(self._ring),
+                "pending": len(self._pending),
+                "archive_dir": str(self.archive_dir) if self.archive_dir else None,
+                **self._counters,
+            }
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+_CAPTURE: Optional[DebugCapture] = None
+_CAPTURE_LOCK = threading.Lock()
+
+
+def get_capture() -> DebugCapture:
+    global _CAPTURE
+    if _CAPTURE is None:
+        with _CAPTURE_LOCK:
+            if _CAPTURE is None:
+                _CAPTURE = DebugCapture(
+                    ring_size=int(_env_float("TZ_OCR_DEBUG_RING", 50)),
+                    sample_rate=_env_float("TZ_OCR_DEBUG_SAMPLE", 0.05),
+                    max_entry_bytes=int(_env_float("TZ_OCR_DEBUG_MAX_KB", 256) * 1024),
+                    archive_bytes=int(_env_float("TZ_OCR_DEBUG_ARCHIVE_MB", 5) * 1024 * 1024),
+                    archive_keep=int(_env_float("TZ_OCR_DEBUG_ARCHIVE_KEEP", 10)),
+                    flush_interval=_env_float("TZ_OCR_DEBUG_FLUSH_SEC", 5),
+                )
+                atexit.register(_CAPTURE.flush)
+    return _CAPTURE
+
+
+def configure(base_dir: Path) -> DebugCapture:
+    capture = get_capture()
+    capture.configure(Path(base_dir) / "debug" if os.getenv("TZ_OCR_DEBUG_ARCHIVE", "0") == "1" else None)
+    return capture
+
+
+def record(route: str, raw: Any = None, normalized: Any = None, error: Optional[str] = None, **info: Any):
+    try:
+        get_capture().record(route, raw, normalized, error, **info)
+    except Exception as exc:  # pragma: no cover - defensive
+        LOGGER.warning("OCR debug capture failed: %s", exc)
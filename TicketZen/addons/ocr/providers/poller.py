@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from addons.ocr.providers import transport
+
+LOGGER = logging.getLogger("ticketzen.azure.poller")
+
+DONE_STATES = {"succeeded"}
+FAILED_STATES = {"failed", "canceled", "cancelled"}
+
+
+class OperationFailed(Exception):
+    pass
+
+
+class OperationTimeout(Exception):
+    pass
+
+
+class _Operation:
+    __slots__ = ("url", "headers", "deadline", "interval", "future", "polls", "errors", "started")
+
+    def __init__(self, url: str, headers: Dict[str, str], deadline: float, interval: float):
+        self.url = url
+        self.headers = headers
+        self.deadline = deadline
+        self.interval = interval
+        self.future: Future = Future()
+        self.polls = 0
+        self.errors = 0
+        self.started = time.time()
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+class OperationPoller:
+    def __init__(self, first_interval: float = 0.5, factor: float = 1.6, max_interval: float = 5.0, read_timeout: float = 5.0, workers: int = 4):
+        self.first_interval = first_interval
+        self.factor = factor
+        self.max_interval = max_interval
+        self.read_timeout = read_timeout
+        self.workers = max(1, workers)
+        self._heap: List[Tuple[float, int, _Operation]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._polling = 0
+        self._pid = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            # The scheduler thread only hands due polls to the pool: a slow GET never delays the other operations.
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tz-azure-poll")
+            self._polling = 0
+            self._thread = threading.Thread(target=self._run, name="tz-azure-poller", daemon=True)
+            self._thread.start()
+
+    def submit(self, url: str, headers: Dict[str, str], timeout: float, retry_after: Optional[float] = None) -> Future:
+        op = _Operation(url, headers, time.time() + timeout, self.first_interval)
+        first = max(self.first_interval, retry_after or 0)
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + first, next(self._seq), op))
+            self._ensure_thread()
+            self._cond.notify()
+        return op.future
+
+    def wait(self, url: str, headers: Dict[str, str], timeout: float, retry_after: Optional[float] = None) -> Dict[str, Any]:
+        future = self.submit(url, headers, timeout, retry_after)
+        try:
+            return future.result(timeout=timeout + self.read_timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise OperationTimeout(f"Opération Azure non terminée après {timeout}s")
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return len(self._heap) + self._polling
+
+    def _resolve(self, op: _Operation, result: Any = None, error: Optional[BaseException] = None):
+        if op.future.done():
+            return
+        try:
+            if error is not None:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(result)
+        except Exception:  # pragma: no cover - cancelled concurrently
+            pass
+
+    def _schedule(self, op: _Operation, retry_after: Optional[float]):
+        op.interval = min(self.max_interval, op.interval * self.factor)
+        delay = max(op.interval, retry_after or 0)
+        # Never sleep past the deadline: the timeout is reported when it falls, not at the next poll.
+        due = min(time.time() + delay, op.deadline + 0.01)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), op))
+            self._cond.notify()
+
+    def _transient(self, op: _Operation, reason: Any, retry_after: Optional[float] = None):
+        # The operation is still running on Azure's side: a failed poll only delays the next one.
+        op.errors += 1
+        LOGGER.warning("Azure poll failed (%s) attempt=%d; retrying: %s", reason, op.errors, op.url)
+        self._schedule(op, retry_after)
+
+    def _poll(self, op: _Operation):
+        if op.future.cancelled():
+            return
+        if time.time() > op.deadline:
+            LOGGER.warning("Azure operation timed out after %d polls: %s", op.polls, op.url)
+            self._resolve(op, error=OperationTimeout(f"Opération Azure non terminée après {op.polls} interrogations"))
+            return
+        op.polls += 1
+        read_timeout = max(0.5, min(self.read_timeout, op.deadline - time.time()))
+        try:
+            resp = transport.get_transport().request("GET", op.url, headers=op.headers, read_timeout=read_timeout, deadline=op.deadline, retries=0)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            self._transient(op, type(exc).__name__)
+            return
+        except Exception as exc:
+            self._resolve(op, error=exc)
+            return
+        retry_after = transport.retry_after_seconds(resp.headers)
+        if resp.status_code >= 400:
+            if resp.status_code in transport.RETRY_STATUSES:
+                self._transient(op, f"HTTP {resp.status_code}", retry_after)
+                return
+            self._resolve(op, error=OperationFailed(f"HTTP {resp.status_code} sur {op.url}"))
+            return
+        try:
+            body = resp.json()
+        except ValueError as exc:
+            self._resolve(op, error=OperationFailed(f"Réponse invalide: {exc}"))
+            return
+        status = str(body.get("status", "")).lower()
+        if status in DONE_STATES:
+            LOGGER.info("Azure operation succeeded polls=%d duration=%.1fms", op.polls, (time.time() - op.started) * 1000)
+            self._resolve(op, result=body)
+        elif status in FAILED_STATES:
+            self._resolve(op, error=OperationFailed(str(body.get("error") or status)))
+        else:
+            self._schedule(op, retry_after)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, op = self._heap[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+                self._polling += 1
+                pool = self._pool
+            pool.submit(self._poll_safely, op)
+
+    def _poll_safely(self, op: _Operation):
+        try:
+            self._poll(op)
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.exception("Azure poll failed: %s", exc)
+            self._resolve(op, error=exc)
+        finally:
+            with self._cond:
+                self._polling -= 1
+
+
+_POLLER: Optional[OperationPoller] = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller() -> OperationPoller:
+    global _POLLER
+    if _POLLER is None:
+        with _POLLER_LOCK:
+            if _POLLER is None:
+                _POLLER = OperationPoller(
+                    first_interval=_env_float("TZ_AZURE_POLL_FIRST_SEC", 0.5),
+                    factor=_env_float("TZ_AZURE_POLL_FACTOR", 1.6),
+                    max_interval=_env_float("TZ_AZURE_POLL_MAX_SEC", 5),
+                    read_timeout=_env_float("TZ_AZURE_POLL_TIMEOUT_SEC", 5),
+                    workers=int(_env_float("TZ_AZURE_POLL_THREADS", 4)),
+                )
+    return _POLLER
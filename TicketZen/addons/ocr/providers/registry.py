@@ -0,0 +1,102 @@
+import importlib
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+LOGGER = logging.getLogger("ticketzen.ocr.providers")
+
+# Every provider exposes analyze_document(content, content_type, config, logger) returning
+# {"fields": {...}, "conf": float|None, "texts": str, "meta": {"lines": [...]}, "warnings": [...]}.
+Provider = Callable[..., Dict[str, Any]]
+
+BUILTIN = {
+    "azure": "addons.ocr.providers.azure_client",
+    "tesseract": "addons.ocr.providers.tesseract",
+}
+STRATEGIES = {"cloud", "local", "local_first"}
+
+_PROVIDERS: Dict[str, Provider] = {}
+
+
+def register(name: str, provider: Provider):
+    _PROVIDERS[name] = provider
+
+
+def get_provider(name: str) -> Provider:
+    provider = _PROVIDERS.get(name)
+    if provider is None:
+        module_path = BUILTIN.get(name)
+        if module_path is None:
+            raise KeyError(f"Fournisseur OCR inconnu : {name}")
+        provider = _PROVIDERS[name] = importlib.import_module(module_path).analyze_document
+    return provider
+
+
+def available() -> List[str]:
+    return sorted(set(BUILTIN) | set(_PROVIDERS))
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def provider_config() -> Dict[str, Any]:
+    strategy = os.getenv("TZ_OCR_STRATEGY", "cloud")
+    return {
+        "strategy": strategy if strategy in STRATEGIES else "cloud",
+        "local_provider": os.getenv("TZ_OCR_LOCAL_PROVIDER", "tesseract"),
+        "local_min_conf": _env_float("TZ_OCR_LOCAL_MIN_CONF", 0.75),
+    }
+
+
+def cache_scope(config: Dict[str, Any]) -> str:
+    strategy = config.get("strategy", "cloud")
+    if strategy == "cloud":
+        return config.get("vendor", "azure")
+    return f"{strategy}:{config.get('local_provider')}:{config.get('vendor', 'azure')}"
+
+
+def _confident(result: Dict[str, Any], min_conf: float) -> bool:
+    conf = result.get("conf")
+    fields = result.get("fields") or {}
+    return conf is not None and conf >= min_conf and bool(fields.get("total"))
+
+
+def _cloud(content: bytes, content_type: str, config: Dict[str, Any], logger: logging.Logger) -> Dict[str, Any]:
+    return get_provider(config.get("vendor") or "azure")(content, content_type, config=config, logger=logger)
+
+
+def analyze_document(content: bytes, content_type: str, config: Dict[str, Any], logger: Optional[logging.Logger] = None, limiter=None) -> Dict[str, Any]:
+    logger = logger or LOGGER
+    strategy = config.get("strategy", "cloud")
+    if strategy == "cloud":
+        if limiter is not None:
+            limiter.acquire()
+        return _cloud(content, content_type, config, logger)
+    local_name = config.get("local_provider") or "tesseract"
+    local: Optional[Dict[str, Any]] = None
+    reason = None
+    try:
+        local = get_provider(local_name)(content, content_type, config=config, logger=logger)
+    except Exception as exc:
+        reason = f"ocr_local_error={type(exc).__name__}"
+        logger.warning("Local OCR %s failed: %s", local_name, exc)
+    if local is not None:
+        if strategy == "local" or _confident(local, config.get("local_min_conf", 0.75)):
+            return local
+        reason = f"ocr_local_conf={local.get('conf')}"
+    if strategy == "local" or not config.get("cloud_enabled", True):
+        fallback = local or {"fields": {"merchant": None, "date_achat": None, "total": None, "lignes": []}, "conf": None, "texts": "", "meta": {"lines": []}, "warnings": []}
+        fallback["warnings"] = list(fallback.get("warnings") or []) + [reason or "ocr_local_failed"]
+        return fallback
+    if limiter is not None:
+        limiter.acquire()
+    cloud = _cloud(content, content_type, config, logger)
+    if local is not None and "azure_all_failed" in (cloud.get("warnings") or []):
+        local["warnings"] = list(local.get("warnings") or []) + [reason, "ocr_fallback_failed"]
+        return local
+    cloud["warnings"] = list(cloud.get("warnings") or []) + ["ocr_fallback=cloud", reason]
+    return cloud
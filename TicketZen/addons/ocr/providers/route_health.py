@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _RouteState:
+    __slots__ = ("state", "consecutive_failures", "failures", "successes", "opened_at", "probing", "probe_from", "last_error", "last_success_at", "last_failure_at")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_from = CLOSED
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[float] = None
+        self.last_failure_at: Optional[float] = None
+
+    def as_dict(self, cooldown: float) -> Dict[str, Any]:
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = round(max(0.0, self.opened_at + cooldown - time.time()), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failures": self.failures,
+            "successes": self.successes,
+            "retry_in_sec": retry_in,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at,
+            "last_failure_at": self.last_failure_at,
+        }
+
+
+def _endpoint_key(endpoint: str) -> str:
+    return urlsplit(endpoint).netloc or endpoint
+
+
+class RouteHealth:
+    def __init__(self, failure_threshold: int = 2, cooldown: float = 60.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._routes: Dict[Tuple[str, str], _RouteState] = {}
+        self._preferred: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint: str, route: str) -> _RouteState:
+        key = (_endpoint_key(endpoint), route)
+        current = self._routes.get(key)
+        if current is None:
+            current = self._routes[key] = _RouteState()
+        return current
+
+    def _probe_due(self, current: _RouteState) -> bool:
+        now = time.time()
+        if current.state == OPEN:
+            return not current.probing and now >= current.opened_at + self.cooldown
+        return current.last_failure_at is not None and now >= current.last_failure_at + self.cooldown
+
+    def order(self, endpoint: str, routes: List[str]) -> List[str]:
+        with self._lock:
+            # The configured route (first) keeps priority; the remembered fallback only takes over while its circuit is not closed.
+            if not routes or self._get(endpoint, routes[0]).state == CLOSED:
+                return list(routes)
+            preferred = self._preferred.get(_endpoint_key(endpoint))
+            if preferred not in routes:
+                return list(routes)
+            ordered = [preferred] + [route for route in routes if route != preferred]
+            for route in routes[:routes.index(preferred)]:
+                current = self._get(endpoint, route)
+                if self._probe_due(current):
+                    ordered.remove(route)
+                    ordered.insert(0, route)
+                    break
+            return ordered
+
+    def allow(self, endpoint: str, route: str) -> bool:
+        with self._lock:
+            current = self._get(endpoint, route)
+            if current.state == CLOSED:
+                return True
+            if current.probing:
+                return False
+            if current.state == OPEN and time.time() < current.opened_at + self.cooldown:
+                return False
+            current.probe_from = current.state
+            current.state = HALF_OPEN
+            current.probing = True
+            return True
+
+    def force_probe(self, endpoint: str, routes: List[str]) -> Optional[str]:
+        with self._lock:
+            preferred = self._preferred.get(_endpoint_key(endpoint))
+            route = preferred if preferred in routes else (routes[0] if routes else None)
+            if route is not None:
+                current = self._get(endpoint, route)
+                current.probe_from = current.state
+                current.state = HALF_OPEN
+                current.probing = True
+            return route
+
+    def record_success(self, endpoint: str, route: str):
+        with self._lock:
+            current = self._get(endpoint, route)
+            current.state = CLOSED
+            current.probing = False
+            current.consecutive_failures = 0
+            current.successes += 1
+            current.last_success_at = time.time()
+            self._preferred[_endpoint_key(endpoint)] = route
+
+    def record_failure(self, endpoint: str, route: str, error: Optional[str] = None):
+        with self._lock:
+            current = self._get(endpoint, route)
+            current.consecutive_failures += 1
+            current.failures += 1
+            current.last_error = error
+            current.last_failure_at = time.time()
+            if current.state == HALF_OPEN or current.consecutive_failures >= self.failure_threshold:
+                current.state = OPEN
+                current.opened_at = time.time()
+            current.probing = False
+            key = _endpoint_key(endpoint)
+            if self._preferred.get(key) == route and current.state == OPEN:
+                self._preferred.pop(key, None)
+
+    def record_neutral(self, endpoint: str, route: str):
+        # The request was rejected for the document itself (400/413/415): says nothing about the route,
+        # but a half-open probe must still be released and the route put back in the state it was in.
+        with self._lock:
+            current = self._get(endpoint, route)
+            if current.probing:
+                current.probing = False
+                current.state = current.probe_from
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            payload: Dict[str, Any] = {}
+            for (endpoint, route), current in self._routes.items():
+                entry = payload.setdefault(endpoint, {"preferred": self._preferred.get(endpoint), "routes": {}})
+                entry["routes"][route] = current.as_dict(self.cooldown)
+            return payload
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._preferred.clear()
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+ROUTE_HEALTH = RouteHealth(
+    failure_threshold=int(_env_float("TZ_AZURE_ROUTE_FAILURES", 2)),
+    cooldown=_env_float("TZ_AZURE_ROUTE_COOLDOWN_SEC", 60),
+)
@@ -0,0 +1,135 @@
+import csv
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+LOGGER = logging.getLogger("ticketzen.ocr.tesseract")
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/tiff", "image/bmp", "image/webp"}
+TOTAL_RE = re.compile(r"\b(?:total|tot\.|net\s+a\s+payer|à\s+payer|montant)\b.*?(\d+[\.,]\d{2})", re.IGNORECASE)
+DATE_RE = re.compile(r"\b(\d{2})[/.-](\d{2})[/.-](\d{4}|\d{2})\b")
+
+_SLOTS: Optional[threading.BoundedSemaphore] = None
+_SLOTS_LOCK = threading.Lock()
+
+
+class TesseractUnavailable(Exception):
+    pass
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def tesseract_config() -> Dict[str, Any]:
+    return {
+        "cmd": os.getenv("TZ_TESSERACT_CMD", "tesseract"),
+        "lang": os.getenv("TZ_TESSERACT_LANG", "fra"),
+        "psm": _env_int("TZ_TESSERACT_PSM", 4),
+        "workers": max(1, _env_int("TZ_TESSERACT_WORKERS", os.cpu_count() or 2)),
+        "timeout": _env_int("TZ_TESSERACT_TIMEOUT_SEC", 60),
+    }
+
+
+def available(cmd: Optional[str] = None) -> bool:
+    return shutil.which(cmd or tesseract_config()["cmd"]) is not None
+
+
+def _slots(workers: int) -> threading.BoundedSemaphore:
+    global _SLOTS
+    with _SLOTS_LOCK:
+        if _SLOTS is None:
+            _SLOTS = threading.BoundedSemaphore(workers)
+        return _SLOTS
+
+
+def run_tesseract(content: bytes, settings: Dict[str, Any]) -> str:
+    binary = shutil.which(settings["cmd"])
+    if binary is None:
+        raise TesseractUnavailable(f"{settings['cmd']} introuvable")
+    # One OS process per page; OMP_THREAD_LIMIT=1 keeps parallel processes from oversubscribing the cores.
+    env = {**os.environ, "OMP_THREAD_LIMIT": "1"}
+    with _slots(settings["workers"]):
+        completed = subprocess.run(
+            [binary, "stdin", "stdout", "-l", settings["lang"], "--psm", str(settings["psm"]), "tsv"],
+            input=content,
+            capture_output=True,
+            timeout=settings["timeout"],
+            env=env,
+            check=False,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode("utf-8", "replace").strip()[:200] or f"tesseract exit {completed.returncode}")
+    return completed.stdout.decode("utf-8", "replace")
+
+
+def parse_tsv(tsv: str) -> Dict[str, Any]:
+    page_height = {}
+    lines: Dict[tuple, Dict[str, Any]] = {}
+    confidences: List[float] = []
+    for row in csv.DictReader(io.StringIO(tsv), delimiter="\t", quoting=csv.QUOTE_NONE):
+        try:
+            level = int(row["level"])
+            page = int(row["page_num"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if level == 1:
+            page_height[page] = int(row["height"]) or 1
+            continue
+        text = (row.get("text") or "").strip()
+        if level != 5 or not text:
+            continue
+        conf = float(row.get("conf") or -1)
+        if conf >= 0:
+            confidences.append(conf)
+        key = (page, int(row["block_num"]), int(row["par_num"]), int(row["line_num"]))
+        line = lines.setdefault(key, {"words": [], "top": int(row["top"]), "page": page})
+        line["words"].append(text)
+        line["top"] = min(line["top"], int(row["top"]))
+    ordered = sorted(lines.values(), key=lambda line: (line["page"], line["top"]))
+    meta_lines = [{"text": " ".join(line["words"]), "y_norm": line["top"] / page_height.get(line["page"], 1), "page": line["page"]} for line in ordered]
+    texts = "\n".join(line["text"] for line in meta_lines)
+    conf = round(sum(confidences) / len(confidences) / 100, 3) if confidences else None
+    return {"texts": texts, "lines": meta_lines, "conf": conf}
+
+
+def _find_total(lines: List[Dict[str, Any]]) -> Optional[str]:
+    for line in reversed(lines):
+        match = TOTAL_RE.search(line["text"])
+        if match:
+            return match.group(1)
+    return None
+
+
+def _find_date(texts: str) -> Optional[str]:
+    match = DATE_RE.search(texts)
+    if not match:
+        return None
+    day, month, year = match.groups()
+    if len(year) == 2:
+        year = f"20{year}"
+    return f"{day}/{month}/{year}"
+
+
+def analyze_document(content: bytes, content_type: str, config: Dict[str, Any], logger: Optional[logging.Logger] = None) -> Dict[str, Any]:
+    logger = logger or LOGGER
+    if content_type not in IMAGE_TYPES:
+        raise TesseractUnavailable(f"type non pris en charge par tesseract : {content_type}")
+    settings = tesseract_config()
+    parsed = parse_tsv(run_tesseract(content, settings))
+    logger.info("Tesseract OCR: %d lines conf=%s", len(parsed["lines"]), parsed["conf"])
+    return {
+        "fields": {"merchant": None, "date_achat": _find_date(parsed["texts"]), "total": _find_total(parsed["lines"]), "lignes": []},
+        "conf": parsed["conf"],
+        "texts": parsed["texts"],
+        "meta": {"lines": parsed["lines"]},
+        "warnings": ["ocr_provider=tesseract"],
+    }
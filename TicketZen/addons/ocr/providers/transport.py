@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+LOGGER = logging.getLogger("ticketzen.azure.transport")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+
+
+def _env_float(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def transport_config() -> Dict[str, Any]:
+    return {
+        "pool_size": int(_env_float("TZ_HTTP_POOL_SIZE", 10)),
+        "connect_timeout": _env_float("TZ_HTTP_CONNECT_TIMEOUT_SEC", 5),
+        "retries": int(_env_float("TZ_HTTP_RETRIES", 3)),
+        "backoff": _env_float("TZ_HTTP_BACKOFF_SEC", 0.5),
+        "backoff_max": _env_float("TZ_HTTP_BACKOFF_MAX_SEC", 20),
+    }
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retryable(method: str, exc: Exception) -> bool:
+    # A read timeout on the analyze POST means Azure may already hold (and bill) the operation:
+    # only retry POSTs that never reached the server.
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+    return isinstance(exc, requests.ConnectionError)
+
+
+def _retryable_status(method: str, status: int, headers: Mapping[str, str]) -> bool:
+    if status not in RETRY_STATUSES:
+        return False
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    # A 500/502/504 on the analyze POST may come back after Azure accepted (and billed) it:
+    # only explicit refusals are re-sent.
+    return status == 429 or (status == 503 and retry_after_seconds(headers) is not None)
+
+
+def _mark_reused(resp: requests.Response) -> bool:
+    # The connection is checked out by this request alone until the body is read: count its uses on it.
+    connection = getattr(resp.raw, "connection", None)
+    if connection is None:
+        return False
+    served = getattr(connection, "tz_served", 0)
+    connection.tz_served = served + 1
+    return served > 0
+
+
+class Transport:
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5, retries: int = 3, backoff: float = 0.5, backoff_max: float = 20):
+        self.connect_timeout = connect_timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False, max_retries=0)
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, data: Optional[bytes] = None, read_timeout: float = 90, deadline: Optional[float] = None, retries: Optional[int] = None) -> requests.Response:
+        session = self._session()
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                resp = session.request(method, url, headers=headers, data=data, timeout=(self.connect_timeout, read_timeout), stream=True)
+                reused = _mark_reused(resp)
+                resp.content
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max)
+                if attempt >= retries or not _retryable(method, exc) or (deadline is not None and time.time() + delay > deadline):
+                    raise
+                LOGGER.warning("%s %s failed attempt=%d: %s; retrying in %.2fs", method, url, attempt + 1, exc, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            LOGGER.info("%s %s status=%s attempt=%d reused=%s duration=%.1fms", method, url, resp.status_code, attempt + 1, reused, (time.time() - start) * 1000)
+            if not _retryable_status(method, resp.status_code, resp.headers) or attempt >= retries:
+                return resp
+            delay = backoff_delay(attempt, self.backoff, self.backoff_max, retry_after_seconds(resp.headers))
+            if deadline is not None and time.time() + delay > deadline:
+                return resp
+            resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._adapter.close()
+
+
+class AsyncTransport:
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5, retries: int = 3, backoff: float = 0.5, backoff_max: float = 20):
+        if httpx is None:
+            raise RuntimeError("httpx n'est pas installé")
+        self.connect_timeout = connect_timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._client = httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, data: Optional[bytes] = None, read_timeout: float = 90, deadline: Optional[float] = None):
+        timeout = httpx.Timeout(read_timeout, connect=self.connect_timeout)
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                resp = await self._client.request(method, url, headers=headers, content=data, timeout=timeout)
+            except (httpx.ConnectError, httpx.TimeoutException) as exc:
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max)
+                if attempt >= self.retries or not _retryable(method, exc) or (deadline is not None and time.time() + delay > deadline):
+                    raise
+                LOGGER.warning("%s %s failed attempt=%d: %s; retrying in %.2fs", method, url, attempt + 1, exc, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            LOGGER.info("%s %s status=%s attempt=%d http=%s duration=%.1fms", method, url, resp.status_code, attempt + 1, resp.http_version, (time.time() - start) * 1000)
+            if not _retryable_status(method, resp.status_code, resp.headers) or attempt >= self.retries:
+                return resp
+            delay = backoff_delay(attempt, self.backoff, self.backoff_max, retry_after_seconds(resp.headers))
+            if deadline is not None and time.time() + delay > deadline:
+                return resp
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_TRANSPORT: Optional[Transport] = None
+_TRANSPORT_PID = 0
+_TRANSPORT_LOCK = threading.Lock()
+
+
+def get_transport() -> Transport:
+    global _TRANSPORT, _TRANSPORT_PID
+    if _TRANSPORT is None or _TRANSPORT_PID != os.getpid():
+        with _TRANSPORT_LOCK:
+            # Pooled sockets must not be shared with a forked worker; the parent's pool is left untouched.
+            if _TRANSPORT is None or _TRANSPORT_PID != os.getpid():
+                _TRANSPORT = Transport(**transport_config())
+                _TRANSPORT_PID = os.getpid()
+    return _TRANSPORT
+
+
+def reset_transport():
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT is not None:
+            _TRANSPORT.close()
+        _TRANSPORT = None
+
+
+def get_async_transport() -> AsyncTransport:
+    return AsyncTransport(**transport_config())
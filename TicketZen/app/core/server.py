@@ -1,17 +1,25 @@
-import json
 import logging
 import os
 import platform
 import secrets
 from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, redirect, render_template, request, send_from_directory, url_for
+from flask import Flask, Request, Response, jsonify, redirect, render_template, request, send_from_directory, url_for
 
-from addons.intake.api import intake_bp
+from addons import metrics as tz_metrics
+from addons.intake.api import batch_bp, expenses_bp, intake_bp, search_bp
+from addons.intake import batch as intake_batch
+from addons.intake import jobs
+from addons.intake import state as intake_state
 from addons.intake import qrcode as qr_utils
+from addons.knowledge import merchants
+from addons.ocr import cache as ocr_cache
+from addons.ocr.providers import debug_capture, route_health, tesseract
+from addons.ocr.providers import registry as ocr_registry
+from app.core import warmup
 
 load_dotenv()
 
@@ -29,12 +37,30 @@ def storage_root() -> Path:
     return target
 
 
-def create_app() -> Flask:
+class TicketZenRequest(Request):
+    @property
+    def max_content_length(self):
+        # Batch archives are far larger than single receipts; their size is bounded by TZ_BATCH_MAX_MB.
+        if self.path.startswith("/api/batch"):
+            return intake_batch.batch_config()["max_bytes"] + 1024 * 1024
+        return super().max_content_length
+
+
+def create_app(start_queue: bool = True, warmup_mode: Optional[str] = None) -> Flask:
     app = Flask(__name__, static_folder=str(Path(__file__).resolve().parent.parent / "static"), template_folder=str(Path(__file__).resolve().parent.parent / "templates"))
+    app.request_class = TicketZenRequest
     app.config["JSON_AS_ASCII"] = False
     app.config["DATA_ROOT"] = storage_root()
     app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET", secrets.token_hex(16))
+    app.config["MAX_CONTENT_LENGTH"] = intake_state.upload_limits()["max_bytes"] + 1024 * 1024
     app.register_blueprint(intake_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(expenses_bp)
+    app.register_blueprint(search_bp)
+    if start_queue:
+        jobs.init_queue(app.config["DATA_ROOT"], release=True)
+    warmup.start(app.config["DATA_ROOT"], warmup_mode)
+    debug_capture.configure(app.config["DATA_ROOT"])
 
     @app.after_request
     def add_cors_headers(response):
@@ -100,21 +126,27 @@ def create_app() -> Flask:
 
     @app.route("/api/metrics")
     def metrics():
-        stats_path = app.config["DATA_ROOT"] / "metrics.json"
+        registry = tz_metrics.METRICS
+        scans = {state: registry.counter("scans", state=state) for state in ("done", "error", "timeout")}
+        total_scans = sum(scans.values())
+        analysis = registry.histogram("analysis") or {}
         payload: Dict[str, object] = {
             "ok": True,
-            "scans": 0,
-            "avg_latency_ms": None,
+            "scans": int(total_scans),
+            "avg_latency_ms": analysis.get("avg_ms"),
             "f1_total_date": None,
-            "alerts_rate": None,
+            "alerts_rate": round((scans["error"] + scans["timeout"]) / total_scans, 3) if total_scans else None,
+            **registry.snapshot(),
         }
-        try:
-            if stats_path.exists():
-                payload.update(json.loads(stats_path.read_text()))
-        except Exception as exc:  # pragma: no cover - defensive
-            LOGGER.warning("Failed to read metrics: %s", exc)
+        queue = jobs.get_queue()
+        if queue is not None:
+            payload["queue"] = queue.stats()
         return jsonify(payload)
 
+    @app.route("/metrics")
+    def metrics_prometheus():
+        return Response(tz_metrics.METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
     @app.route("/debug/azure")
     def debug_azure():
         endpoint = os.getenv("AZURE_DI_ENDPOINT", "")
@@ -127,14 +159,71 @@ def create_app() -> Flask:
             "dry_run": bool(int(os.getenv("OCR_DRY_RUN", "0"))),
             "endpoint_set": bool(endpoint),
             "key_set": bool(key),
+            "routes": route_health.ROUTE_HEALTH.snapshot(),
+            "ocr_providers": {**ocr_registry.provider_config(), "available": ocr_registry.available(), "tesseract_found": tesseract.available()},
+            "ocr_cache": ocr_cache.get_cache(app.config["DATA_ROOT"]).stats() if ocr_cache.cache_enabled() else None,
+            "capture": debug_capture.get_capture().stats(),
             "timestamp": datetime.utcnow().isoformat() + "Z",
         }
         return jsonify(response)
 
+    def admin_allowed() -> bool:
+        admin_token = os.getenv("TZ_ADMIN_TOKEN", "")
+        if admin_token:
+            return secrets.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token)
+        return request.remote_addr in ("127.0.0.1", "::1")
+
+    @app.route("/debug/azure/captures")
+    def debug_azure_captures():
+        # Raw OCR payloads contain the receipts themselves: same access rule as the admin API.
+        if not admin_allowed():
+            return jsonify({"ok": False, "error": "Accès administrateur refusé"}), 200
+        capture = debug_capture.get_capture()
+        limit = max(1, min(request.args.get("limit", 50, type=int), capture.ring_size))
+        items = capture.entries(limit=limit, route=request.args.get("route") or None, errors_only=request.args.get("errors") == "1")
+        return jsonify({"ok": True, "items": items, "archives": capture.archives(), **capture.stats()})
+
+    @app.route("/debug/azure/captures/<int:capture_id>")
+    def debug_azure_capture(capture_id: int):
+        if not admin_allowed():
+            return jsonify({"ok": False, "error": "Accès administrateur refusé"}), 200
+        entry = debug_capture.get_capture().entry(capture_id)
+        if entry is None:
+            return jsonify({"ok": False, "error": "Capture introuvable (sortie du tampon ?)"}), 200
+        return jsonify({"ok": True, **entry})
+
+    @app.route("/debug/azure/archives/<name>")
+    def debug_azure_archive(name: str):
+        if not admin_allowed():
+            return jsonify({"ok": False, "error": "Accès administrateur refusé"}), 200
+        capture = debug_capture.get_capture()
+        if capture.archive_dir is None or name not in {item["name"] for item in capture.archives()}:
+            return jsonify({"ok": False, "error": "Archive introuvable"}), 200
+        capture.flush()
+        return send_from_directory(capture.archive_dir, name, mimetype="application/gzip", as_attachment=True)
+
+    @app.route("/api/admin/knowledge", methods=["GET", "POST"])
+    def admin_knowledge():
+        if not admin_allowed():
+            return jsonify({"ok": False, "error": "Accès administrateur refusé"}), 200
+        if request.method == "POST":
+            try:
+                info = merchants.KNOWLEDGE.reload()
+            except Exception as exc:
+                LOGGER.warning("Knowledge reload failed: %s", exc)
+                return jsonify({"ok": False, "error": f"Rechargement impossible : {exc}"}), 200
+            return jsonify({"ok": True, "reloaded": True, **info})
+        return jsonify({"ok": True, **merchants.KNOWLEDGE.info()})
+
     @app.route("/healthz")
     def healthz():
         return jsonify({"ok": True, "app": os.getenv("APP_NAME", "TicketZen")})
 
+    @app.route("/readyz")
+    def readyz():
+        status = warmup.status()
+        return jsonify({"ok": True, "ready": status["state"] == "ready", "warmup": status})
+
     return app
 
 
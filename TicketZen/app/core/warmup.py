@@ -0,0 +1,96 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger("ticketzen.warmup")
+
+MODES = {"background", "sync", "off"}
+
+_STATUS: Dict[str, Any] = {"state": "cold", "steps": {}, "took_ms": None}
+_LOCK = threading.Lock()
+
+
+def warmup_mode(requested: Optional[str] = None) -> str:
+    mode = requested or os.getenv("TZ_WARMUP", "background")
+    return mode if mode in MODES else "background"
+
+
+def _load_pillow():
+    from PIL import Image
+
+    Image.init()
+
+
+def _load_providers():
+    from addons.intake import pipeline
+    from addons.ocr.providers import registry
+
+    config = pipeline.ocr_config()
+    names = [config.get("vendor") or "azure"]
+    if config.get("strategy") != "cloud":
+        names.insert(0, config.get("local_provider") or "tesseract")
+    for name in names:
+        registry.get_provider(name)
+    if "azure" in names:
+        from addons.ocr.providers import transport
+
+        transport.get_transport()
+
+
+def _load_dedupe(base_dir: Path):
+    from addons.intake import dedupe
+
+    # Replays the hash log once so the first upload does not pay for it.
+    if dedupe.dedupe_config()["enabled"]:
+        dedupe.get_index(base_dir).stats()
+
+
+def _steps(base_dir: Path) -> List[Tuple[str, Callable[[], Any]]]:
+    return [
+        ("knowledge", lambda: importlib.import_module("addons.knowledge.merchants").KNOWLEDGE.snapshot),
+        ("postprocess", lambda: importlib.import_module("addons.ocr.postprocess_fr")),
+        ("pillow", _load_pillow),
+        ("ocr_providers", _load_providers),
+        ("intake_store", lambda: importlib.import_module("addons.intake.store").get_store(base_dir)),
+        ("dedupe_index", lambda: _load_dedupe(base_dir)),
+    ]
+
+
+def warmup(base_dir: Path) -> Dict[str, Any]:
+    with _LOCK:
+        if _STATUS["state"] == "ready":
+            return status()
+        _STATUS["state"] = "warming"
+        started = time.perf_counter()
+        for name, step in _steps(base_dir):
+            step_started = time.perf_counter()
+            try:
+                step()
+                _STATUS["steps"][name] = round((time.perf_counter() - step_started) * 1000, 1)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.warning("Warm-up step %s failed: %s", name, exc)
+                _STATUS["steps"][name] = f"error: {exc}"
+        _STATUS["took_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        _STATUS["state"] = "ready"
+        LOGGER.info("Warm-up done in %.1fms: %s", _STATUS["took_ms"], _STATUS["steps"])
+        return status()
+
+
+def start(base_dir: Path, mode: Optional[str] = None) -> Optional[threading.Thread]:
+    mode = warmup_mode(mode)
+    if mode == "off":
+        return None
+    if mode == "sync":
+        warmup(base_dir)
+        return None
+    thread = threading.Thread(target=warmup, args=(base_dir,), name="tz-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def status() -> Dict[str, Any]:
+    return {"state": _STATUS["state"], "steps": dict(_STATUS["steps"]), "took_ms": _STATUS["took_ms"]}
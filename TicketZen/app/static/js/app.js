@@ -1,6 +1,6 @@
 const TZ_I18N = {
-  fr: { uploaded: 'Fichier envoyé', analyzing: 'Analyse en cours', done: 'Terminé' },
-  en: { uploaded: 'File uploaded', analyzing: 'Analyzing', done: 'Done' }
+  fr: { uploaded: 'Fichier envoyé', analyzing: 'Analyse en cours', done: 'Terminé', duplicate: 'Ce ticket ressemble à un ticket déjà envoyé' },
+  en: { uploaded: 'File uploaded', analyzing: 'Analyzing', done: 'Done', duplicate: 'This receipt looks like one already uploaded' }
 };
 const TZ_COLORS = () => {
   const style = getComputedStyle(document.documentElement);
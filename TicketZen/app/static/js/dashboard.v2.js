@@ -1,13 +1,25 @@
 const colors = TZ_COLORS();
 const donut = document.getElementById('chart-donut');
 const bar = document.getElementById('chart-bar');
-new Chart(donut, {
-  type: 'doughnut',
-  data: { labels: ['Supermarché','Électronique','Restauration'], datasets: [{ data: [12,5,3], backgroundColor: [colors.accent, colors.accent2, '#22c55e'] }]},
-  options: { plugins: { legend: { position: 'bottom' }}}
-});
-new Chart(bar, {
-  type: 'bar',
-  data: { labels: ['Avr','Mai','Juin'], datasets: [{ label: 'Total €', data: [120, 230, 180], backgroundColor: colors.accent }]},
-  options: { scales: { y: { beginAtZero: true }}}
-});
+const palette = [colors.accent, colors.accent2, '#22c55e', '#f59e0b', '#ef4444', '#14b8a6', '#8b5cf6'];
+
+async function rollup(dim, limit){
+  const res = await fetch(`/api/expenses/rollups?dim=${dim}&limit=${limit}`);
+  const data = await res.json();
+  if(!data.ok) throw new Error(data.error);
+  return data.buckets;
+}
+
+Promise.all([rollup('category', 7), rollup('month', 12)]).then(([categories, months]) => {
+  new Chart(donut, {
+    type: 'doughnut',
+    data: { labels: categories.map(b => b.key || 'Non classé'), datasets: [{ data: categories.map(b => b.total), backgroundColor: palette }]},
+    options: { plugins: { legend: { position: 'bottom' }}}
+  });
+  months.reverse();
+  new Chart(bar, {
+    type: 'bar',
+    data: { labels: months.map(b => b.key), datasets: [{ label: 'Total €', data: months.map(b => b.total), backgroundColor: colors.accent }]},
+    options: { scales: { y: { beginAtZero: true }}}
+  });
+}).catch(err => showToast(`Statistiques indisponibles : ${err.message}`));
@@ -1,21 +1,42 @@
 const tableBody = document.querySelector('#expenses-table tbody');
-const dummy = [
-  { merchant: 'Netto', date: '2024-05-01', total: 9.42, category: 'supermarché' },
-  { merchant: 'Fnac', date: '2024-05-03', total: 199.99, category: 'électronique' },
-];
-function renderRows(rows){
-  tableBody.innerHTML = '';
-  rows.forEach(row => {
+const moreButton = document.getElementById('more-expenses');
+const rows = [];
+let cursor = null;
+
+function cell(value){
+  const td = document.createElement('td');
+  td.textContent = value == null ? '' : value;
+  return td;
+}
+
+function renderRows(items){
+  items.forEach(row => {
     const tr = document.createElement('tr');
-    tr.innerHTML = `<td>${row.merchant}</td><td>${row.date}</td><td>${row.total}</td><td>${row.category}</td>`;
+    [row.merchant, row.date, row.total.toFixed(2), row.category].forEach(value => tr.appendChild(cell(value)));
     tableBody.appendChild(tr);
   });
 }
-renderRows(dummy);
 
-document.getElementById('export-csv').addEventListener('click', () => {
+async function loadPage(){
+  const params = new URLSearchParams({ limit: '50' });
+  if(cursor) params.set('cursor', cursor);
+  const res = await fetch(`/api/expenses?${params}`);
+  const data = await res.json();
+  if(!data.ok){ showToast(data.error); return; }
+  rows.push(...data.items);
+  renderRows(data.items);
+  cursor = data.next_cursor;
+  moreButton.hidden = !cursor;
+}
+
+moreButton.addEventListener('click', loadPage);
+loadPage();
+
+document.getElementById('export-csv').addEventListener('click', async () => {
+  while(cursor){ await loadPage(); }
+  const quote = value => `"${String(value == null ? '' : value).replace(/"/g, '""')}"`;
   const header = ['merchant','date','total','category'];
-  const csv = [header.join(',')].concat(dummy.map(r => `${r.merchant},${r.date},${r.total},${r.category}`)).join('\n');
+  const csv = [header.join(',')].concat(rows.map(r => header.map(key => quote(r[key])).join(','))).join('\n');
   const blob = new Blob([csv], {type:'text/csv;charset=utf-8;'});
   const link = document.createElement('a');
   link.href = URL.createObjectURL(blob);
@@ -0,0 +1,44 @@
+const historyList = document.getElementById('history-list');
+const STATE_LABELS = { pending: 'En attente', queued: 'En file', analyzing: 'Analyse en cours', interrupted: 'Interrompue', done: 'Terminé', error: 'Erreur' };
+
+fetch('/api/intake?limit=50').then(res => res.json()).then(data => {
+  if(!data.ok){ showToast(data.error); return; }
+  if(!data.items.length) return;
+  historyList.textContent = '';
+  data.items.forEach(item => {
+    const row = document.createElement('div');
+    const when = new Date(item.updated_at * 1000).toLocaleString();
+    row.textContent = `${when} — ${item.token} — ${STATE_LABELS[item.state] || item.state}`;
+    historyList.appendChild(row);
+  });
+});
+
+const searchForm = document.getElementById('search-form');
+const searchResults = document.getElementById('search-results');
+
+searchForm.addEventListener('submit', async event => {
+  event.preventDefault();
+  const params = new URLSearchParams({ q: document.getElementById('search-q').value, limit: '20' });
+  const from = document.getElementById('search-from').value;
+  const to = document.getElementById('search-to').value;
+  if(from) params.set('date_from', from);
+  if(to) params.set('date_to', to);
+  const data = await (await fetch(`/api/search?${params}`)).json();
+  if(!data.ok){ showToast(data.error); return; }
+  searchResults.textContent = '';
+  const corrected = Object.values(data.expanded || {}).flat();
+  if(corrected.length) showToast(`Recherche élargie à : ${corrected.join(', ')}`);
+  if(!data.items.length){ searchResults.textContent = 'Aucun ticket trouvé.'; return; }
+  data.items.forEach(item => {
+    const li = document.createElement('li');
+    const total = item.total == null ? '' : `${item.total.toFixed(2)} €`;
+    li.textContent = [item.merchant, item.date, total].filter(Boolean).join(' — ');
+    if(item.snippet){
+      const snippet = document.createElement('div');
+      snippet.className = 'muted';
+      snippet.textContent = item.snippet.replace(/\n/g, ' ');
+      li.appendChild(snippet);
+    }
+    searchResults.appendChild(li);
+  });
+});
@@ -3,17 +3,44 @@ const statusEl = document.getElementById('status');
 const resultEl = document.getElementById('result');
 const fileInput = document.getElementById('file-input');
 
-async function pollStatus(){
-  const res = await fetch(`/api/intake/${token}/status`);
-  const data = await res.json();
+let pollTimer = null;
+
+function showStatus(data){
   statusEl.textContent = `PIN: ${token} · ${data.state}`;
-  if(data.state === 'done' && data.result){
+  if(data.result && (data.state === 'done' || data.result.partial)){
     renderResult(data.result);
   }
 }
 
-function renderResult(result){
-  resultEl.innerHTML = `
+async function pollStatus(){
+  const res = await fetch(`/api/intake/${token}/status`, { cache:'no-cache' });
+  if(!res.ok) return;
+  showStatus(await res.json());
+}
+
+function startPolling(){
+  if(pollTimer) return;
+  pollTimer = setInterval(pollStatus, 4000);
+  pollStatus();
+}
+
+function watchStatus(){
+  if(!window.EventSource){ startPolling(); return; }
+  const source = new EventSource(`/api/intake/${token}/events`);
+  source.addEventListener('status', (event) => {
+    if(pollTimer){ clearInterval(pollTimer); pollTimer = null; }
+    const data = JSON.parse(event.data);
+    showStatus(data);
+    // Each open stream holds a server thread: stop listening once the analysis is over.
+    if(data.state === 'done' || data.state === 'error') source.close();
+  });
+  source.addEventListener('error', () => {
+    if(source.readyState === EventSource.CLOSED) startPolling();
+  });
+}
+
+function receiptHtml(result){
+  return `
     <div>Marchand: <strong>${result.merchant || 'n/a'}</strong></div>
     <div>Date: ${result.date || 'n/a'}</div>
     <div>Total: ${result.total || 'n/a'}</div>
@@ -21,16 +48,113 @@ function renderResult(result){
   `;
 }
 
+function renderResult(result){
+  // A confirmed duplicate is shown but left out of the expenses; a possible one is counted until the user says otherwise.
+  let notice = result.duplicate_of ? '<div class="duplicate">Doublon : non compté dans les dépenses</div>' : '';
+  if(result.possible_duplicate_of){
+    notice = `<div class="duplicate">Même enseigne, date et total qu'un ticket déjà envoyé.
+      <button type="button" data-duplicate="1">C'est un doublon</button>
+      <button type="button" data-duplicate="0">Ce sont deux achats</button></div>`;
+  }
+  if(!result.receipts){
+    resultEl.innerHTML = notice + receiptHtml(result);
+    return;
+  }
+  const header = result.partial ? `<div>Pages analysées: ${result.receipts.length}/${result.pages}</div>` : '';
+  resultEl.innerHTML = notice + header + result.receipts.map((receipt) => `<div class="receipt"><div>Page ${receipt.page}</div>${receiptHtml(receipt)}</div>`).join('');
+}
+
+const MAX_SIDE = 2000;
+const SHRINK_ABOVE = 1.5 * 1024 * 1024;
+
+async function shrinkImage(file){
+  if(!file.type.startsWith('image/') || file.size < SHRINK_ABOVE || !window.createImageBitmap){ return file; }
+  try {
+    const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+    const scale = Math.min(1, MAX_SIDE / Math.max(bitmap.width, bitmap.height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(bitmap.width * scale);
+    canvas.height = Math.round(bitmap.height * scale);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    const blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.85));
+    if(!blob || blob.size >= file.size){ return file; }
+    return new File([blob], file.name.replace(/\.[^.]+$/, '') + '.jpg', { type: 'image/jpeg' });
+  } catch(err) {
+    return file;
+  }
+}
+
+const CHUNK_SIZE = 512 * 1024;
+const CHUNK_RETRIES = 4;
+
+async function sendChunk(file, offset){
+  const chunk = file.slice(offset, offset + CHUNK_SIZE);
+  for(let attempt = 0; ; attempt++){
+    try {
+      const res = await fetch(`/api/intake/${token}/upload/chunk`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'X-Upload-Offset': String(offset),
+          'X-Upload-Total': String(file.size),
+          'X-Upload-Name': file.name,
+        },
+        body: chunk,
+      });
+      return await res.json();
+    } catch(err) {
+      if(attempt >= CHUNK_RETRIES){ throw err; }
+      await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+    }
+  }
+}
+
+async function resumeOffset(file){
+  try {
+    const res = await fetch(`/api/intake/${token}/upload/chunk`);
+    const data = await res.json();
+    return data.total === file.size && data.filename === file.name ? data.offset : 0;
+  } catch(err) {
+    return 0;
+  }
+}
+
 async function upload(){
   if(!fileInput.files.length){ return showToast('Choisissez un fichier'); }
-  const form = new FormData();
-  form.append('file', fileInput.files[0]);
-  const res = await fetch(`/api/intake/${token}/upload`, { method:'POST', body: form });
+  const file = await shrinkImage(fileInput.files[0]);
+  let offset = await resumeOffset(file);
+  let data = { ok: true };
+  let resyncs = 0;
+  try {
+    while(offset < file.size){
+      data = await sendChunk(file, offset);
+      if(!data.ok){
+        // The server tells us where it stands: resume from there a few times, then give up.
+        if(typeof data.offset !== 'number' || data.offset === offset || ++resyncs > 3){ break; }
+      }
+      offset = data.offset;
+      statusEl.textContent = `PIN: ${token} · envoi ${Math.round(100 * offset / file.size)}%`;
+      if(data.complete){ break; }
+    }
+  } catch(err) {
+    data = { ok: false, error: 'Connexion perdue, réessayez pour reprendre l\'envoi' };
+  }
+  if(data.ok){ showToast(data.duplicate_of && data.duplicate_of.length ? TZ_I18N.fr.duplicate : TZ_I18N.fr.uploaded); pollStatus(); }
+  else { showToast(data.error || 'Erreur'); }
+}
+
+async function resolveDuplicate(confirm){
+  const res = await fetch(`/api/intake/${token}/duplicate`, { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ confirm }) });
   const data = await res.json();
-  if(data.ok){ showToast(TZ_I18N.fr.uploaded); pollStatus(); }
+  if(data.ok){ showStatus(data); }
   else { showToast(data.error || 'Erreur'); }
 }
 
+resultEl.addEventListener('click', (event) => {
+  const choice = event.target.dataset && event.target.dataset.duplicate;
+  if(choice !== undefined){ resolveDuplicate(choice === '1'); }
+});
+
 async function analyze(){
   const res = await fetch(`/api/intake/${token}/analyze`, { method:'POST' });
   const data = await res.json();
@@ -40,5 +164,4 @@ async function analyze(){
 
 document.getElementById('upload-btn').addEventListener('click', upload);
 document.getElementById('analyze-btn').addEventListener('click', analyze);
-setInterval(pollStatus, 4000);
-pollStatus();
+watchStatus();
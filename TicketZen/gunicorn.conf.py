@@ -0,0 +1,92 @@
+import gc
+import logging
+import multiprocessing
+import os
+
+LOGGER = logging.getLogger("ticketzen.gunicorn")
+
+WORKER_CLASSES = {"sync": "sync", "gthread": "gthread", "gevent": "gevent"}
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, default))
+    except ValueError:
+        return default
+
+
+def _worker_class() -> str:
+    requested = WORKER_CLASSES.get(os.getenv("TZ_WORKER_CLASS", "gthread"), "gthread")
+    if requested == "gevent":
+        try:
+            import gevent  # noqa: F401
+        except ImportError:  # pragma: no cover - optional dependency
+            LOGGER.warning("gevent is not installed; falling back to gthread workers")
+            return "gthread"
+    return requested
+
+
+CPUS = multiprocessing.cpu_count()
+
+bind = os.getenv("TZ_BIND", "0.0.0.0:5000")
+worker_class = _worker_class()
+# Analyses wait on Azure most of the time: threads or greenlets carry the concurrency,
+# processes only need to cover the CPU work (preprocessing, normalisation).
+workers = _env_int("TZ_WEB_WORKERS", 0) or (CPUS * 2 + 1 if worker_class == "sync" else max(2, min(CPUS, 4)))
+threads = _env_int("TZ_WEB_THREADS", 0) or (max(8, CPUS * 4) if worker_class == "gthread" else 1)
+worker_connections = _env_int("TZ_WEB_CONNECTIONS", 1000)
+# Sync workers are killed after `timeout` without a heartbeat; SSE streams (TZ_SSE_MAX_SEC) need gthread or gevent.
+timeout = _env_int("TZ_WEB_TIMEOUT_SEC", 120)
+graceful_timeout = _env_int("TZ_WEB_GRACEFUL_SEC", 60)
+keepalive = 5
+max_requests = _env_int("TZ_WEB_MAX_REQUESTS", 0)
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = os.getenv("TZ_WEB_ACCESS_LOG", "-") or None
+errorlog = "-"
+
+
+def when_ready(server):
+    from addons.intake import jobs
+    from app.core import warmup
+    from app.core.server import storage_root
+
+    # Before any worker exists, every queued/analyzing row is an orphan: mark them so the first workers resume them
+    # (post_fork). Later, workers reclaim rows whose owner died or whose lease lapsed (TZ_OCR_LEASE_SEC).
+    jobs.release_orphans(storage_root())
+    # Warm up in the master, then move everything out of the GC's reach: collections in the workers
+    # no longer touch (and copy) the pages they share with it.
+    status = warmup.warmup(storage_root())
+    gc.freeze()
+    server.log.info("TicketZen preloaded in %sms %s, worker_class=%s workers=%s threads=%s", status["took_ms"], status["steps"], worker_class, workers, threads)
+
+
+def post_fork(server, worker):
+    from addons.intake import jobs
+    from app.core.server import storage_root
+
+    queue = jobs.init_queue(storage_root())
+    server.log.info("Worker %s: OCR queue started (%s x%d)", worker.pid, queue.mode, queue.workers)
+
+
+def worker_exit(server, worker):
+    from addons.intake import jobs
+
+    queue = jobs.get_queue()
+    if queue is None:
+        return
+    drain = max(1, graceful_timeout - 5)
+    stats = queue.stats()
+    server.log.info("Worker %s: draining OCR queue (depth=%s running=%s, up to %ss)", worker.pid, stats["depth"], stats["running"], drain)
+    queue.shutdown(drain=True, timeout=drain)
+    # Whatever did not finish in time is marked interrupted for a sibling (or the next worker) to resume.
+    queue.release()
+
+
+def worker_abort(worker):
+    from addons.intake import jobs
+
+    # Killed on timeout: no drain, but hand the unfinished analyses over before going.
+    queue = jobs.get_queue()
+    if queue is not None:
+        queue.release()
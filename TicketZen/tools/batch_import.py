@@ -0,0 +1,91 @@
+import argparse
+import json
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+
+from addons.intake import batch
+
+
+def _zip_directory(folder: Path) -> Path:
+    handle = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+    with zipfile.ZipFile(handle, "w", zipfile.ZIP_STORED) as archive:
+        for path in sorted(p for p in folder.rglob("*") if p.is_file()):
+            archive.write(path, str(path.relative_to(folder)))
+    handle.close()
+    return Path(handle.name)
+
+
+def run_remote(url: str, source: Optional[Path], batch_id: Optional[str], concurrency: Optional[int]) -> Iterator[Dict[str, Any]]:
+    params = {"concurrency": concurrency} if concurrency else {}
+    if batch_id:
+        response = requests.post(f"{url}/api/batch/{batch_id}/run", params=params, stream=True, timeout=(10, None))
+    else:
+        archive = _zip_directory(source) if source.is_dir() else source
+        try:
+            with archive.open("rb") as body:
+                response = requests.post(f"{url}/api/batch", data=body, params=params, headers={"Content-Type": "application/zip"}, stream=True, timeout=(10, None))
+        finally:
+            if archive != source:
+                archive.unlink()
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        yield {"type": "error", **response.json()}
+        return
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def run_local(base_dir: Path, source: Optional[Path], batch_id: Optional[str], concurrency: Optional[int], rate: Optional[float]) -> Iterator[Dict[str, Any]]:
+    if not batch_id:
+        batch_id = batch.create_batch(base_dir, source)["batch_id"]
+    yield from batch.run_batch(base_dir, batch_id, concurrency=concurrency, rate=rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import en lot de tickets (zip ou dossier) avec résultats NDJSON")
+    parser.add_argument("source", type=Path, nargs="?", help="archive zip ou dossier de tickets")
+    parser.add_argument("--url", default=None, help="serveur TicketZen (ex. http://127.0.0.1:5000) ; sinon traitement local")
+    parser.add_argument("--base-dir", type=Path, default=None, help="racine des données en mode local (défaut : storage_root())")
+    parser.add_argument("--resume", dest="batch_id", default=None, help="identifiant d'un lot interrompu à reprendre")
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="appels OCR par seconde (mode local)")
+    parser.add_argument("--out", type=Path, default=None, help="fichier NDJSON de sortie (défaut : stdout)")
+    args = parser.parse_args()
+    if not args.batch_id and (args.source is None or not args.source.exists()):
+        parser.error("source introuvable")
+
+    if args.url:
+        stream = run_remote(args.url.rstrip("/"), args.source, args.batch_id, args.concurrency)
+    else:
+        base_dir = args.base_dir
+        if base_dir is None:
+            from app.core.server import storage_root
+            base_dir = storage_root()
+        stream = run_local(base_dir, args.source, args.batch_id, args.concurrency, args.rate)
+
+    out = args.out.open("a") if args.out else sys.stdout
+    failed = 0
+    try:
+        for event in stream:
+            out.write(json.dumps(event, ensure_ascii=False) + "\n")
+            out.flush()
+            if event.get("type") == "batch":
+                print(f"lot {event['batch_id']} : {event['total']} fichiers (reprise : --resume {event['batch_id']})", file=sys.stderr)
+            elif event.get("type") == "item":
+                failed += 0 if event.get("ok") else 1
+                print(f"[{event['progress']}/{event['total']}] {event['name']} {'ok' if event.get('ok') else 'KO ' + str(event.get('error'))}", file=sys.stderr)
+            elif event.get("type") == "error":
+                print(f"erreur : {event.get('error')}", file=sys.stderr)
+                failed += 1
+    except batch.BatchRejected as exc:
+        print(f"erreur : {exc}", file=sys.stderr)
+        failed += 1
+    finally:
+        if args.out:
+            out.close()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,106 @@
+import argparse
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from addons.intake import dedupe
+
+
+def synthetic_hashes(count: int, clustered: bool, seed: int = 7) -> List[int]:
+    rng = random.Random(seed)
+    if not clustered:
+        return [rng.getrandbits(64) for _ in range(count)]
+    # Real dHashes are far from uniform: receipts photographed on a table share most gradient bits.
+    templates = [rng.getrandbits(64) for _ in range(500)]
+    hashes = []
+    for _ in range(count):
+        value = rng.choice(templates)
+        for bit in rng.sample(range(64), rng.randint(4, 16)):
+            value ^= 1 << bit
+        hashes.append(value)
+    return hashes
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {"p50_ms": round(statistics.median(ordered) * 1000, 3), "p99_ms": round(ordered[int(0.99 * (len(ordered) - 1))] * 1000, 3)}
+
+
+def run(entries: int, queries: int, max_distance: int, clustered: bool) -> Dict[str, object]:
+    rng = random.Random(11)
+    hashes = synthetic_hashes(entries, clustered)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = dedupe.HashIndex()
+    start = time.perf_counter()
+    for rowid, value in enumerate(hashes, 1):
+        index.add(rowid, value)
+    build = time.perf_counter() - start
+    report: Dict[str, object] = {"entries": entries, "clustered": clustered, "max_distance": max_distance, "build_sec": round(build, 2)}
+    report["rss_mib"] = round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1)
+    # Half of the probes are near-duplicates of stored hashes, half are unseen receipts.
+    probes = []
+    for idx in range(queries):
+        value = rng.choice(hashes)
+        if idx % 2:
+            for bit in rng.sample(range(64), rng.randint(0, max_distance)):
+                value ^= 1 << bit
+        else:
+            value = synthetic_hashes(1, clustered, seed=idx + entries)[0]
+        probes.append(value)
+    samples, found = [], 0
+    for value in probes:
+        began = time.perf_counter()
+        found += bool(index.lookup(value, max_distance))
+        samples.append(time.perf_counter() - began)
+    report.update({f"lookup_{key}": value for key, value in _percentiles(samples).items()})
+    report["hit_rate"] = round(found / queries, 3)
+    # What a flat scan of every hash would cost per lookup.
+    began = time.perf_counter()
+    for value in probes[:5]:
+        [other for other in hashes if (other ^ value).bit_count() <= max_distance]
+    report["scan_ms"] = round((time.perf_counter() - began) / 5 * 1000, 1)
+    return report
+
+
+def run_store(entries: int) -> Dict[str, float]:
+    # Cold start of a worker: replaying the SQLite log into memory, then one lookup.
+    base_dir = Path(tempfile.mkdtemp(prefix="tz-dedupe-"))
+    store = dedupe.DuplicateIndex(base_dir / "dedupe.sqlite")
+    conn = store._conn()
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO phashes (source, hash, replaces, added_at) VALUES (?, ?, NULL, 0)", ((f"intake:t{idx}", dedupe._to_sql(value)) for idx, value in enumerate(synthetic_hashes(entries, False))))
+    conn.execute("COMMIT")
+    store.close()
+    store = dedupe.DuplicateIndex(base_dir / "dedupe.sqlite")
+    start = time.perf_counter()
+    store.stats()
+    load = time.perf_counter() - start
+    began = time.perf_counter()
+    store.add("intake:new", 0x0123456789ABCDEF)
+    add = time.perf_counter() - began
+    began = time.perf_counter()
+    store.lookup(0x0123456789ABCDEF, 6)
+    lookup = time.perf_counter() - began
+    store.close()
+    shutil.rmtree(base_dir, ignore_errors=True)
+    return {"store_load_sec": round(load, 2), "store_add_ms": round(add * 1000, 3), "store_lookup_ms": round(lookup * 1000, 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latence de l'index de doublons (hachage multi-index) face à un parcours complet")
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=dedupe.dedupe_config()["max_distance"])
+    parser.add_argument("--clustered", action="store_true", help="hachages regroupés autour de quelques centaines de modèles")
+    parser.add_argument("--store", action="store_true", help="mesure aussi le rechargement depuis SQLite")
+    args = parser.parse_args()
+    report = run(args.entries, args.queries, args.max_distance, args.clustered)
+    if args.store:
+        report.update(run_store(args.entries))
+    for key, value in report.items():
+        print(f"{key:18s} {value}")
@@ -0,0 +1,167 @@
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from addons.ocr import extract_fr, postprocess_fr
+from addons.ocr.providers import debug_capture
+
+ITEMS = ["PAIN COMPLET", "LAIT DEMI ECR", "BEURRE DOUX", "POMMES GALA", "CAFE MOULU", "YAOURT NAT X4", "JAMBON BLANC", "EAU MINERALE 6X1.5L", "CHOCOLAT NOIR", "PATES FUSILLI", "TOMATES GRAPPE", "FROMAGE RAPE"]
+MERCHANTS = ["NETTO", "E.LECLERC", "CARREFOUR MARKET", "LIDL", "MONOPRIX", "INTERMARCHE", "BOULANGERIE DU PORT"]
+TOTAL_LABELS = ["TOTAL", "TOTAL TTC", "NET A PAYER", "A PAYER", "MONTANT TTC", "TOTAL EUR"]
+
+
+def _fr(value: float, thousands: bool = True) -> str:
+    whole, cents = f"{value:.2f}".split(".")
+    if thousands and len(whole) > 3:
+        whole = f"{whole[:-3]} {whole[-3:]}"
+    return f"{whole},{cents}"
+
+
+def _date_text(day: date, rng: random.Random) -> str:
+    style = rng.randrange(4)
+    if style == 0:
+        return day.strftime("%d/%m/%Y")
+    if style == 1:
+        return day.strftime("%d/%m/%y")
+    if style == 2:
+        return day.strftime("%d.%m.%Y")
+    return day.strftime("%d-%m-%y")
+
+
+def synthetic_receipt(seed: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    rng = random.Random(seed)
+    day = date(2024, 1, 1) + timedelta(days=rng.randrange(600))
+    prices = [round(rng.uniform(0.5, 40 if rng.random() < 0.9 else 900), 2) for _ in range(rng.randint(1, 12))]
+    total = round(sum(prices), 2)
+    rows: List[str] = [rng.choice(MERCHANTS), f"{rng.randint(1, 200)} RUE DE LA GARE", f"{rng.randint(10, 95)}{rng.randint(100, 999)} VILLE"]
+    if rng.random() < 0.5:
+        rows.append(f"LE {_date_text(day, rng)} A {rng.randint(8, 20)}:{rng.randint(0, 59):02d}")
+    split_label = rng.random() < 0.4
+    for name, price in zip(rng.sample(ITEMS * 2, len(prices)), prices):
+        rows.append(f"{name} {_fr(price, thousands=False)}" if rng.random() < 0.7 else f"{rng.randint(1, 3)} x {name} {_fr(price, thousands=False)}")
+    if rng.random() < 0.4:
+        rows.append(f"SOUS-TOTAL {_fr(total)}")
+    if rng.random() < 0.3:
+        rows.append(f"REMISE FIDELITE -{_fr(round(rng.uniform(0.5, 3), 2))}")
+    label = rng.choice(TOTAL_LABELS)
+    if rng.random() < 0.1:
+        label = label.replace("O", "0").replace("A", "4", 1)
+    rows.extend([label, _fr(total)] if split_label else [f"{label} {_fr(total)} EUR"])
+    rows.append(f"TVA 5,5% {_fr(round(total * 0.052, 2))}")
+    if rng.random() < 0.6:
+        rows.append(f"CB {_fr(total)}")
+    else:
+        given = round(total + rng.uniform(1, 20), 0)
+        rows.extend([f"ESPECES {_fr(given)}", f"RENDU MONNAIE {_fr(round(given - total, 2))}"])
+    if rng.random() < 0.5:
+        rows.append(f"{_date_text(day, rng)} {rng.randint(8, 20)}:{rng.randint(0, 59):02d} CAISSE {rng.randint(1, 9)}")
+    else:
+        rows.append(f"DATE {_date_text(day, rng)}")
+    count = len(rows)
+    lines = []
+    y = 0.02
+    for idx, text in enumerate(rows):
+        if split_label and idx > 0 and rows[idx - 1] == label:
+            lines.append({"text": text, "y_norm": round(lines[-1]["y_norm"] + rng.uniform(-0.004, 0.004), 4), "page": 1})
+            continue
+        lines.append({"text": text, "y_norm": round(y, 4), "page": 1})
+        y += 0.95 / count
+    raw = {"fields": {}, "texts": "\n".join(rows), "meta": {"lines": lines}, "warnings": []}
+    return raw, {"total": total, "date": day.isoformat()}
+
+
+def load_corpus(path: Path) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    samples = []
+    for line in path.read_text().splitlines():
+        if line.strip():
+            record = json.loads(line)
+            samples.append((record["raw"], record["expected"]))
+    return samples
+
+
+def load_captures(archive_dir: Path) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    # Real OCR outputs from the debug archives, labelled with the fields of Azure's receipt model:
+    # the extractor never sees those fields, so they are held out from what it is scored on.
+    samples, seen = [], set()
+    for path in sorted(archive_dir.glob(f"{debug_capture.ARCHIVE_PREFIX}*{debug_capture.ARCHIVE_SUFFIX}")):
+        with gzip.open(path, "rt", encoding="utf-8") as handle:
+            for line in handle:
+                entry = json.loads(line)
+                normalized = (entry.get("payload") or {}).get("normalized") or {}
+                fields = normalized.get("fields") or {}
+                lines = (normalized.get("meta") or {}).get("lines") or []
+                total = postprocess_fr._parse_amount_fr(fields.get("total"))
+                if entry.get("error") or not lines or total is None or normalized.get("texts") in seen:
+                    continue
+                seen.add(normalized.get("texts"))
+                raw = {"fields": {}, "texts": normalized.get("texts", ""), "meta": {"lines": lines}, "warnings": []}
+                samples.append((raw, {"total": total, "date": postprocess_fr._parse_date(fields.get("date_achat"))}))
+    return samples
+
+
+def legacy(raw: Dict[str, Any]) -> Dict[str, Any]:
+    fields = raw.get("fields", {})
+    return {"total": postprocess_fr._parse_amount_fr(fields.get("total") or raw.get("texts")), "date": None if not fields.get("date_achat") else postprocess_fr._parse_date(fields.get("date_achat"))}
+
+
+def candidate(raw: Dict[str, Any]) -> Dict[str, Any]:
+    return extract_fr.extract(raw["meta"]["lines"], raw.get("texts", ""))
+
+
+def score(fn, corpus) -> Dict[str, Any]:
+    totals = dates = dated = 0
+    start = time.perf_counter()
+    outputs = [fn(raw) for raw, _ in corpus]
+    elapsed = time.perf_counter() - start
+    for output, (_, expected) in zip(outputs, corpus):
+        totals += output["total"] is not None and abs(output["total"] - expected["total"]) < 0.005
+        if expected.get("date"):
+            dated += 1
+            dates += output["date"] == expected["date"]
+    return {"total_acc": totals / len(corpus), "date_acc": dates / dated if dated else None, "per_sec": len(corpus) / elapsed}
+
+
+def _pct(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.1%}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Précision et débit de l'extraction total/date")
+    parser.add_argument("--corpus", type=Path, default=None, help='NDJSON {"raw": ..., "expected": {"total", "date"}} vérifié à la main')
+    parser.add_argument("--archives", type=Path, default=None, help="archives de captures OCR (défaut : <data>/debug, TZ_OCR_DEBUG_ARCHIVE=1)")
+    parser.add_argument("--export", type=Path, default=None, help="écrit le corpus tiré des archives en NDJSON, à relire avant de le passer à --corpus")
+    parser.add_argument("--synthetic", type=int, default=0, help="débit seul sur N reçus synthétiques (leur précision n'a pas de sens : ils suivent les motifs de l'extracteur)")
+    args = parser.parse_args()
+    if args.synthetic:
+        corpus = [synthetic_receipt(seed) for seed in range(args.synthetic)]
+        for name, fn in (("legacy", legacy), ("extract_fr", candidate)):
+            print(f"{name:11s} {score(fn, corpus)['per_sec']:,.0f} receipts/s")
+        sys.exit(0)
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        archive_dir = args.archives
+        if archive_dir is None:
+            from app.core.server import storage_root
+
+            archive_dir = storage_root() / "debug"
+        corpus = load_captures(archive_dir)
+        if args.export:
+            with args.export.open("w") as out:
+                for raw, expected in corpus:
+                    out.write(json.dumps({"raw": raw, "expected": expected}, ensure_ascii=False) + "\n")
+            print(f"{len(corpus)} captures écrites dans {args.export}")
+            sys.exit(0)
+    if not corpus:
+        print("Corpus vide : activer TZ_OCR_DEBUG_ARCHIVE=1 pour capturer des réponses OCR, ou passer --corpus")
+        sys.exit(1)
+    print(f"{len(corpus)} reçus")
+    for name, fn in (("legacy", legacy), ("extract_fr", candidate)):
+        result = score(fn, corpus)
+        print(f"{name:11s} total={_pct(result['total_acc'])} date={_pct(result['date_acc'])} {result['per_sec']:,.0f} receipts/s")
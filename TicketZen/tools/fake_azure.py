@@ -0,0 +1,203 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+RECEIPT_LINES: List[Tuple[str, str]] = [
+    ("CARREFOUR MARKET", ""),
+    ("12 rue de la Paix 75002 Paris", ""),
+    ("01/05/2024 10:32", ""),
+    ("PAIN DE MIE", "1,20"),
+    ("LAIT DEMI ECREME", "0,99"),
+    ("CAFE MOULU", "4,56"),
+    ("POULET FERMIER", "16,70"),
+    ("TOTAL TTC", "23,45"),
+    ("CB EMV", "23,45"),
+]
+RECEIPT_FIELDS = {"merchant": "Carrefour Market", "date": "01/05/2024", "total": "23,45"}
+ITEMS = [(name, price) for name, price in RECEIPT_LINES[3:7]]
+
+
+def _line_text(name: str, price: str) -> str:
+    return f"{name} {price}".strip()
+
+
+def v21_result() -> Dict[str, Any]:
+    height = 1000
+    lines = [
+        {"text": _line_text(name, price), "boundingBox": [10, 40 + idx * 60, 600, 40 + idx * 60, 600, 80 + idx * 60, 10, 80 + idx * 60]}
+        for idx, (name, price) in enumerate(RECEIPT_LINES)
+    ]
+    return {
+        "status": "succeeded",
+        "analyzeResult": {
+            "version": "2.1.0",
+            "readResults": [{"page": 1, "height": height, "width": 700, "lines": lines}],
+            "documentResults": [{
+                "docType": "prebuilt:receipt",
+                "fields": {
+                    "MerchantName": {"type": "string", "text": RECEIPT_FIELDS["merchant"]},
+                    "TransactionDate": {"type": "date", "text": RECEIPT_FIELDS["date"]},
+                    "Total": {"type": "number", "text": RECEIPT_FIELDS["total"], "valueNumber": 23.45},
+                    "Items": {"type": "array", "valueArray": [
+                        {"type": "object", "valueObject": {"Name": {"text": name}, "TotalPrice": {"text": price}}}
+                        for name, price in ITEMS
+                    ]},
+                },
+            }],
+        },
+    }
+
+
+def v4_result() -> Dict[str, Any]:
+    height = 11.0
+    lines = [
+        {"content": _line_text(name, price), "polygon": [0.2, 0.5 + idx * 0.6, 6.0, 0.5 + idx * 0.6, 6.0, 0.9 + idx * 0.6, 0.2, 0.9 + idx * 0.6]}
+        for idx, (name, price) in enumerate(RECEIPT_LINES)
+    ]
+    return {
+        "status": "succeeded",
+        "analyzeResult": {
+            "apiVersion": "2024-07-31",
+            "content": "\n".join(line["content"] for line in lines),
+            "pages": [{"pageNumber": 1, "height": height, "width": 8.5, "lines": lines}],
+            "documents": [{
+                "docType": "receipt.retailMeal",
+                "fields": {
+                    "MerchantName": {"type": "string", "content": RECEIPT_FIELDS["merchant"], "valueString": RECEIPT_FIELDS["merchant"]},
+                    "TransactionDate": {"type": "date", "content": RECEIPT_FIELDS["date"]},
+                    "Total": {"type": "currency", "content": RECEIPT_FIELDS["total"]},
+                    "Items": {"type": "array", "valueArray": [
+                        {"type": "object", "valueObject": {"Name": {"content": name}, "TotalPrice": {"content": price}}}
+                        for name, price in ITEMS
+                    ]},
+                },
+            }],
+        },
+    }
+
+
+class FakeAzure:
+    def __init__(self, latency: float = 1.0, jitter: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0, retry_after: Optional[float] = None, seed: Optional[int] = None, host: str = "127.0.0.1", port: int = 0, bytes_per_sec: Optional[float] = None, poll_error_rate: float = 0.0):
+        self.latency = latency
+        self.poll_error_rate = poll_error_rate
+        self.bytes_per_sec = bytes_per_sec
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.operations: Dict[str, Tuple[float, str]] = {}
+        self.counters = {"submits": 0, "polls": 0, "errors": 0, "poll_errors": 0, "throttled": 0, "bytes_in": 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAzure":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-azure", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _sample_latency(self) -> float:
+        return max(0.0, self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency)
+
+    def _submit(self, path: str, size: int) -> Tuple[int, Dict[str, str], Any]:
+        with self._lock:
+            self.counters["submits"] += 1
+            self.counters["bytes_in"] += size
+            roll = self.random.random()
+            if roll < self.error_rate:
+                self.counters["errors"] += 1
+                return 500, {}, {"error": {"code": "InternalServerError"}}
+            if roll < self.error_rate + self.throttle_rate:
+                self.counters["throttled"] += 1
+                return 429, {"Retry-After": "1"}, {"error": {"code": "429"}}
+            op_id = str(next(self._ids))
+            shape = "v21" if "/v2.1/" in path else "v4"
+            transfer = size / self.bytes_per_sec if self.bytes_per_sec else 0.0
+            self.operations[op_id] = (time.time() + self._sample_latency() + transfer, shape)
+        headers = {"Operation-Location": f"{self.url}/operations/{op_id}"}
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return 202, headers, None
+
+    def _poll(self, op_id: str) -> Tuple[int, Dict[str, str], Any]:
+        with self._lock:
+            self.counters["polls"] += 1
+            operation = self.operations.get(op_id)
+            if operation and self.random.random() < self.poll_error_rate:
+                self.counters["poll_errors"] += 1
+                return 503, {}, {"error": {"code": "ServiceUnavailable"}}
+        if not operation:
+            return 404, {}, {"error": {"code": "NotFound"}}
+        ready_at, shape = operation
+        if time.time() < ready_at:
+            return 200, {}, {"status": "running"}
+        return 200, {}, v21_result() if shape == "v21" else v4_result()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _reply(self, status: int, headers: Dict[str, str], body: Any):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                size = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(size)
+                if not self.headers.get("Ocp-Apim-Subscription-Key"):
+                    return self._reply(401, {}, {"error": {"code": "401"}})
+                self._reply(*fake._submit(self.path, size))
+
+            def do_GET(self):
+                if not self.path.startswith("/operations/"):
+                    return self._reply(404, {}, {"error": {"code": "NotFound"}})
+                self._reply(*fake._poll(self.path.rsplit("/", 1)[-1].split("?")[0]))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faux serveur Azure Document Intelligence (202 + Operation-Location)")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.5)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--poll-error-rate", type=float, default=0.0, help="part des interrogations répondues en 503")
+    parser.add_argument("--bytes-per-sec", type=float, default=None, help="débit simulé : ajoute taille/débit à la latence")
+    args = parser.parse_args()
+    fake = FakeAzure(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate, port=args.port, bytes_per_sec=args.bytes_per_sec, poll_error_rate=args.poll_error_rate)
+    print(f"Fake Azure listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
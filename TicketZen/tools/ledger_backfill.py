@@ -0,0 +1,50 @@
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+from addons.intake import batch, ledger
+
+
+def iter_results(base_dir: Path, counts: Dict[str, int]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for result_path in sorted((base_dir / "intake").glob("*/result.json")):
+        try:
+            result = json.loads(result_path.read_text())
+        except ValueError:
+            counts["skipped"] += 1
+            continue
+        yield f"intake:{result_path.parent.name}", result
+    for manifest_path in sorted((base_dir / "batches").glob("*/batch.json")):
+        batch_id = manifest_path.parent.name
+        for index, item in sorted(batch.load_results(base_dir, batch_id).items()):
+            if item.get("ok") and item.get("result"):
+                yield f"batch:{batch_id}:{index}", item["result"]
+
+
+def backfill(base_dir: Path, dry_run: bool = False) -> dict:
+    book = ledger.get_ledger(base_dir)
+    counts = {"sources": 0, "recorded": 0, "reversed": 0, "skipped": 0}
+    for source, result in iter_results(base_dir, counts):
+        counts["sources"] += 1
+        if dry_run:
+            counts["recorded"] += len(ledger.expense_rows(result))
+            continue
+        outcome = book.record(source, result)
+        counts["recorded"] += outcome["recorded"]
+        counts["reversed"] += outcome["reversed"]
+    if not dry_run:
+        counts["rollups_rebuilt"] = book.rebuild_rollups()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Alimente le registre des dépenses (ledger.sqlite) à partir des result.json existants")
+    parser.add_argument("--base-dir", type=Path, default=None, help="racine des données (défaut : storage_root())")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    base_dir = args.base_dir
+    if base_dir is None:
+        from app.core.server import storage_root
+
+        base_dir = storage_root()
+    print(f"{base_dir}: {backfill(base_dir, dry_run=args.dry_run)}")
@@ -0,0 +1,65 @@
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from addons.intake import ledger
+
+MERCHANTS = [("Carrefour", "supermarché"), ("Fnac", "électronique"), ("Big M", "restauration"), ("Leroy Merlin", "bricolage"), ("Pharmacie du Centre", "santé"), ("Total", "carburant")]
+
+
+def receipt(rng: random.Random) -> dict:
+    merchant, category = rng.choice(MERCHANTS)
+    day = date(2022, 1, 1) + timedelta(days=rng.randrange(3 * 365))
+    return {"merchant": merchant, "category": category, "date": day.isoformat(), "total": round(rng.uniform(1, 250), 2)}
+
+
+def _timed(fn, repeat: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - start) / repeat * 1000, 3)
+
+
+def run(receipts: int, corrections: float, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    base_dir = Path(tempfile.mkdtemp(prefix="tz-ledger-"))
+    book = ledger.Ledger(base_dir / "ledger.sqlite")
+    start = time.perf_counter()
+    for idx in range(receipts):
+        book.record(f"intake:t{idx}", receipt(rng))
+    for idx in rng.sample(range(receipts), int(receipts * corrections)):
+        book.record(f"intake:t{idx}", receipt(rng))
+    write_elapsed = time.perf_counter() - start
+    conn = book._conn()
+    report = {
+        "receipts": receipts,
+        "records_per_sec": round(receipts * (1 + corrections) / write_elapsed),
+        "ledger_entries": conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0],
+        "rollup_month_ms": _timed(lambda: book.rollup("month")),
+        "rollup_category_ms": _timed(lambda: book.rollup("category")),
+        "rollup_month_category_ms": _timed(lambda: book.rollup("category", month="2023-06")),
+        "summary_ms": _timed(lambda: book.summary()),
+        # What the dashboard would cost without rollups: a scan of every live expense.
+        "scan_category_ms": _timed(lambda: conn.execute("SELECT e.category, COUNT(*), SUM(e.total_cents) FROM live l JOIN entries e ON e.id = l.entry_id GROUP BY e.category").fetchall(), repeat=3),
+        "page_first_ms": _timed(lambda: book.expenses(limit=50)),
+    }
+    cursor = book.expenses(limit=50)["next_cursor"]
+    for _ in range(100):
+        cursor = book.expenses(limit=50, cursor=cursor)["next_cursor"]
+    report["page_deep_ms"] = _timed(lambda: book.expenses(limit=50, cursor=cursor))
+    book.close()
+    shutil.rmtree(base_dir, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coût des requêtes du tableau de bord : agrégats précalculés vs parcours du registre")
+    parser.add_argument("--receipts", type=int, default=100000)
+    parser.add_argument("--corrections", type=float, default=0.05, help="part des tickets réanalysés (contre-passation + nouvelle écriture)")
+    args = parser.parse_args()
+    for key, value in run(args.receipts, args.corrections).items():
+        print(f"{key:26s} {value}")
@@ -0,0 +1,234 @@
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+from PIL import Image, ImageDraw
+from werkzeug.serving import make_server
+
+from tools.fake_azure import FakeAzure
+
+LOGGER = logging.getLogger("ticketzen.loadtest")
+
+ENDPOINTS = ("refresh_pin", "mobile_page", "upload", "analyze", "status")
+
+
+def receipt_image(seed: int) -> bytes:
+    # Chaque ticket est unique pour ne jamais toucher le cache OCR.
+    rng = random.Random(seed)
+    img = Image.new("RGB", (600, 900), (245, 243, 238))
+    draw = ImageDraw.Draw(img)
+    for row in range(40, 860, 40):
+        draw.rectangle((30, row, 30 + rng.randint(100, 540), row + 18), fill=(40, 40, 40))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        # Receipts whose analyze call was refused at least once (queue full), and the refusals themselves.
+        self.throttled = {"receipts": 0, "refusals": 0}
+        self.end_to_end: List[float] = []
+        self._lock = threading.Lock()
+
+    def call(self, endpoint: str, fn, *args, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            response = fn(*args, **kwargs)
+        except requests.RequestException as exc:
+            LOGGER.debug("%s failed: %s", endpoint, exc)
+            response = None
+        elapsed = time.perf_counter() - start
+        failed = response is None or response.status_code not in (200, 304) or (response.status_code == 200 and response.headers.get("Content-Type", "").startswith("application/json") and response.json().get("ok") is False)
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if failed:
+                self.errors[endpoint] += 1
+        return response
+
+    def refused(self, first: bool):
+        with self._lock:
+            self.throttled["refusals"] += 1
+            self.throttled["receipts"] += first
+
+    def finish(self, outcome: str, elapsed: Optional[float] = None):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            if elapsed is not None:
+                self.end_to_end.append(elapsed)
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(pct: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000, 1)
+
+    return {"count": len(ordered), "p50_ms": pick(50), "p90_ms": pick(90), "p99_ms": pick(99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def phone(url: str, images: List[bytes], recorder: Recorder, poll_interval: float, receipt_timeout: float):
+    session = requests.Session()
+    for image in images:
+        response = recorder.call("refresh_pin", session.get, f"{url}/refresh_pin", timeout=30)
+        if response is None or response.status_code != 200:
+            recorder.finish("error")
+            continue
+        pin = response.json()["pin"]
+        recorder.call("mobile_page", session.get, f"{url}/m/{pin}", timeout=30)
+        started = time.perf_counter()
+        response = recorder.call("upload", session.post, f"{url}/api/intake/{pin}/upload", files={"file": ("ticket.jpg", image, "image/jpeg")}, timeout=60)
+        if response is None or not response.json().get("ok"):
+            recorder.finish("error")
+            continue
+        refusals = 0
+        while True:
+            response = recorder.call("analyze", session.post, f"{url}/api/intake/{pin}/analyze", timeout=30)
+            if response is None:
+                break
+            payload = response.json()
+            if payload.get("ok") or "Retry-After" not in response.headers:
+                break
+            recorder.refused(refusals == 0)
+            refusals += 1
+            time.sleep(float(response.headers["Retry-After"]))
+        if response is None or not response.json().get("ok"):
+            recorder.finish("error")
+            continue
+        # Même comportement que le téléphone : sondage conditionnel avec l'ETag du dernier statut.
+        etag = None
+        state = None
+        while time.perf_counter() - started < receipt_timeout:
+            time.sleep(poll_interval)
+            headers = {"If-None-Match": etag} if etag else {}
+            response = recorder.call("status", session.get, f"{url}/api/intake/{pin}/status", headers=headers, timeout=30)
+            if response is None or response.status_code == 304:
+                continue
+            etag = response.headers.get("ETag")
+            state = response.json().get("state")
+            if state in ("done", "error"):
+                break
+        recorder.finish(state if state in ("done", "error") else "timeout", time.perf_counter() - started)
+
+
+def prepare_env(workdir: Path, fake: FakeAzure, args: argparse.Namespace):
+    # create_app lit sa configuration dans l'environnement : tout pointe vers le faux Azure et un HOME jetable.
+    os.environ.update({
+        "HOME": str(workdir),
+        "LOCALAPPDATA": str(workdir),
+        "AZURE_DI_ENDPOINT": fake.url,
+        "AZURE_DI_KEY": "loadtest",
+        "AZURE_DI_ROUTE": args.route,
+        "AZURE_DI_TIMEOUT_SEC": str(args.azure_timeout),
+        "OCR_DRY_RUN": "0",
+        "TICKETZEN_OCR_CLOUD_ENABLED": "1",
+        "TZ_OCR_STRATEGY": "cloud",
+        "TZ_OCR_WORKERS": str(args.workers),
+        "TZ_OCR_QUEUE_MAX": str(args.queue_max),
+    })
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = Path(tempfile.mkdtemp(prefix="tz-loadtest-"))
+    fake = FakeAzure(latency=args.azure_latency, jitter=args.azure_jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate, seed=args.seed).start()
+    prepare_env(workdir, fake, args)
+    from addons.intake import jobs
+    from app.core.server import create_app
+
+    app = create_app()
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-app", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    images = [receipt_image(args.seed * 100000 + idx) for idx in range(args.clients * args.receipts)]
+    recorder = Recorder()
+    crashed = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            futures = []
+            for client in range(args.clients):
+                futures.append(pool.submit(phone, url, images[client * args.receipts:(client + 1) * args.receipts], recorder, args.poll_interval, args.receipt_timeout))
+                if args.ramp:
+                    time.sleep(args.ramp / args.clients)
+            for future in futures:
+                exc = future.exception()
+                if exc is not None:
+                    crashed += 1
+                    LOGGER.error("Simulated phone crashed: %r", exc)
+        duration = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        queue = jobs.get_queue()
+        if queue is not None:
+            queue.shutdown(drain=False, timeout=5)
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # A crashed phone leaves its remaining receipts unaccounted for: they count as errors.
+    missing = len(images) - sum(recorder.outcomes.values())
+    if missing > 0:
+        recorder.outcomes["error"] += missing
+    requests_total = sum(len(values) for values in recorder.latencies.values())
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        calls = len(recorder.latencies[endpoint])
+        endpoints[endpoint] = {**_percentiles(recorder.latencies[endpoint]), "errors": recorder.errors[endpoint], "error_rate": round(recorder.errors[endpoint] / calls, 4) if calls else 0.0}
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "report"},
+        "duration_sec": round(duration, 2),
+        "receipts": dict(recorder.outcomes),
+        "throttled": recorder.throttled,
+        "crashed_clients": crashed,
+        "receipts_per_sec": round(recorder.outcomes["done"] / duration, 2),
+        "requests_per_sec": round(requests_total / duration, 1),
+        "end_to_end": _percentiles(recorder.end_to_end),
+        "endpoints": endpoints,
+        "fake_azure": dict(fake.counters),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne : application Flask + faux Azure, parcours complet du scanner")
+    parser.add_argument("--clients", type=int, default=20, help="téléphones simulés en parallèle")
+    parser.add_argument("--receipts", type=int, default=3, help="tickets envoyés par téléphone")
+    parser.add_argument("--ramp", type=float, default=2.0, help="secondes pour démarrer tous les téléphones")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--receipt-timeout", type=float, default=120.0)
+    parser.add_argument("--workers", type=int, default=4, help="TZ_OCR_WORKERS")
+    parser.add_argument("--queue-max", type=int, default=32, help="TZ_OCR_QUEUE_MAX")
+    parser.add_argument("--route", default="documentintelligence", choices=["documentintelligence", "formrecognizer", "formrecognizer_v21"])
+    parser.add_argument("--azure-latency", type=float, default=1.5)
+    parser.add_argument("--azure-jitter", type=float, default=0.3)
+    parser.add_argument("--azure-timeout", type=int, default=30)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--report", type=Path, default=None, help="écrit le rapport JSON dans ce fichier")
+    args = parser.parse_args()
+    # Les refus « file pleine » sont attendus sous charge : ils sont comptés dans le rapport, pas journalisés.
+    logging.basicConfig(level=logging.ERROR, format="%(levelname)s %(name)s: %(message)s")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True, default=str)
+    if args.report:
+        args.report.write_text(text + "\n")
+    print(text)
+    sys.exit(0 if report["receipts"].get("done") and not report["crashed_clients"] else 1)
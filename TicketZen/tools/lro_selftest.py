@@ -0,0 +1,45 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from addons.ocr.providers import azure_client, poller
+from tools.fake_azure import FakeAzure
+
+logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+LOGGER = logging.getLogger("ticketzen.lro_selftest")
+
+CONCURRENCY = 20
+
+
+def _config(endpoint, route, timeout=10):
+    return {"endpoint": endpoint, "key": "test", "route": route, "timeout": timeout, "cloud_enabled": True, "dry_run": False}
+
+
+if __name__ == "__main__":
+    fake = FakeAzure(latency=1.2, jitter=0.3, seed=7).start()
+    for route in ["documentintelligence", "formrecognizer", "formrecognizer_v21"]:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            results = list(pool.map(lambda _: azure_client.analyze_document(b"img", "image/jpeg", _config(fake.url, route), LOGGER), range(CONCURRENCY)))
+        merchants = {res["fields"].get("merchant") for res in results}
+        ok = merchants == {"Carrefour Market"} and all(f"azure_route={route}" in res["warnings"] for res in results)
+        print(f"{'OK' if ok else 'KO'}: {route} x{CONCURRENCY} in {time.time() - start:.2f}s (submits={fake.counters['submits']}, polls={fake.counters['polls']})")
+    print(f"{'OK' if poller.get_poller().in_flight() == 0 else 'KO'}: no operation left in flight")
+
+    flaky = FakeAzure(latency=1.0, poll_error_rate=0.25, seed=3).start()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        results = list(pool.map(lambda _: azure_client.analyze_document(b"img", "image/jpeg", _config(flaky.url, "documentintelligence"), LOGGER), range(CONCURRENCY)))
+    ok = all("azure_route=documentintelligence" in res["warnings"] for res in results) and flaky.counters["submits"] == CONCURRENCY
+    # A failed poll is retried: the accepted analysis is kept, nothing is resubmitted.
+    print(f"{'OK' if ok else 'KO'}: flaky polls x{CONCURRENCY} in {time.time() - start:.2f}s (submits={flaky.counters['submits']}, poll_errors={flaky.counters['poll_errors']})")
+    flaky.stop()
+
+    slow = FakeAzure(latency=30).start()
+    start = time.time()
+    result = azure_client.analyze_document(b"img", "image/jpeg", {**_config(slow.url, "documentintelligence", timeout=2)}, LOGGER)
+    elapsed = time.time() - start
+    # The 2s budget covers every route: no fallback gets a fresh one.
+    print(f"{'OK' if elapsed < 4 and 'azure_all_failed' in result['warnings'] else 'KO'}: timeout cancels polling after {elapsed:.2f}s (submits={slow.counters['submits']})")
+    fake.stop()
+    slow.stop()
@@ -0,0 +1,102 @@
+import argparse
+import random
+import re
+import statistics
+import string
+import time
+from typing import Any, Dict, List, Optional
+
+from rapidfuzz import fuzz
+
+from addons.knowledge import merchants
+from addons.knowledge.matcher import MerchantMatcher
+
+WORDS = ["super", "marché", "boulangerie", "pharmacie", "garage", "bricolage", "cave", "primeur", "tabac", "presse", "café", "bistrot", "optique", "fleurs", "boucherie", "maison", "jardin", "sport", "mode", "beauté"]
+CITIES = ["lyon", "paris", "nantes", "lille", "rennes", "brest", "nice", "metz", "dijon", "tours", "caen", "pau", "albi", "laval", "niort"]
+
+
+def legacy_resolve(merchant_list: List[Dict[str, Any]], candidate: Optional[str]) -> Optional[str]:
+    if not candidate:
+        return None
+    normalized = candidate.strip().lower()
+    best_match = None
+    best_score = 0
+    for merchant in merchant_list:
+        canonical = merchant.get("name")
+        for pattern in merchant.get("regex", []):
+            if re.search(pattern, candidate, re.IGNORECASE):
+                return canonical
+        for alias in merchant.get("aliases", []) + [canonical]:
+            score = fuzz.token_sort_ratio(normalized, alias.lower())
+            if score > best_score:
+                best_score = score
+                best_match = canonical
+    if best_score > 60:
+        return best_match
+    return candidate
+
+
+def synthetic_merchants(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    base = list(merchants.DATA.get("merchants", []))
+    generated = []
+    for idx in range(max(0, count - len(base))):
+        brand = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+        name = f"{brand.capitalize()} {rng.choice(WORDS).capitalize()} {rng.choice(CITIES).capitalize()} {idx}"
+        regex = [f"{brand} {idx}"] if rng.random() < 0.8 else [rf"\b{brand}\s?{idx}\b"]
+        generated.append({"name": name, "aliases": [name.upper(), f"{brand} {idx}"], "regex": regex, "default_category": rng.choice(WORDS)})
+    return (base + generated)[:count]
+
+
+def queries(merchant_list: List[Dict[str, Any]], count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    samples = ["E LECLERC", "gamm vert", "Big M", "carrefour city", "SARL DUPONT ET FILS", "TICKET CLIENT"]
+    for _ in range(count):
+        merchant = rng.choice(merchant_list)
+        name = merchant["name"]
+        kind = rng.random()
+        if kind < 0.4:
+            samples.append(name.upper())
+        elif kind < 0.7:
+            chars = list(name)
+            chars[rng.randrange(len(chars))] = rng.choice(string.ascii_letters)
+            samples.append("".join(chars))
+        else:
+            samples.append(" ".join(rng.choice(WORDS) for _ in range(3)))
+    return samples
+
+
+def _time(fn, samples: List[str]) -> List[float]:
+    timings = []
+    for sample in samples:
+        start = time.perf_counter()
+        fn(sample)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latence de resolve_merchant selon la taille de merchants.yml")
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-max", type=int, default=10000, help="taille max pour la boucle historique (lente)")
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        merchant_list = synthetic_merchants(size)
+        samples = queries(merchant_list, args.queries)
+        start = time.perf_counter()
+        matcher = MerchantMatcher(merchant_list)
+        build = time.perf_counter() - start
+        fast = _time(matcher.resolve, samples)
+        line = f"{size:>7} merchants  build={build * 1000:8.1f}ms  p50={statistics.median(fast) * 1e6:8.0f}us  p95={statistics.quantiles(fast, n=20)[-1] * 1e6:8.0f}us"
+        if size <= args.legacy_max:
+            legacy = _time(lambda sample: legacy_resolve(merchant_list, sample), samples)
+            agree = sum(matcher.resolve(sample) == legacy_resolve(merchant_list, sample) for sample in samples)
+            line += f"  legacy p50={statistics.median(legacy) * 1e6:10.0f}us  agree={agree}/{len(samples)}"
+        elif matcher._grams:
+            exact = MerchantMatcher(merchant_list, blocking_min=len(matcher._aliases) + 1)
+            unblocked = _time(exact.resolve, samples)
+            agree = sum(matcher.resolve(sample) == exact.resolve(sample) for sample in samples)
+            line += f"  unblocked p50={statistics.median(unblocked) * 1e6:8.0f}us  agree={agree}/{len(samples)}"
+        print(line)
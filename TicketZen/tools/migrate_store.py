@@ -0,0 +1,23 @@
+import argparse
+from pathlib import Path
+
+from addons.intake import store as intake_store
+
+
+def migrate(base_dir: Path, dry_run: bool = False) -> dict:
+    # The store imports the folders by itself on first start; this reruns the import on demand.
+    target = intake_store.SQLiteStore(base_dir / "intake.sqlite")
+    return target.import_legacy(base_dir, dry_run=dry_run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importe les dossiers intake/<token>/status.json dans intake.sqlite")
+    parser.add_argument("--base-dir", type=Path, default=None, help="racine des données (défaut : storage_root())")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    base_dir = args.base_dir
+    if base_dir is None:
+        from app.core.server import storage_root
+
+        base_dir = storage_root()
+    print(f"{base_dir}: {migrate(base_dir, dry_run=args.dry_run)}")
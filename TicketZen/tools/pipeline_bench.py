@@ -0,0 +1,199 @@
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from addons.ocr import postprocess_fr
+from addons.ocr.providers import azure_client
+
+DEFAULT_BASELINE = Path(__file__).with_name("pipeline_baseline.json")
+FIELDS = ("merchant", "date", "total", "category")
+# (texte imprimé en tête, enseigne attendue, catégorie attendue)
+MERCHANTS = [
+    ("NETTO", "Netto", "supermarché"),
+    ("E.LECLERC", "E.Leclerc", "supermarché"),
+    ("CARREFOUR MARKET", "Carrefour", "supermarché"),
+    ("LIDL", "Lidl", "discount"),
+    ("MONOPRIX", "Monoprix", "supermarché"),
+    ("INTERMARCHE", "Intermarché", "supermarché"),
+    ("GAMM VERT", "Gamm Vert", "jardin"),
+    ("FNAC", "Fnac", "électronique"),
+    ("DECATHLON", "Decathlon", "sport"),
+    ("BIG M", "Big M", "restauration"),
+]
+ITEMS = ["PAIN DE MIE", "LAIT DEMI ECREME", "CAFE MOULU", "POULET FERMIER", "YAOURT NATURE", "EAU MINERALE", "PILES AA", "TERREAU 40L", "CHAUSSETTES"]
+
+
+def _fr(value: float) -> str:
+    return f"{value:.2f}".replace(".", ",")
+
+
+def synthetic_record(seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    printed, merchant, category = rng.choice(MERCHANTS)
+    day = date(2024, 1, 1) + timedelta(days=rng.randrange(600))
+    items = [(rng.choice(ITEMS), round(rng.uniform(0.5, 60), 2)) for _ in range(rng.randint(1, 15))]
+    total = round(sum(price for _, price in items), 2)
+    rows = [printed, f"{rng.randint(1, 200)} rue de la Paix", f"{day:%d/%m/%Y} {rng.randint(8, 20)}:{rng.randint(0, 59):02d}"]
+    rows += [f"{name} {_fr(price)}" for name, price in items]
+    rows += [f"TOTAL TTC {_fr(total)}", f"TVA 5,5% {_fr(round(total * 0.052, 2))}", f"CB EMV {_fr(total)}"]
+    # Azure ne renvoie pas toujours les champs : l'enseigne, le total ou la date doivent alors venir des lignes.
+    fields = {
+        "merchant": printed if rng.random() > 0.3 else None,
+        "date": f"{day:%d/%m/%Y}" if rng.random() > 0.2 else None,
+        "total": _fr(total) if rng.random() > 0.2 else None,
+    }
+    shape = "v21" if rng.random() < 0.5 else "v4"
+    raw = _v21(rows, fields, items) if shape == "v21" else _v4(rows, fields, items)
+    return {"shape": shape, "raw": raw, "expected": {"merchant": merchant, "date": day.isoformat(), "total": total, "category": category}}
+
+
+def _v21(rows: List[str], fields: Dict[str, Any], items: List[Tuple[str, float]]) -> Dict[str, Any]:
+    lines = [{"text": text, "boundingBox": [10, 40 + idx * 60, 600, 40 + idx * 60, 600, 80 + idx * 60, 10, 80 + idx * 60]} for idx, text in enumerate(rows)]
+    document = {"Items": {"type": "array", "valueArray": [{"type": "object", "valueObject": {"Name": {"text": name}, "TotalPrice": {"text": _fr(price)}}} for name, price in items]}}
+    if fields["merchant"]:
+        document["MerchantName"] = {"type": "string", "text": fields["merchant"]}
+    if fields["date"]:
+        document["TransactionDate"] = {"type": "date", "text": fields["date"]}
+    if fields["total"]:
+        document["Total"] = {"type": "number", "text": fields["total"]}
+    return {"status": "succeeded", "analyzeResult": {"version": "2.1.0", "readResults": [{"page": 1, "height": 40 + len(rows) * 60, "width": 700, "lines": lines}], "documentResults": [{"docType": "prebuilt:receipt", "fields": document}]}}
+
+
+def _v4(rows: List[str], fields: Dict[str, Any], items: List[Tuple[str, float]]) -> Dict[str, Any]:
+    lines = [{"content": text, "polygon": [0.2, 0.5 + idx * 0.6, 6.0, 0.5 + idx * 0.6, 6.0, 0.9 + idx * 0.6, 0.2, 0.9 + idx * 0.6]} for idx, text in enumerate(rows)]
+    document = {"Items": {"type": "array", "valueArray": [{"type": "object", "valueObject": {"Name": {"content": name}, "TotalPrice": {"content": _fr(price)}}} for name, price in items]}}
+    if fields["merchant"]:
+        document["MerchantName"] = {"type": "string", "content": fields["merchant"], "valueString": fields["merchant"]}
+    if fields["date"]:
+        document["TransactionDate"] = {"type": "date", "content": fields["date"]}
+    if fields["total"]:
+        document["Total"] = {"type": "currency", "content": fields["total"]}
+    return {"status": "succeeded", "analyzeResult": {"apiVersion": "2024-07-31", "content": "\n".join(rows), "pages": [{"pageNumber": 1, "height": 1.0 + len(rows) * 0.6, "width": 8.5, "lines": lines}], "documents": [{"docType": "receipt.retailMeal", "fields": document}]}}
+
+
+def load_corpus(path: Path) -> List[Dict[str, Any]]:
+    # NDJSON {"raw": <réponse Azure enregistrée>, "expected": {"merchant", "date", "total", "category"}} ou dossier de *.json du même format.
+    if path.is_dir():
+        return [json.loads(item.read_text()) for item in sorted(path.glob("*.json"))]
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def normalize(raw: Dict[str, Any]) -> Dict[str, Any]:
+    if (raw.get("analyzeResult") or {}).get("readResults") is not None:
+        return azure_client._normalize_v21(raw)
+    return azure_client._normalize_azure(raw)
+
+
+def process(raw: Dict[str, Any]) -> Dict[str, Any]:
+    return postprocess_fr.normalize_result(normalize(raw))
+
+
+def _matches(field: str, got: Any, expected: Any) -> bool:
+    if field == "total":
+        return got is not None and expected is not None and abs(float(got) - float(expected)) < 0.005
+    return got == expected
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(corpus: List[Dict[str, Any]], rounds: int = 3) -> Dict[str, Any]:
+    for record in corpus[:50]:
+        process(record["raw"])
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for record in corpus:
+            began = time.perf_counter()
+            process(record["raw"])
+            latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    hits = {field: 0 for field in FIELDS}
+    misses: List[Dict[str, Any]] = []
+    # Start from a collected heap so the peak does not depend on garbage left by imports.
+    gc.collect()
+    tracemalloc.start()
+    for record in corpus:
+        result = process(record["raw"])
+        expected = record["expected"]
+        wrong = [field for field in FIELDS if field in expected and not _matches(field, result.get(field), expected[field])]
+        for field in FIELDS:
+            hits[field] += field not in wrong
+        if wrong:
+            misses.append({"expected": expected, "got": {field: result.get(field) for field in FIELDS}, "fields": wrong})
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "receipts": len(corpus),
+        "receipts_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "accuracy": {field: round(hits[field] / len(corpus), 4) for field in FIELDS},
+        "misses": misses,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for field in FIELDS:
+        before = baseline.get("accuracy", {}).get(field)
+        after = report["accuracy"][field]
+        if before is not None and after < before - 0.001:
+            regressions.append(f"précision {field}: {before:.2%} -> {after:.2%}")
+    if baseline.get("receipts_per_sec") and report["receipts_per_sec"] < baseline["receipts_per_sec"] * (1 - tolerance):
+        regressions.append(f"débit: {baseline['receipts_per_sec']} -> {report['receipts_per_sec']} reçus/s")
+    if baseline.get("p99_ms") and report["p99_ms"] > baseline["p99_ms"] * (1 + tolerance):
+        regressions.append(f"p99: {baseline['p99_ms']} -> {report['p99_ms']} ms")
+    if baseline.get("peak_kib") and report["peak_kib"] > baseline["peak_kib"] * (1 + tolerance):
+        regressions.append(f"mémoire: {baseline['peak_kib']} -> {report['peak_kib']} KiB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rejeu hors ligne de réponses OCR enregistrées : débit, latence, mémoire et précision par champ")
+    parser.add_argument("--corpus", type=Path, default=None, help="NDJSON ou dossier de *.json (défaut : corpus synthétique v2.1 + v4)")
+    parser.add_argument("--count", type=int, default=2000, help="taille du corpus synthétique")
+    parser.add_argument("--record", type=Path, default=None, help="écrit le corpus synthétique en NDJSON puis quitte")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre ce résultat comme nouvelle référence")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="écart relatif toléré sur débit, p99 et mémoire")
+    parser.add_argument("--show-misses", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.record:
+        with args.record.open("w") as out:
+            for seed in range(args.count):
+                out.write(json.dumps(synthetic_record(seed), ensure_ascii=False) + "\n")
+        print(f"{args.count} reçus écrits dans {args.record}")
+        sys.exit(0)
+
+    corpus = load_corpus(args.corpus) if args.corpus else [synthetic_record(seed) for seed in range(args.count)]
+    report = run(corpus, args.rounds)
+    misses = report.pop("misses")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    for miss in misses[: args.show_misses]:
+        print("---", json.dumps(miss, ensure_ascii=False))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({**report, "corpus": str(args.corpus or f"synthetic:{args.count}")}, ensure_ascii=False, indent=2) + "\n")
+        print(f"Référence enregistrée dans {args.baseline}")
+        sys.exit(0)
+    if not args.baseline.exists():
+        print("Pas de référence : lancer avec --save-baseline pour en créer une")
+        sys.exit(0)
+    regressions = compare(report, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"RÉGRESSION {regression}")
+    print("KO" if regressions else "OK")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,100 @@
+import argparse
+import io
+import logging
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from addons.ocr import preprocess
+from addons.ocr.providers import azure_client
+from tools.fake_azure import FakeAzure
+
+LOGGER = logging.getLogger("ticketzen.preprocess_bench")
+
+
+def synthetic_photo(seed: int, size: Tuple[int, int] = (4032, 3024)) -> bytes:
+    rng = random.Random(seed)
+    img = Image.effect_noise(size, 40).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", size, (90, 70, 50)), 0.6)
+    draw = ImageDraw.Draw(img)
+    left, top = rng.randint(600, 1200), rng.randint(100, 300)
+    right, bottom = left + rng.randint(1300, 1700), size[1] - rng.randint(100, 300)
+    draw.rectangle((left, top, right, bottom), fill=(245, 243, 238))
+    for row in range(top + 60, bottom - 60, 70):
+        width = rng.randint(400, right - left - 120)
+        draw.rectangle((left + 60, row, left + 60 + width, row + 28), fill=(40, 40, 40))
+    img = img.filter(ImageFilter.GaussianBlur(1.2))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def load_corpus(corpus: Path, count: int) -> List[Tuple[str, bytes]]:
+    if corpus and corpus.exists():
+        files = sorted(p for p in corpus.iterdir() if p.suffix.lower() in preprocess.IMAGE_SUFFIXES)
+        return [(p.name, p.read_bytes()) for p in files[:count]]
+    return [(f"synthetic_{idx}.jpg", synthetic_photo(idx)) for idx in range(count)]
+
+
+def rotation_costs(content: bytes, rounds: int = 5) -> Dict[str, float]:
+    # Ancien /rotate (décodage, rotation, réencodage) face à l'orientation EXIF sans perte et à l'aperçu réduit.
+    def _legacy():
+        out = io.BytesIO()
+        Image.open(io.BytesIO(content)).rotate(-90, expand=True).save(out, format="JPEG")
+
+    def _preview():
+        img = Image.open(io.BytesIO(content))
+        img.draft("RGB", (preprocess.PREVIEW_SIDE, preprocess.PREVIEW_SIDE))
+        img.thumbnail((preprocess.PREVIEW_SIDE, preprocess.PREVIEW_SIDE), Image.BICUBIC, reducing_gap=2.0)
+        img.rotate(-90, expand=True).save(io.BytesIO(), format="JPEG", quality=80)
+
+    costs = {}
+    for name, action in (("reencode", _legacy), ("exif_lossless", lambda: preprocess.orient_jpeg(content, 270)), ("preview", _preview)):
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            action()
+            samples.append(time.perf_counter() - start)
+        costs[name] = statistics.median(samples) * 1000
+    return costs
+
+
+def _analyze(fake: FakeAzure, content: bytes) -> float:
+    config = {"endpoint": fake.url, "key": "bench", "route": "documentintelligence", "timeout": 60, "cloud_enabled": True}
+    start = time.time()
+    azure_client.analyze_document(content, "image/jpeg", config, LOGGER)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Octets envoyés et latence OCR avant/après prétraitement")
+    parser.add_argument("--corpus", type=Path, default=None, help="dossier d'images (défaut : photos synthétiques 12 Mpx)")
+    parser.add_argument("--count", type=int, default=8)
+    parser.add_argument("--uplink-mbps", type=float, default=8.0, help="débit montant simulé vers Azure")
+    parser.add_argument("--latency", type=float, default=0.8, help="latence OCR simulée hors transfert")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    settings = {key: value for key, value in preprocess.preprocess_config().items() if key != "enabled"}
+    fake = FakeAzure(latency=args.latency, bytes_per_sec=args.uplink_mbps * 1e6 / 8).start()
+    rows = []
+    for name, original in load_corpus(args.corpus, args.count):
+        t0 = time.time()
+        prepared = preprocess.prepare_image(original, **settings)
+        prep_time = time.time() - t0
+        before = _analyze(fake, original)
+        after = prep_time + _analyze(fake, prepared)
+        rows.append((name, len(original), len(prepared), prep_time, before, after))
+        print(f"{name:24s} {len(original) / 1e6:7.2f} MB -> {len(prepared) / 1e6:6.2f} MB  prep={prep_time * 1000:6.0f}ms  e2e {before:5.2f}s -> {after:5.2f}s")
+    fake.stop()
+    if rows:
+        total_before = sum(row[1] for row in rows)
+        total_after = sum(row[2] for row in rows)
+        print(f"bytes sent: {total_before / 1e6:.1f} MB -> {total_after / 1e6:.1f} MB ({100 * (1 - total_after / total_before):.0f}% less)")
+        print(f"e2e median: {statistics.median(r[4] for r in rows):.2f}s -> {statistics.median(r[5] for r in rows):.2f}s")
+        costs = rotation_costs(load_corpus(args.corpus, 1)[0][1])
+        print("rotation: " + "  ".join(f"{name}={value:.1f}ms" for name, value in costs.items()))
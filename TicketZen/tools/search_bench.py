@@ -0,0 +1,92 @@
+import argparse
+import random
+import shutil
+import statistics
+import string
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+from addons.intake import search
+
+MERCHANTS = [("Darty", "électronique"), ("Fnac", "électronique"), ("Boulanger", "électronique"), ("Carrefour", "supermarché"), ("E.Leclerc", "supermarché"), ("Monoprix", "supermarché"), ("Lidl", "discount"), ("Decathlon", "sport"), ("Leroy Merlin", "bricolage"), ("Big M", "restauration"), ("Pharmacie du Centre", "santé"), ("Gamm Vert", "jardin")]
+NOUNS = ["téléviseur", "câble", "chargeur", "casque", "lave-linge", "réfrigérateur", "café", "pain", "lait", "yaourt", "poulet", "fromage", "chaussettes", "raquette", "ballon", "perceuse", "vis", "terreau", "rosier", "doliprane", "shampooing", "cahier", "stylo", "piles", "ampoule"]
+ADJECTIVES = ["noir", "blanc", "bio", "fermier", "grand", "petit", "premium", "écran", "sans fil", "4k", "demi écrémé", "moulu", "lot de 3", "inox", "rechargeable"]
+QUERIES = [
+    ("merchant", "darty", {}),
+    ("prefix", "darty télé", {}),
+    ("typo_merchant", "drty televiseur", {}),
+    ("typo_item", "televisuer", {}),
+    ("typo_item_recent", "televisuer", {"sort": "recent"}),
+    ("words_filtered", "café moulu", {"date_from": "2024-01-01", "date_to": "2024-06-30", "total_min": 5}),
+    ("filters_only", "", {"category": "électronique", "date_from": "2024-03-01", "date_to": "2024-03-31"}),
+]
+
+
+def synthetic_result(rng: random.Random) -> Dict[str, Any]:
+    merchant, category = rng.choice(MERCHANTS)
+    day = date(2023, 1, 1) + timedelta(days=rng.randrange(730))
+    lignes = [{"name": f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)}".upper(), "price": f"{rng.uniform(0.5, 400):.2f}".replace(".", ",")} for _ in range(rng.randint(1, 12))]
+    # OCR noise and reference numbers make up most of a real vocabulary.
+    noise = ["".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(rng.randint(4, 9))) for _ in range(rng.randint(2, 6))]
+    texts = "\n".join([merchant.upper(), f"{rng.randint(1, 300)} rue {rng.choice(NOUNS)}", day.strftime("%d/%m/%Y")] + [f"{line['name']} {line['price']}" for line in lignes] + noise + ["TOTAL TTC"])
+    total = round(rng.uniform(2, 900), 2)
+    return {"merchant": merchant, "category": category, "date": day.isoformat(), "total": total, "header": merchant.upper(), "lignes": lignes, "texts": texts}
+
+
+def _timed(fn, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def run(receipts: int, repeat: int, seed: int = 11) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    base_dir = Path(tempfile.mkdtemp(prefix="tz-search-"))
+    index = search.SearchIndex(base_dir / "search.sqlite", vocab_refresh_sec=3600)
+    started = time.perf_counter()
+    for idx in range(receipts):
+        index.index(f"intake:t{idx}", synthetic_result(rng))
+    index_elapsed = time.perf_counter() - started
+    index.optimize()
+    vocab_ms = _timed(index.vocabulary, 1)[0]
+    report: Dict[str, Any] = {
+        "receipts": receipts,
+        "indexed_per_sec": round(receipts / index_elapsed),
+        "db_mib": round(sum(path.stat().st_size for path in base_dir.iterdir()) / 1024 / 1024, 1),
+        "vocabulary": len(index.vocabulary().terms),
+        "vocab_load_ms": round(vocab_ms, 1),
+        "queries": {},
+    }
+    for name, text, filters in QUERIES:
+        found = index.search(text, limit=20, **filters)
+        samples = sorted(_timed(lambda: index.search(text, limit=20, **filters), repeat))
+        report["queries"][name] = {
+            "q": text,
+            "hits": len(found["items"]),
+            "top": found["items"][0]["merchant"] if found["items"] else None,
+            "expanded": found["expanded"],
+            "p50_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(samples[int(0.95 * (len(samples) - 1))], 2),
+        }
+    index.close()
+    shutil.rmtree(base_dir, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latence de la recherche plein texte (FTS5, préfixes, fautes de frappe) sur un corpus synthétique")
+    parser.add_argument("--receipts", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    report = run(args.receipts, args.repeat)
+    for key, value in report.items():
+        if key != "queries":
+            print(f"{key:16s} {value}")
+    for name, stats in report["queries"].items():
+        print(f"{name:16s} {stats}")
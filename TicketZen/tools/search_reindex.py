@@ -0,0 +1,30 @@
+import argparse
+import time
+from pathlib import Path
+
+from addons.intake import search
+from tools.ledger_backfill import iter_results
+
+
+def reindex(base_dir: Path) -> dict:
+    index = search.get_index(base_dir)
+    counts = {"indexed": 0, "skipped": 0}
+    started = time.time()
+    for source, result in iter_results(base_dir, counts):
+        index.index(source, result)
+        counts["indexed"] += 1
+    index.optimize()
+    counts["took_ms"] = round((time.time() - started) * 1000, 1)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit l'index de recherche (search.sqlite) à partir des result.json existants")
+    parser.add_argument("--base-dir", type=Path, default=None, help="racine des données (défaut : storage_root())")
+    args = parser.parse_args()
+    base_dir = args.base_dir
+    if base_dir is None:
+        from app.core.server import storage_root
+
+        base_dir = storage_root()
+    print(f"{base_dir}: {reindex(base_dir)}")
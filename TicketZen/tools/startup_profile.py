@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+# Modules that must stay out of the import path and only load on first use or during warm-up.
+LAZY_MODULES = ["requests", "PIL", "yaml", "rapidfuzz", "addons.ocr.providers.azure_client", "addons.knowledge.matcher"]
+
+MARKER = "--- startup done"
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app.core.server as server
+imported = time.perf_counter()
+app = server.create_app(start_queue=False, warmup_mode="off")
+created = time.perf_counter()
+sys.stderr.write("%s\\n")
+eager = [name for name in %r if name in sys.modules]
+from app.core import warmup
+status = warmup.warmup(app.config["DATA_ROOT"])
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000, "warmup_ms": status["took_ms"], "warmup_steps": status["steps"], "eager": eager}))
+""" % (MARKER, LAZY_MODULES)
+
+
+def run_probe() -> Dict[str, Any]:
+    home = tempfile.mkdtemp(prefix="tz-startup-")
+    env = {**os.environ, "HOME": home, "LOCALAPPDATA": home, "PYTHONPATH": str(ROOT)}
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=home, env=env, capture_output=True, text=True, check=True)
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    startup, _, warm = completed.stderr.partition(MARKER)
+    # Whatever `site` pulls in (.pth hooks) is interpreter startup, not ours.
+    startup = startup.split("| site\n", 1)[-1]
+    report["modules"] = parse_importtime(startup)
+    report["warmup_modules"] = parse_importtime(warm)
+    return report
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, raw_name = line[len("import time:"):].split("|", 2)
+        name = raw_name.strip()
+        modules.append({"module": name, "depth": (len(raw_name) - len(raw_name.lstrip()) - 1) // 2, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return modules
+
+
+def _median_by_module(runs: List[Dict[str, Any]], key: str, keep) -> Dict[str, float]:
+    per_module: Dict[str, List[float]] = {}
+    for run in runs:
+        for module in run[key]:
+            if keep(module["module"]):
+                per_module.setdefault(module["module"], []).append(module["cumulative_ms"])
+    return {name: round(statistics.median(values), 1) for name, values in per_module.items()}
+
+
+def _top(values: Dict[str, float], top: int) -> Dict[str, float]:
+    return dict(sorted(values.items(), key=lambda item: -item[1])[:top])
+
+
+def summarize(runs: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    def is_package(name: str) -> bool:
+        return "." not in name and name not in ("app", "addons")
+
+    def is_own(name: str) -> bool:
+        return name.split(".")[0] in ("app", "addons")
+
+    return {
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "create_app_ms": round(statistics.median(run["create_app_ms"] for run in runs), 1),
+        "warmup_ms": round(statistics.median(run["warmup_ms"] for run in runs), 1),
+        "warmup_steps": runs[-1]["warmup_steps"],
+        "eager_lazy_modules": runs[-1]["eager"],
+        "startup_packages": _top(_median_by_module(runs, "modules", is_package), top),
+        "ticketzen_modules": _top(_median_by_module(runs, "modules", is_own), top),
+        "warmup_packages": _top(_median_by_module(runs, "warmup_modules", is_package), top),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Temps d'import par module et coût du démarrage (create_app, warm-up)")
+    parser.add_argument("--repeat", type=int, default=3, help="nombre d'interpréteurs neufs (médiane)")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None, help="échec si l'import de app.core.server dépasse ce temps")
+    parser.add_argument("--json", type=Path, default=None, help="écrit le rapport JSON dans ce fichier")
+    args = parser.parse_args()
+    report = summarize([run_probe() for _ in range(max(1, args.repeat))], args.top)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.json:
+        args.json.write_text(text + "\n")
+    print(text)
+    failures = [f"module chargé au démarrage : {name}" for name in report["eager_lazy_modules"]]
+    if args.budget_ms is not None and report["import_ms"] > args.budget_ms:
+        failures.append(f"import {report['import_ms']}ms > budget {args.budget_ms}ms")
+    for failure in failures:
+        print(f"KO: {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,62 @@
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from addons.intake import store as intake_store
+
+RESULT = {"merchant": "Carrefour", "date": "2024-05-01", "total": 23.45, "lignes": [{"name": "Pain", "price": "1,20"}] * 8, "category": "supermarché"}
+
+
+def _writer(backend: str, base_dir: str, worker: int, ops: int):
+    store = intake_store.make_store(Path(base_dir), backend)
+    for idx in range(ops):
+        token = f"w{worker}-{idx % 50}"
+        store.set_status(token, intake_store.status_payload("analyzing", 50))
+        store.set_status(token, intake_store.status_payload("done", 100, result=RESULT))
+
+
+def _reader(backend: str, base_dir: str, ops: int):
+    store = intake_store.make_store(Path(base_dir), backend)
+    for idx in range(ops):
+        store.get_status(f"w0-{idx % 50}")
+
+
+def run(backend: str, writers: int, ops: int, use_processes: bool) -> dict:
+    base_dir = tempfile.mkdtemp(prefix=f"tz-store-{backend}-")
+    intake_store.make_store(Path(base_dir), backend)
+    spawn = multiprocessing.Process if use_processes else threading.Thread
+    workers = [spawn(target=_writer, args=(backend, base_dir, idx, ops)) for idx in range(writers)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    write_elapsed = time.time() - start
+    start = time.time()
+    _reader(backend, base_dir, ops * 2)
+    read_elapsed = time.time() - start
+    store = intake_store.make_store(Path(base_dir), backend)
+    start = time.time()
+    listed = store.list_intakes(states=["done"], limit=1000)
+    list_elapsed = time.time() - start
+    shutil.rmtree(base_dir, ignore_errors=True)
+    return {
+        "writes_per_sec": round(writers * ops * 2 / write_elapsed),
+        "reads_per_sec": round(ops * 2 / read_elapsed),
+        "list_done_ms": round(list_elapsed * 1000, 2),
+        "listed": len(listed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Débit lecture/écriture des statuts : fichiers JSON vs SQLite WAL")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="transitions par écrivain")
+    parser.add_argument("--processes", action="store_true", help="écrivains en processus plutôt qu'en threads")
+    args = parser.parse_args()
+    for backend in ("file", "sqlite"):
+        print(f"{backend:7s} {run(backend, args.writers, args.ops, args.processes)}")
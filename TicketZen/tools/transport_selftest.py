@@ -0,0 +1,51 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from addons.ocr.providers import transport
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    failures = {"/flaky": 2, "/throttled": 1}
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        remaining = self.failures.get(self.path, 0)
+        if remaining:
+            self.failures[self.path] = remaining - 1
+            if self.path == "/throttled":
+                return self._reply(429, {"error": "throttled"}, {"Retry-After": "0"})
+            return self._reply(503, {"error": "unavailable"})
+        return self._reply(200, {"ok": True, "path": self.path})
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    client = transport.Transport(pool_size=2, retries=3, backoff=0.01, backoff_max=0.05)
+    for path in ["/ok", "/flaky", "/throttled", "/ok"]:
+        resp = client.request("POST", base + path, data=b"x", read_timeout=5)
+        status = "OK" if resp.status_code == 200 else "KO"
+        print(f"{status}: {path} -> {resp.status_code}")
+    opened = client._opened_connections(base)
+    print(f"{'OK' if opened == 1 else 'KO'}: connections opened = {opened}")
+    server.shutdown()
@@ -0,0 +1,9 @@
+import logging
+
+from app.core.server import create_app
+
+logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s")
+
+# The OCR queue is started per worker (gunicorn.conf.py post_fork, or lazily on the first /analyze)
+# and the warm-up runs in the master (when_ready): threads started here would not survive the fork.
+app = create_app(start_queue=False, warmup_mode="off")